@@ -7,23 +7,37 @@
 
 """
 Action overrides
+
+With dry_run set in the context, the harvest actions map, refine, validate and convert records to Metax catalog
+records as usual, but write nothing to Metax, the CKAN database or the harvest journal. The outcome they would
+have had, eg. would_create or unchanged, is added to the DryRunSummary in context['dry_run_summary'] instead of
+the harvest metrics. See dry_run.
 """
 
+import functools
 import logging
+import sqlite3
 import uuid
 
 from requests import HTTPError
 from requests.exceptions import ReadTimeout
 
 import ckanext.etsin.metax_api as metax_api
+import ckanext.etsin.journal as journal
+import ckanext.etsin.metrics as metrics
+import ckanext.etsin.profiling as profiling
+import ckanext.etsin.timing as timing
 from ckanext.etsin.refine import refine
-from ckanext.etsin.utils import convert_to_metax_catalog_record
+from ckanext.etsin.utils import convert_to_metax_catalog_record, get_oaipmh_identifier
 
 import ckan.model as model
 import ckan.logic.action.create
 import ckan.logic.action.update
+import ckan.logic.action.delete
 from ckan.lib.navl.validators import not_empty
-from ckanext.etsin.exceptions import DatasetFieldsMissingError
+from ckanext.harvest.model import HarvestObject
+from ckanext.etsin.exceptions import DatasetFieldsMissingError, ResearchDatasetInvalidError
+from ckanext.etsin.validation import validate_research_dataset
 
 log = logging.getLogger(__name__)
 
@@ -33,6 +47,41 @@ package_schema = {
 }
 
 
+def _timed_action(stage):
+    """
+    Time the action and the stages inside it for the harvest source of the context, and profile it if the
+    record is sampled for profiling.
+    """
+    def decorate(action):
+        @functools.wraps(action)
+        def wrapper(context, data_dict):
+            harvest_source_name = context.get('harvest_source_name', None)
+            with timing.source(harvest_source_name):
+                try:
+                    with timing.timer(stage), \
+                            profiling.profile(stage, harvest_source_name, lambda: _record_guid(context, data_dict)):
+                        return action(context, data_dict)
+                finally:
+                    timing.record_finished()
+        return wrapper
+    return decorate
+
+
+def _record_guid(context, data_dict):
+    return context.get('guid') or data_dict.get('preferred_identifier') or data_dict.get('id')
+
+
+def _harvest_object_guid(context):
+    """
+    :return: guid of the harvest object of the record: set by the ISO 19139 mapper, or the OAI-PMH identifier
+    """
+    if context.get('guid'):
+        return context['guid']
+    if context.get('source_data', None) is not None and hasattr(context['source_data'], 'getroottree'):
+        return get_oaipmh_identifier(context['source_data'])
+    return None
+
+
 def _create_catalog_record_to_metax(context, metax_rd_dict):
     """
 
@@ -49,12 +98,14 @@ def _create_catalog_record_to_metax(context, metax_rd_dict):
         try:
             log.info("Trying to create a catalog record (CR) to MetaX having preferred_identifier {0}"
                      .format(pref_id))
-            md = convert_to_metax_catalog_record(metax_rd_dict, context)
+            with timing.timer('convert_to_metax_catalog_record'):
+                md = convert_to_metax_catalog_record(metax_rd_dict, context)
             log.info("Payload to be sent to MetaX: {0}".format(md))
             metax_cr_id = metax_api.create_catalog_record(md)
             log.info("Successfully created a CR to MetaX. Returned CR identifier: %s", metax_cr_id)
         except HTTPError as e:
             log.info("Trying to PUT the CR in case it already existed in Metax..")
+            metrics.inc('etsin_metax_retries_total', {'operation': 'create_catalog_record'})
             metax_cr_id = metax_api.get_catalog_record_identifier_using_preferred_identifier(pref_id)
             if not metax_cr_id:
                 log.info("Unable to find CR having preferred identifier {0} from Metax".format(pref_id))
@@ -81,6 +132,7 @@ def _create_catalog_record_to_metax(context, metax_rd_dict):
     return metax_cr_id
 
 
+@_timed_action('action.package_create')
 def package_create(context, metax_rd_dict):
     """
     Refines metax_rd_dict further with harvester source specific refiners. Calls MetaX API to create a new dataset.
@@ -98,26 +150,43 @@ def package_create(context, metax_rd_dict):
         # Create the package_id for the package dict
         ckan_package_id = unicode(uuid.uuid4())
 
-        # Refine metax_rd_dict based on organization it belongs to
+        # Refine metax_rd_dict based on organization it belongs to and check it before sending it anywhere
         try:
             metax_rd_dict = refine(context, metax_rd_dict)
             if not metax_rd_dict:
+                _count_outcome(context, journal.ACTION_CREATE, 'skipped')
                 return False
-        except DatasetFieldsMissingError as e:
+            with timing.timer('validate_research_dataset'):
+                validate_research_dataset(metax_rd_dict)
+        except (DatasetFieldsMissingError, ResearchDatasetInvalidError) as e:
             log.error(e)
+            _count_outcome(context, journal.ACTION_CREATE, 'invalid', error=e)
             return False
 
+        if context.get('dry_run'):
+            return _dry_run_outcome(context, journal.ACTION_CREATE, 'would_create', metax_rd_dict)
+
+        _journal_step(context, ckan_package_id, journal.ACTION_CREATE, journal.STEP_BEGIN,
+                      preferred_identifier=metax_rd_dict.get('preferred_identifier', None),
+                      guid=_harvest_object_guid(context))
+
         # Creating catalog record to MetaX should return catalog record identifier
         metax_cr_id = _create_catalog_record_to_metax(context, metax_rd_dict)
         if not metax_cr_id:
+            _journal_step(context, ckan_package_id, journal.ACTION_CREATE, journal.STEP_ABORTED)
+            _count_outcome(context, journal.ACTION_CREATE, 'failed')
             return False
 
+        _journal_step(context, ckan_package_id, journal.ACTION_CREATE, journal.STEP_METAX_DONE,
+                      metax_cr_id=metax_cr_id)
+
         # Create the package to CKAN database linking ckan_package_id and metax_cr_id together
         context['schema'] = package_schema
         log.info("Trying to create package to CKAN database with ID: %s and name: %s", ckan_package_id, metax_cr_id)
         data_dict = _get_data_dict_for_ckan_db(ckan_package_id, metax_cr_id)
         try:
-            output = ckan.logic.action.create.package_create(context, data_dict)
+            with timing.timer('ckan.package_create'):
+                output = ckan.logic.action.create.package_create(context, data_dict)
         except Exception as e:
             log.error("Unable to package_create package. Trying to package_update..")
             try:
@@ -125,7 +194,10 @@ def package_create(context, metax_rd_dict):
             except Exception as e:
                 log.error(e)
                 log.error("Unable to package_update package. Aborting")
+                _count_outcome(context, journal.ACTION_CREATE, 'failed')
                 return False
+        _journal_step(context, ckan_package_id, journal.ACTION_CREATE, journal.STEP_DONE, metax_cr_id=metax_cr_id)
+        _count_outcome(context, journal.ACTION_CREATE, 'created')
         log.info("Created package to CKAN database successfully with ID: %s and name: %s", ckan_package_id, metax_cr_id)
     else:
         output = ckan.logic.action.create.package_create(context, metax_rd_dict)
@@ -133,6 +205,7 @@ def package_create(context, metax_rd_dict):
     return output
 
 
+@_timed_action('action.package_update')
 def package_update(context, metax_rd_dict):
     """
     Refines metax_rd_dict further with harvester source specific refiners. Call MetaX API to update an existing dataset.
@@ -152,15 +225,20 @@ def package_update(context, metax_rd_dict):
 
         if not ckan_package_id:
             log.error("Package id not found in package_update from data_dict. Aborting..")
+            _count_outcome(context, journal.ACTION_UPDATE, 'failed')
             return False
 
-        # Refine metax_rd_dict based on organization it belongs to
+        # Refine metax_rd_dict based on organization it belongs to and check it before sending it anywhere
         try:
             metax_rd_dict = refine(context, metax_rd_dict)
             if not metax_rd_dict:
+                _count_outcome(context, journal.ACTION_UPDATE, 'skipped')
                 return False
-        except DatasetFieldsMissingError as e:
+            with timing.timer('validate_research_dataset'):
+                validate_research_dataset(metax_rd_dict)
+        except (DatasetFieldsMissingError, ResearchDatasetInvalidError) as e:
             log.error(e)
+            _count_outcome(context, journal.ACTION_UPDATE, 'invalid', error=e)
             return False
 
         # Get MetaX catalog record identifier from CKAN database by searching for a package with given ckan_package_id
@@ -180,20 +258,31 @@ def package_update(context, metax_rd_dict):
             # Check whether the dataset has been modified
             if (existing_dataset_modified == incoming_dataset_modified):
                 log.info("Dataset %s unchanged. Parameter 'modified' is the same. Skipping...", metax_cr_id)
+                _count_outcome(context, journal.ACTION_UPDATE, 'unchanged')
                 return False
 
+            if context.get('dry_run'):
+                return _dry_run_outcome(context, journal.ACTION_UPDATE, 'would_update', metax_rd_dict, metax_cr_id)
+
             # If the dataset has actually been altered, proceed...
+            _journal_step(context, ckan_package_id, journal.ACTION_UPDATE, journal.STEP_BEGIN,
+                          preferred_identifier=pref_id, metax_cr_id=metax_cr_id)
             try:
                 log.info("Trying to update catalog record (CR) to MetaX having CR identifier: %s", metax_cr_id)
-                metax_api.update_catalog_record(metax_cr_id, convert_to_metax_catalog_record(metax_rd_dict,
-                                                                                             context, metax_cr_id))
+                with timing.timer('convert_to_metax_catalog_record'):
+                    md = convert_to_metax_catalog_record(metax_rd_dict, context, metax_cr_id)
+                metax_api.update_catalog_record(metax_cr_id, md)
                 log.info("Successfully updated CR to MetaX!")
             except HTTPError as e:
                 log.error("Failed to update CR to MetaX having CR identifier {0} for a "
                           "CKAN package ID: {1}, error: {2}".format(metax_cr_id, ckan_package_id, repr(e)))
+                _journal_step(context, ckan_package_id, journal.ACTION_UPDATE, journal.STEP_ABORTED)
+                _count_outcome(context, journal.ACTION_UPDATE, 'failed')
                 return False
             except ReadTimeout as e:
                 log.error("Connection timeout: {0}".format(repr(e)))
+                _journal_step(context, ckan_package_id, journal.ACTION_UPDATE, journal.STEP_ABORTED)
+                _count_outcome(context, journal.ACTION_UPDATE, 'failed')
                 return False
         else:
             # CR does not exist in Metax even though it has been stored to local CKAN database
@@ -202,14 +291,27 @@ def package_update(context, metax_rd_dict):
                         "exists in CKAN database with id {1}".format(metax_cr_id, ckan_package_id))
             log.info("Trying to recreate (or update) package to MetaX and update package name into CKAN database "
                      "with a new MetaX CR identifier value")
+            if context.get('dry_run'):
+                return _dry_run_outcome(context, journal.ACTION_UPDATE, 'would_update', metax_rd_dict)
+            _journal_step(context, ckan_package_id, journal.ACTION_UPDATE, journal.STEP_BEGIN,
+                          preferred_identifier=metax_rd_dict.get('preferred_identifier', None))
             metax_cr_id = _create_catalog_record_to_metax(context, metax_rd_dict)
             if not metax_cr_id:
+                _journal_step(context, ckan_package_id, journal.ACTION_UPDATE, journal.STEP_ABORTED)
+                _count_outcome(context, journal.ACTION_UPDATE, 'failed')
                 return False
 
+        _journal_step(context, ckan_package_id, journal.ACTION_UPDATE, journal.STEP_METAX_DONE,
+                      metax_cr_id=metax_cr_id)
+
         # Update the package into CKAN database
         context['schema'] = package_schema
         log.info("Trying to update package to CKAN database with ID: %s and name: %s", ckan_package_id, metax_cr_id)
-        output = ckan.logic.action.update.package_update(context, _get_data_dict_for_ckan_db(ckan_package_id, metax_cr_id))
+        with timing.timer('ckan.package_update'):
+            output = ckan.logic.action.update.package_update(context,
+                                                             _get_data_dict_for_ckan_db(ckan_package_id, metax_cr_id))
+        _journal_step(context, ckan_package_id, journal.ACTION_UPDATE, journal.STEP_DONE, metax_cr_id=metax_cr_id)
+        _count_outcome(context, journal.ACTION_UPDATE, 'updated')
         log.info("Updated package to CKAN database successfully with ID: %s and name: %s", ckan_package_id, metax_cr_id)
     else:
         output = ckan.logic.action.update.package_update(context, metax_rd_dict)
@@ -217,6 +319,7 @@ def package_update(context, metax_rd_dict):
     return output
 
 
+@_timed_action('action.package_delete')
 def package_delete(context, data_dict):
     """
     Calls MetaX API to delete a dataset.
@@ -234,11 +337,19 @@ def package_delete(context, data_dict):
 
         if not ckan_package_id:
             log.error("Package id not found in package_delete from data_dict. Aborting..")
+            _count_outcome(context, journal.ACTION_DELETE, 'failed')
             return False
 
         # Get Metax catalog record identifier from CKAN database
         metax_cr_id = _get_metax_id_from_ckan_db(ckan_package_id)
 
+        if context.get('dry_run'):
+            _count_outcome(context, journal.ACTION_DELETE, 'would_delete')
+            package_dict = _get_data_dict_for_ckan_db(ckan_package_id, metax_cr_id)
+            return package_dict['id'] if return_id_only else package_dict
+
+        _journal_step(context, ckan_package_id, journal.ACTION_DELETE, journal.STEP_BEGIN, metax_cr_id=metax_cr_id)
+
         if metax_api.check_catalog_record_exists(metax_cr_id):
             try:
                 log.info("Trying to delete catalog record (CR) from MetaX having MetaX CR identifier: %s", metax_cr_id)
@@ -247,20 +358,30 @@ def package_delete(context, data_dict):
             except HTTPError:
                 log.error("Failed to delete package from MetaX for a CR having CKAN package ID: %s and "
                           "MetaX CR identifier: %s", ckan_package_id, metax_cr_id)
+                _journal_step(context, ckan_package_id, journal.ACTION_DELETE, journal.STEP_ABORTED)
+                _count_outcome(context, journal.ACTION_DELETE, 'failed')
                 return False
             except ReadTimeout as e:
                 log.error("Connection timeout: {0}".format(repr(e)))
+                _journal_step(context, ckan_package_id, journal.ACTION_DELETE, journal.STEP_ABORTED)
+                _count_outcome(context, journal.ACTION_DELETE, 'failed')
                 return False
         else:
             log.warning("CR with identifier {0} was not found from MetaX even though it exists in "
                         "CKAN database with id {1}".format(metax_cr_id, ckan_package_id))
             log.info("Skipping delete operation in MetaX")
 
+        _journal_step(context, ckan_package_id, journal.ACTION_DELETE, journal.STEP_METAX_DONE,
+                      metax_cr_id=metax_cr_id)
+
         package_dict = _get_data_dict_for_ckan_db(ckan_package_id, metax_cr_id)
         log.info("Trying to delete package from CKAN database with ID: %s and name: %s", ckan_package_id, metax_cr_id)
-        package_dict = ckan.logic.action.delete.package_delete(context, package_dict)
+        with timing.timer('ckan.package_delete'):
+            package_dict = ckan.logic.action.delete.package_delete(context, package_dict)
+        _journal_step(context, ckan_package_id, journal.ACTION_DELETE, journal.STEP_DONE, metax_cr_id=metax_cr_id)
         log.info("Successfully deleted package from CKAN database with ID: %s and name: %s",
                  ckan_package_id, metax_cr_id)
+        _count_outcome(context, journal.ACTION_DELETE, 'deleted')
     else:
         package_dict = ckan.logic.action.delete.package_delete(context, data_dict)
 
@@ -281,3 +402,172 @@ def _get_data_dict_for_ckan_db(package_id, metax_id):
         'name': metax_id
     }
 
+
+
+def _count_outcome(context, action, outcome, error=None):
+    if context.get('dry_run'):
+        # A dry run is not counted in the harvest metrics
+        summary = context.get('dry_run_summary', None)
+        if summary is not None:
+            summary.add(outcome, context.get('guid', None), error)
+        return
+    metrics.record_harvest_outcome(context.get('harvest_source_name', None), action, outcome)
+
+
+def _dry_run_outcome(context, action, outcome, metax_rd_dict, metax_cr_id=None):
+    """
+    Convert a refined and validated record to a Metax catalog record without sending it anywhere.
+
+    :return: the catalog record, or False if it could not be converted
+    """
+    with timing.timer('convert_to_metax_catalog_record'):
+        catalog_record = convert_to_metax_catalog_record(metax_rd_dict, context, metax_cr_id)
+    if not catalog_record:
+        _count_outcome(context, action, 'invalid', error='Unable to convert to a Metax catalog record')
+        return False
+    _count_outcome(context, action, outcome)
+    return catalog_record
+
+
+def _journal_step(context, package_id, action, step, **kwargs):
+    """
+    Write a step of a harvest action to the harvest journal, if journaling is enabled.
+    A failing journal write is logged but does not stop the harvest.
+    """
+    harvest_journal = journal.get_journal()
+    if harvest_journal is None or context.get('dry_run'):
+        return
+    try:
+        harvest_journal.record(package_id, action, step,
+                               harvest_source_name=context.get('harvest_source_name', None), **kwargs)
+    except sqlite3.Error as e:
+        log.error("Unable to write step {0} of {1} for package {2} to harvest journal: {3}"
+                  .format(step, action, package_id, repr(e)))
+
+
+def resume_journaled_actions(harvest_journal, get_context):
+    """
+    Finish or roll back harvest actions that were left half-done according to the harvest journal.
+
+    Actions whose Metax side was done are finished by doing only the CKAN database part. For actions that
+    stopped before Metax answered, Metax is checked for whether the request landed:
+
+    * a create is finished if Metax has a catalog record with the journaled preferred identifier
+    * an update is finished if its catalog record, or one with the journaled preferred identifier, exists
+    * a delete is finished if its catalog record no longer exists in Metax
+
+    Otherwise nothing was changed and the action is rolled back; the next harvest will redo it. Finishing a
+    create also makes a harvest object of the record current for the package, as the harvester would have.
+
+    :param harvest_journal: HarvestJournal to resume
+    :param get_context: function returning a fresh CKAN action context for the 'harvest' user
+    :return: dictionary with counts of finished, rolled back and failed actions
+    """
+    summary = {'finished': 0, 'rolled_back': 0, 'failed': 0}
+
+    for entry in harvest_journal.pending():
+        context = get_context()
+        context['harvest_source_name'] = entry.harvest_source_name
+        metax_cr_id = entry.metax_cr_id
+
+        try:
+            if entry.step == journal.STEP_BEGIN:
+                metax_cr_id = _find_landed_catalog_record(entry)
+                if not metax_cr_id:
+                    log.info("Rolling back {0} of package {1}".format(entry.action, entry.package_id))
+                    _journal_step(context, entry.package_id, entry.action, journal.STEP_ABORTED)
+                    summary['rolled_back'] += 1
+                    continue
+
+            log.info("Finishing {0} of package {1} having MetaX CR identifier {2}"
+                     .format(entry.action, entry.package_id, metax_cr_id))
+            _finish_ckan_db_action(context, entry.action, entry.package_id, metax_cr_id)
+            if entry.action == journal.ACTION_CREATE:
+                _link_harvest_object(entry.harvest_source_name, _journaled_guid(harvest_journal, entry),
+                                     entry.package_id)
+        except Exception as e:
+            log.error("Unable to finish {0} of package {1}: {2}".format(entry.action, entry.package_id, repr(e)))
+            summary['failed'] += 1
+            continue
+
+        _journal_step(context, entry.package_id, entry.action, journal.STEP_DONE, metax_cr_id=metax_cr_id)
+        summary['finished'] += 1
+
+    return summary
+
+
+def _find_landed_catalog_record(entry):
+    """
+    Check whether the Metax request of an action journaled only up to its begin step landed.
+
+    :param entry: JournalEntry at STEP_BEGIN
+    :return: the catalog record identifier to finish the action with, or None if the action changed nothing
+    """
+    if entry.action == journal.ACTION_DELETE:
+        if entry.metax_cr_id and metax_api.check_catalog_record_exists(entry.metax_cr_id):
+            return None
+        # Deleted from Metax, or never there, in which case the action deletes only the CKAN package
+        return entry.metax_cr_id
+
+    if entry.action == journal.ACTION_UPDATE and entry.metax_cr_id and \
+            metax_api.check_catalog_record_exists(entry.metax_cr_id):
+        return entry.metax_cr_id
+    if entry.preferred_identifier:
+        # A create, or an update recreating a catalog record missing from Metax
+        return metax_api.get_catalog_record_identifier_using_preferred_identifier(entry.preferred_identifier)
+    return None
+
+
+def _journaled_guid(harvest_journal, entry):
+    """
+    :return: guid of the harvest object of the record, journaled with the begin step of its action
+    """
+    for step in reversed(harvest_journal.history(entry.package_id)):
+        if step.guid:
+            return step.guid
+    return None
+
+
+def _link_harvest_object(harvest_source_name, guid, package_id):
+    """
+    Make the latest harvest object of a record current for its package, as the harvester does after importing
+    the record, or add one if the harvester had not saved it. Otherwise the package would look orphaned to the
+    next harvest and to reconcile.
+    """
+    source = model.Package.get(harvest_source_name) if harvest_source_name else None
+    if source is None or not guid:
+        log.warning("Unable to link package {0} to a harvest object, harvest source {1} or guid {2} unknown"
+                    .format(package_id, harvest_source_name, guid))
+        return
+    harvest_objects = model.Session.query(HarvestObject) \
+                                   .filter(HarvestObject.harvest_source_id == source.id) \
+                                   .filter(HarvestObject.guid == guid) \
+                                   .order_by(HarvestObject.gathered.desc()) \
+                                   .all()
+    for harvest_object in harvest_objects:
+        harvest_object.current = False
+    if harvest_objects:
+        harvest_object = harvest_objects[0]
+    else:
+        harvest_object = HarvestObject(guid=guid, harvest_source_id=source.id, state='COMPLETE',
+                                       report_status='added')
+        model.Session.add(harvest_object)
+    harvest_object.package_id = package_id
+    harvest_object.current = True
+    model.Session.commit()
+    log.info("Linked package {0} to harvest object {1} of {2}".format(package_id, guid, harvest_source_name))
+
+
+def _finish_ckan_db_action(context, action, package_id, metax_cr_id):
+    context['schema'] = package_schema
+    data_dict = _get_data_dict_for_ckan_db(package_id, metax_cr_id)
+    if action == journal.ACTION_CREATE:
+        try:
+            ckan.logic.action.create.package_create(context, data_dict)
+        except Exception:
+            log.info("Unable to package_create package {0}. Trying to package_update..".format(package_id))
+            ckan.logic.action.update.package_update(context, data_dict)
+    elif action == journal.ACTION_UPDATE:
+        ckan.logic.action.update.package_update(context, data_dict)
+    elif action == journal.ACTION_DELETE:
+        ckan.logic.action.delete.package_delete(context, data_dict)
@@ -0,0 +1,101 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Compact model of the agents (people and organizations) of a record, used by the CMDI mapper while parsing.
+
+Agents are slotted objects rather than dicts, and the organization names, emails and other strings repeated
+across the agents of a record are shared through a dict of strings given by the parser of the record, so
+records with long agent lists take less memory. Agents are converted to Metax JSON with to_metax only when
+the package dict is built.
+
+Optional fields are left out of the Metax JSON when they are None; an empty string is kept, as some sources
+map it.
+"""
+
+
+def intern_text(strings, value):
+    """
+    :param strings: dict of the shared strings of a record, or None to not share strings
+    :return: the shared copy of the string, or None
+    """
+    if value is None or strings is None:
+        return value
+    return strings.setdefault(value, value)
+
+
+class Organization(object):
+    """
+    An organization agent.
+
+    :param names: name, or tuple of (language, name) pairs
+    :param strings: dict of the shared strings of the record, see intern_text
+    """
+
+    __slots__ = ('names', 'email', 'telephone', 'homepage')
+
+    def __init__(self, names, email=None, telephone=None, homepage=None, strings=None):
+        if isinstance(names, tuple):
+            names = tuple((intern_text(strings, lang), intern_text(strings, name)) for lang, name in names)
+        else:
+            names = intern_text(strings, names)
+        self.names = names
+        self.email = intern_text(strings, email)
+        self.telephone = intern_text(strings, telephone)
+        self.homepage = intern_text(strings, homepage)
+
+    def to_metax(self):
+        """
+        :return: the organization in the Metax agent format
+        """
+        agent = {
+            '@type': 'Organization',
+            'name': dict(self.names) if isinstance(self.names, tuple) else self.names,
+        }
+        if self.email is not None:
+            agent['email'] = self.email
+        if self.telephone:
+            agent['telephone'] = [self.telephone]
+        if self.homepage:
+            agent['homepage'] = {'identifier': self.homepage}
+        return agent
+
+
+class Person(object):
+    """
+    A person agent.
+
+    :param member_of: Organization the person is a member of, or None
+    :param strings: dict of the shared strings of the record, see intern_text
+    """
+
+    __slots__ = ('name', 'email', 'telephone', 'identifier', 'member_of')
+
+    def __init__(self, name, email=None, telephone=None, identifier=None, member_of=None, strings=None):
+        self.name = name
+        self.email = intern_text(strings, email)
+        self.telephone = telephone
+        self.identifier = identifier
+        self.member_of = member_of
+
+    def to_metax(self):
+        """
+        :return: the person in the Metax agent format
+        """
+        agent = {
+            '@type': 'Person',
+            'name': self.name,
+        }
+        if self.email is not None:
+            agent['email'] = self.email
+        if self.telephone:
+            agent['telephone'] = [self.telephone]
+        if self.identifier is not None:
+            agent['identifier'] = self.identifier
+        if self.member_of is not None:
+            agent['member_of'] = self.member_of.to_metax()
+        return agent
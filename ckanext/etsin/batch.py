@@ -0,0 +1,209 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Map dumps of OAI-PMH records to Metax catalog records without CKAN, eg. for bulk migrations:
+
+    etsin-map --format oai_ddi25 --config /etc/ckan/default/production.ini --output fsd.jsonl fsd-dump.tar.gz
+
+The records of XML files, directories and tar or zip archives of them (see dumps) are mapped, refined with the
+refiner of the harvest source, validated and converted to Metax catalog records in a pool of processes. The
+catalog records are written as JSON lines, in the order of the records, to stdout or --output. Progress and
+throughput are logged to stderr every --progress-interval seconds, and the outcome counts at the end.
+
+The harvest source is given with --source, and defaults to the source of the format, eg. fsd for oai_ddi25. If
+the format has no harvest source, the mapped research datasets are written as such, without refining or
+validating them.
+
+The mappers query reference data from Metax, whose settings are read from the [app:main] section of the CKAN
+config given with --config; with etsin.cassette.mode = replay in it they are answered from a recorded cassette.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import timeit
+from ConfigParser import SafeConfigParser
+from itertools import islice
+
+from lxml import etree
+
+from ckanext.etsin import dumps
+from ckanext.etsin.mapper_registry import OAIPMH_MAPPERS, get_oaipmh_mapper
+
+import logging
+log = logging.getLogger(__name__)
+
+# Harvest source of the records of each format, choosing the refiner and the data catalog
+DEFAULT_SOURCES = {
+    'cmdi0571': 'kielipankki',
+    'oai_ddi25': 'fsd',
+}
+
+MAPPED = 'mapped'
+DELETED = 'deleted'
+INVALID = 'invalid'
+FAILED = 'failed'
+
+# Format and harvest source of the records mapped in a pool process
+_worker = {}
+
+
+def load_config(path):
+    """
+    Read the [app:main] section of a CKAN config file to the pylons config, for the Metax settings.
+    """
+    from pylons import config
+
+    parser = SafeConfigParser({'here': os.path.dirname(os.path.abspath(path))})
+    parser.read(path)
+    settings = dict(parser.items('app:main'))
+    # The metrics of this process are not those of the harvester, so they are not exported
+    settings.pop('etsin.metrics.textfile_path', None)
+    config.update(settings)
+
+
+def map_record(format, harvest_source_name, xml):
+    """
+    Map, refine, validate and convert a serialized OAI-PMH record to a Metax catalog record.
+
+    :param harvest_source_name: harvest source of the record, or None to only map it
+    :return: (outcome, OAI-PMH identifier, catalog record as JSON or error message)
+    """
+    from ckanext.etsin.exceptions import DatasetFieldsMissingError, ResearchDatasetInvalidError
+    from ckanext.etsin.refine import refine
+    from ckanext.etsin.utils import convert_to_metax_catalog_record
+    from ckanext.etsin.validation import validate_research_dataset
+
+    guid = None
+    try:
+        record = etree.fromstring(xml)
+        guid, deleted = dumps.oaipmh_header(record)
+        if deleted:
+            return DELETED, guid, None
+        context = {'harvest_source_name': harvest_source_name, 'source_data': record, 'guid': guid}
+        package_dict = get_oaipmh_mapper(format)(record, context)
+        if not package_dict:
+            return INVALID, guid, 'Mapper returned no package'
+
+        if harvest_source_name is None:
+            return MAPPED, guid, json.dumps({'research_dataset': package_dict})
+
+        package_dict = refine(context, package_dict)
+        if not package_dict:
+            return INVALID, guid, 'Refiner returned no package'
+        validate_research_dataset(package_dict)
+        catalog_record = convert_to_metax_catalog_record(package_dict, context)
+        if not catalog_record:
+            return INVALID, guid, 'Unable to convert to a Metax catalog record'
+        return MAPPED, guid, json.dumps(catalog_record)
+    except (DatasetFieldsMissingError, ResearchDatasetInvalidError) as e:
+        return INVALID, guid, unicode(e)
+    except Exception as e:
+        log.debug("Mapping record {0} failed".format(guid), exc_info=True)
+        return FAILED, guid, repr(e)
+
+
+def _init_worker(format, harvest_source_name):
+    _worker['format'] = format
+    _worker['harvest_source_name'] = harvest_source_name
+
+
+def _map_in_worker(xml):
+    return map_record(_worker['format'], _worker['harvest_source_name'], xml)
+
+
+def run(format, harvest_source_name, records, output, processes=None, chunksize=8, progress_interval=10.0):
+    """
+    Map records and write the catalog records to output as JSON lines.
+
+    :param records: iterable of serialized records, see dumps.iter_records
+    :param processes: number of mapping processes, defaults to the number of CPUs; 1 maps in this process
+    :return: dict of outcome -> number of records
+    """
+    outcomes = {}
+    start = last_progress = timeit.default_timer()
+
+    pool = None
+    if processes == 1:
+        _init_worker(format, harvest_source_name)
+        results = (_map_in_worker(xml) for xml in records)
+    else:
+        pool = multiprocessing.Pool(processes, _init_worker, (format, harvest_source_name))
+        results = pool.imap(_map_in_worker, records, chunksize)
+
+    try:
+        for outcome, guid, value in results:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            if outcome == MAPPED:
+                output.write(value + '\n')
+            elif outcome != DELETED:
+                log.warning(u"Record {0} {1}: {2}".format(guid, outcome, value))
+
+            now = timeit.default_timer()
+            if now - last_progress >= progress_interval:
+                last_progress = now
+                log.info(_format_progress(outcomes, now - start))
+    finally:
+        if pool is not None:
+            # The workers are idle once every result is read; this also stops them on errors and interrupts
+            pool.terminate()
+            pool.join()
+
+    log.info(_format_progress(outcomes, timeit.default_timer() - start))
+    return outcomes
+
+
+def _format_progress(outcomes, seconds):
+    records = sum(outcomes.values())
+    return '{0} records in {1:.1f} s, {2:.1f} records/s ({3})'.format(
+        records, seconds, records / seconds if seconds else 0.0,
+        ', '.join('{0} {1}'.format(outcome, count) for outcome, count in sorted(outcomes.items())))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Map dumps of OAI-PMH records to Metax catalog records as JSON lines')
+    parser.add_argument('paths', nargs='+', help='XML files, tar or zip archives, or directories of XML files')
+    parser.add_argument('--format', required=True, choices=sorted(OAIPMH_MAPPERS.keys()),
+                        help='OAI-PMH metadata format of the records')
+    parser.add_argument('--source', help='Harvest source of the records, choosing the refiner and data catalog. '
+                                         'Defaults to the source of the format')
+    parser.add_argument('--config', help='CKAN config file of the Metax settings')
+    parser.add_argument('--output', help='File of the catalog records, defaults to stdout')
+    parser.add_argument('--processes', type=int, default=None, help='Mapping processes, defaults to the CPUs')
+    parser.add_argument('--chunksize', type=int, default=8, help='Records sent to a process at a time')
+    parser.add_argument('--limit', type=int, default=None, help='Map at most this many records')
+    parser.add_argument('--progress-interval', type=float, default=10.0, help='Seconds between progress reports')
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()), stream=sys.stderr,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if args.config:
+        load_config(args.config)
+    harvest_source_name = args.source or DEFAULT_SOURCES.get(args.format)
+    if harvest_source_name is None:
+        log.info("No harvest source for {0}, writing research datasets without refining or validating them"
+                 .format(args.format))
+
+    records = dumps.iter_records(args.paths)
+    if args.limit is not None:
+        records = islice(records, args.limit)
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        outcomes = run(args.format, harvest_source_name, records, output, args.processes, args.chunksize,
+                       args.progress_interval)
+    finally:
+        if args.output:
+            output.close()
+    return 1 if outcomes.get(FAILED) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,35 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Benchmarks for the Etsin harvester. Each module is runnable on its own, eg.
+
+    python -m ckanext.etsin.benchmarks.languages
+"""
+
+import timeit
+
+
+def time_per_call(func, args_list, repeat=5, number=1000):
+    """
+    Measure how long one call of func takes on average.
+
+    :param func: function to measure
+    :param args_list: list of argument tuples, func is called once with each per round
+    :param repeat: number of measurements, the fastest one is used
+    :param number: number of rounds per measurement
+    :return: seconds per call
+    """
+    def run():
+        for args in args_list:
+            func(*args)
+    best = min(timeit.repeat(run, repeat=repeat, number=number))
+    return best / (number * len(args_list))
+
+
+def print_result(name, seconds_per_call):
+    print('{0:<55} {1:>12.0f} ns/call'.format(name, seconds_per_call * 1e9))
@@ -0,0 +1,249 @@
+# coding=utf-8
+#
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Synthetic corpora for benchmarking the mappers.
+
+Records are made by varying the test fixtures: agent counts, title and description languages, description
+sizes and identifiers are drawn at random for every record, so that the corpus looks like a harvest rather
+than one record repeated. The same seed gives the same corpus. Records are generated lazily, so corpora of
+100 000 records do not need to fit in memory.
+"""
+
+import copy
+import os
+import random
+from collections import namedtuple
+
+from lxml import etree
+
+from ckanext.etsin.tests.helpers import _get_file_as_string
+
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+CorpusSettings = namedtuple('CorpusSettings', ['records', 'seed', 'agents', 'languages', 'description_size'])
+
+# 1000 records of 1-20 agents each, titles and descriptions in 1-3 languages of 100-5000 characters
+DEFAULT_SETTINGS = CorpusSettings(records=1000, seed=1, agents=(1, 20), languages=('fi', 'en', 'sv'),
+                                  description_size=(100, 5000))
+
+# A synthetic OAI-PMH record: xml as a string and its identifier
+XmlRecord = namedtuple('XmlRecord', ['guid', 'xml'])
+
+# A synthetic ckanext-spatial record: the iso_values dict and the harvest object guid
+IsoRecord = namedtuple('IsoRecord', ['guid', 'iso_values'])
+
+GIVEN_NAMES = [u'Aino', u'Eero', u'Helmi', u'Juhani', u'Kaisa', u'Lauri', u'Maria', u'Matti', u'Sofia', u'Tuomas',
+               u'Anna', u'Erik', u'John', u'Olga', u'Pawel']
+SURNAMES = [u'Korhonen', u'Virtanen', u'Nieminen', u'Laine', u'Heikkinen', u'Lindqvist', u'Smith', u'Kowalski',
+            u'Westinen', u'Häkkinen', u'Mäkelä', u'Öhman']
+ORGANIZATIONS = [u'University of Helsinki', u'University of Tampere', u'Åbo Akademi University',
+                 u'Finnish Environment Institute', u'CSC - IT Center for Science']
+WORDS = [u'aineisto', u'data', u'survey', u'kysely', u'environment', u'ympäristö', u'language', u'kieli', u'students',
+         u'opiskelijat', u'values', u'arvot', u'measurement', u'mittaus', u'corpus', u'korpus', u'samples', u'näytteet',
+         u'Finland', u'Suomi', u'research', u'tutkimus', u'annotated', u'lake', u'järvi', u'forest', u'metsä']
+ISO_ROLES = ['author', 'originator', 'pointOfContact', 'custodian', 'distributor', 'publisher', 'owner',
+             'processor', 'user']
+ISO_LANGUAGES = {'fi': 'fin', 'en': 'eng', 'sv': 'swe'}
+
+
+class _Random(random.Random):
+
+    def count(self, bounds):
+        return self.randint(bounds[0], bounds[1])
+
+    def languages(self, languages):
+        return self.sample(languages, self.randint(1, len(languages)))
+
+    def words(self, count):
+        return ' '.join(self.choice(WORDS) for _ in range(count))
+
+    def text(self, size):
+        """ Text of about size characters """
+        return self.words(max(1, size // 8))[:size]
+
+    def person(self):
+        return self.choice(GIVEN_NAMES), self.choice(SURNAMES)
+
+
+def _elements(root, name):
+    return list(root.iter('{*}' + name))
+
+
+def _replicate(template, count):
+    """
+    Replace template and its following siblings of the same tag with count copies of template.
+
+    :return: list of the copies
+    """
+    parent = template.getparent()
+    index = parent.index(template)
+    for sibling in [e for e in parent if e.tag == template.tag]:
+        parent.remove(sibling)
+    copies = []
+    for i in range(count):
+        element = copy.deepcopy(template)
+        parent.insert(index + i, element)
+        copies.append(element)
+    return copies
+
+
+def _set_lang_texts(rnd, template, languages, text):
+    """
+    Replace template and its siblings of the same tag with one element per language.
+
+    :param text: function of language returning the text
+    """
+    for element, lang in zip(_replicate(template, len(languages)), languages):
+        element.set(XML_LANG, lang)
+        element.text = text(lang)
+
+
+def _fixture_generator(fixture, vary):
+    """
+    Generator of XmlRecords made from a fixture.
+
+    :param vary: function of (random, settings, index, tree) varying a copy of the fixture in place and returning
+        the identifier of the record
+    """
+    def generate(settings):
+        rnd = _Random(settings.seed)
+        original = etree.fromstring(_get_file_as_string(fixture))
+        for index in range(settings.records):
+            tree = copy.deepcopy(original)
+            guid = vary(rnd, settings, index, tree)
+            yield XmlRecord(guid, etree.tostring(tree, encoding='utf-8'))
+    return generate
+
+
+def _vary_datacite(rnd, settings, index, tree):
+    guid = '10.18150/{0}'.format(9000000 + index)
+    _elements(tree, 'identifier')[0].text = 'http://dx.doi.org/' + guid
+    for element in _elements(tree, 'alternateIdentifier'):
+        element.text = guid
+
+    creators = _replicate(_elements(tree, 'creator')[0], rnd.count(settings.agents))
+    for creator in creators:
+        given_name, surname = rnd.person()
+        _elements(creator, 'creatorName')[0].text = u'{0}, {1}'.format(surname, given_name)
+
+    languages = rnd.languages(settings.languages)
+    _set_lang_texts(rnd, _elements(tree, 'title')[0], languages, lambda lang: rnd.words(8).capitalize())
+    _set_lang_texts(rnd, _elements(tree, 'description')[0], languages,
+                    lambda lang: rnd.text(rnd.count(settings.description_size)))
+    for subject in _replicate(_elements(tree, 'subject')[0], rnd.randint(1, 10)):
+        subject.text = rnd.words(2)
+    _elements(tree, 'date')[0].text = '{0}-{1:02d}-{2:02d}'.format(rnd.randint(1990, 2018), rnd.randint(1, 12),
+                                                                  rnd.randint(1, 28))
+    return guid
+
+
+def _vary_ddi25(rnd, settings, index, tree):
+    study = 'FSD{0}'.format(3000 + index)
+    _elements(tree, 'header')[0][0].text = 'oai:fsd.uta.fi:' + study
+    for id_no in _elements(tree, 'IDNo'):
+        if id_no.get('agency') == 'FSD':
+            id_no.text = study
+        else:
+            # The agency the mapper takes the preferred identifier from
+            id_no.set('agency', 'URN')
+            id_no.text = 'urn:nbn:fi:fsd:T-' + study
+
+    # The mapper matches the authors of the citations by position, so every language gets the same ones
+    agents = [(rnd.person(), rnd.choice(ORGANIZATIONS)) for _ in range(rnd.count(settings.agents))]
+    title = rnd.words(6).capitalize()
+    for citation in _elements(tree, 'citation'):
+        for name in ('titl', 'parTitl'):
+            for element in _elements(citation, name):
+                element.text = title
+        auth_entities = _elements(citation, 'AuthEnty')
+        if auth_entities:
+            for auth_enty, ((given_name, surname), organization) in zip(
+                    _replicate(auth_entities[0], len(agents)), agents):
+                auth_enty.text = u'{0}, {1}'.format(surname, given_name)
+                auth_enty.set('affiliation', organization)
+    abstract = rnd.text(rnd.count(settings.description_size))
+    for element in _elements(tree, 'abstract'):
+        element.text = abstract
+    return 'oai:fsd.uta.fi:' + study
+
+
+def _vary_cmdi(rnd, settings, index, tree):
+    urn = 'urn:nbn:fi:lb-{0}'.format(20140730000 + index)
+    _elements(tree, 'header')[0][0].text = 'oai:kielipankki.fi:{0}'.format(index)
+    _elements(tree, 'MdSelfLink')[0].text = 'http://urn.fi/' + urn
+    _elements(tree, 'identificationInfo')[0].find('{*}identifier').text = 'http://urn.fi/' + urn
+
+    languages = rnd.languages(settings.languages)
+    _set_lang_texts(rnd, _elements(tree, 'resourceName')[0], languages, lambda lang: rnd.words(6).capitalize())
+    _set_lang_texts(rnd, _elements(tree, 'description')[0], languages,
+                    lambda lang: rnd.text(rnd.count(settings.description_size)))
+
+    for person in _replicate(_elements(tree, 'contactPerson')[0], rnd.count(settings.agents)):
+        given_name, surname = rnd.person()
+        _elements(person, 'surname')[0].text = surname
+        _elements(person, 'givenName')[0].text = given_name
+        _elements(person, 'email')[0].text = u'{0}.{1}@example.fi'.format(given_name, surname).lower()
+    return 'oai:kielipankki.fi:{0}'.format(index)
+
+
+def _syke_guids():
+    """ Guids of the SYKE mapping file, so that the SYKE refiner accepts the records """
+    path = os.path.join(os.path.dirname(__file__), '..', 'refiners', 'resources', 'syke_guid_to_kata_urn.csv')
+    with open(path) as f:
+        return [line.split(',')[0] for line in f if line.strip()]
+
+
+def generate_iso_19139(settings):
+    """
+    Generator of IsoRecords, as ckanext-spatial gives them to the ISO 19139 mapper.
+    """
+    rnd = _Random(settings.seed)
+    guids = _syke_guids()
+    for index in range(settings.records):
+        responsible_organisations = []
+        for _ in range(rnd.count(settings.agents)):
+            given_name, surname = rnd.person()
+            agent = {'organisation-name': rnd.choice(ORGANIZATIONS),
+                     'contact-info': {'email': u'{0}.{1} [at] example.fi'.format(given_name, surname).lower()},
+                     'role': [rnd.choice(ISO_ROLES)]}
+            if rnd.random() < 0.7:
+                agent['individual-name'] = u'{0} {1}'.format(given_name, surname)
+            responsible_organisations.append(agent)
+        languages = rnd.languages(settings.languages)
+        start_year = rnd.randint(1950, 2017)
+        iso_values = {
+            'title': rnd.words(6).capitalize(),
+            'responsible-organisation': responsible_organisations,
+            'metadata-language': ISO_LANGUAGES[languages[0]],
+            'abstract': rnd.text(rnd.count(settings.description_size)),
+            'dataset-language': [ISO_LANGUAGES[lang] for lang in languages],
+            'tags': [rnd.words(1) for _ in range(rnd.randint(1, 10))],
+            'bbox': [{'west': '21.193932', 'east': '23.154996', 'north': '60.87458', 'south': '59.880178'}],
+            'date-released': '{0}-01-01'.format(start_year),
+            'date-updated': '{0}-06-06'.format(start_year + 1),
+            'use-constraints': [rnd.choice(['CC BY 4.0', 'joopajoo', 'Ei rajoituksia'])],
+            'temporal-extent-begin': ['{0}-01-01'.format(start_year)],
+            'temporal-extent-end': ['{0}-12-31'.format(start_year)],
+            'lineage': rnd.words(10),
+            'topic-category': [rnd.choice(['environment', 'biota', 'inlandWaters', 'climatologyMeteorologyAtmosphere'])],
+        }
+        yield IsoRecord(guids[index % len(guids)], iso_values)
+
+
+generate_datacite = _fixture_generator('datacite/datacite1.xml', _vary_datacite)
+generate_ddi25 = _fixture_generator('ddi25/ddi25_1.xml', _vary_ddi25)
+generate_cmdi = _fixture_generator('kielipankki_cmdi/cmdi_record_example.xml', _vary_cmdi)
+
+GENERATORS = {
+    'cmdi': generate_cmdi,
+    'datacite': generate_datacite,
+    'ddi25': generate_ddi25,
+    'iso19139': generate_iso_19139,
+}
@@ -0,0 +1,39 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Microbenchmark of the date conversions in utils against the dateutil based implementations
+"""
+
+from ckanext.etsin import utils
+from ckanext.etsin.benchmarks import print_result, time_per_call
+
+# Date shapes the mappers typically see
+DATETIME_ARGS = [
+    ('2017', '01-01', '00:00:00'),
+    ('2017-05-23', None, '23:59:59'),
+    ('2017-5-3', None, None),
+    ('2017-05-23T10:20:30Z', None, None),
+    ('2017-05-23T10:20:30.123+03:00', None, None),
+    ('2017-05-23T10:20:30', None, None),
+]
+DATE_ARGS = [('2017',), ('2017-05-23',), ('2017-5-3',), ('2017-05-23T10:20:30Z',)]
+
+
+def main():
+    for name, func, args in [
+            ('dateutil get_string_as_valid_datetime_string',
+             utils._get_string_as_valid_datetime_string_with_dateutil, DATETIME_ARGS),
+            ('utils.get_string_as_valid_datetime_string', utils.get_string_as_valid_datetime_string, DATETIME_ARGS),
+            ('dateutil get_string_as_valid_date_string',
+             utils._get_string_as_valid_date_string_with_dateutil, DATE_ARGS),
+            ('utils.get_string_as_valid_date_string', utils.get_string_as_valid_date_string, DATE_ARGS)]:
+        print_result(name, time_per_call(func, args))
+
+
+if __name__ == '__main__':
+    main()
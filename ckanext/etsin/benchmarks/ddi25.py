@@ -0,0 +1,45 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Benchmark of mapping and refining the DDI 2.5 test record replicated 1000 times. Reference data queries
+are replaced with a stub.
+"""
+
+import timeit
+
+import mock
+from lxml import etree
+
+from ckanext.etsin.benchmarks import print_result
+from ckanext.etsin.ddi_index import DDIIndex, NAMESPACES
+from ckanext.etsin.mappers import ddi25
+from ckanext.etsin.refiners.fsd import fsd_refiner
+from ckanext.etsin.tests.helpers import _get_file_as_string
+
+
+def main(copies=1000):
+    source = _get_file_as_string('ddi25/ddi25_1.xml')
+    records = [etree.fromstring(source) for _ in range(copies)]
+
+    start = timeit.default_timer()
+    for xml in records:
+        DDIIndex(xml.find('.//ddi:codeBook', NAMESPACES))
+    print_result('DDIIndex per record', (timeit.default_timer() - start) / copies)
+
+    with mock.patch.object(ddi25, 'get_ref_data_batch', side_effect=lambda queries: [None] * len(queries)):
+        start = timeit.default_timer()
+        for xml in records:
+            context = {'source_data': xml}
+            package_dict = ddi25.ddi25_mapper(xml, context)
+            package_dict['preferred_identifier'] = 'urn:nbn:fi:fsd:T-FSD3092'
+            fsd_refiner(context, package_dict)
+        print_result('ddi25_mapper and fsd_refiner per record', (timeit.default_timer() - start) / copies)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Startup benchmark: time importing the modules a CKAN worker or paster command imports, each in a fresh
+interpreter, and list the heavy dependencies the import pulls in.
+
+Python 2 has no -X importtime, so the import is timed inside the child process.
+"""
+
+import json
+import subprocess
+import sys
+
+MODULES = [
+    'ckanext.etsin.utils',
+    'ckanext.etsin.metax_api',
+    'ckanext.etsin.data_catalog_service',
+    'ckanext.etsin.validation',
+    'ckanext.etsin.refine',
+]
+
+# Dependencies that should be imported only on first use
+HEAVY_MODULES = ['iso639', 'dateutil', 'jsonschema', 'lxml.objectify', 'ckanext.etsin.mappers.cmdi',
+                 'ckanext.etsin.mappers.datacite', 'ckanext.etsin.mappers.ddi25', 'ckanext.etsin.mappers.iso_19139']
+
+_CHILD = """
+import json, sys, timeit
+start = timeit.default_timer()
+import {module}
+seconds = timeit.default_timer() - start
+print(json.dumps([seconds, [m for m in {heavy!r} if m in sys.modules]]))
+"""
+
+
+def import_in_child(module):
+    """
+    Import module in a fresh interpreter.
+
+    :return: (seconds taken by the import, list of heavy modules imported)
+    """
+    output = subprocess.check_output([sys.executable, '-c', _CHILD.format(module=module, heavy=HEAVY_MODULES)])
+    seconds, heavy = json.loads(output.splitlines()[-1])
+    return seconds, heavy
+
+
+def main(repeat=5):
+    for module in MODULES:
+        results = [import_in_child(module) for _ in range(repeat)]
+        best = min(seconds for seconds, _ in results)
+        print('{0:<45} {1:>8.1f} ms  heavy: {2}'.format(module, best * 1e3, ', '.join(results[0][1]) or '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Per field benchmark of the ISO 19139 mapping spec
+"""
+
+import timeit
+
+from ckanext.etsin.benchmarks import print_result
+from ckanext.etsin.mappers.iso_19139 import ISO_19139_SPEC
+
+ISO_VALUES = {
+    'title': 'Testiaineisto',
+    'metadata-language': 'fin',
+    'abstract': 'kuvailuteksti',
+    'dataset-language': ['fin'],
+    'tags': ['testiavainsana'],
+    'bbox': [{'west': '21.193932', 'east': '23.154996', 'north': '60.87458', 'south': '59.880178'}],
+    'date-released': '2017-01-01',
+    'date-updated': '2017-06-06',
+    'use-constraints': ['joopajoo'],
+    'temporal-extent-begin': ['2000-01-01'],
+    'temporal-extent-end': ['2001-01-01'],
+    'lineage': 'provenance',
+    'topic-category': ['environment'],
+}
+
+
+def main(number=10000):
+    env = {'meta_lang': 'fi', 'context': {}}
+    timings = {}
+    start = timeit.default_timer()
+    for _ in range(number):
+        ISO_19139_SPEC.apply(ISO_VALUES, {}, env, timings)
+    total = timeit.default_timer() - start
+
+    for target, seconds in sorted(timings.items(), key=lambda item: -item[1]):
+        print_result(target, seconds / number)
+    print_result('total per record, with timing overhead', total / number)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Microbenchmark of the language code conversions in utils against looking the codes up from iso639 directly
+"""
+
+from iso639 import languages
+
+from ckanext.etsin import utils
+from ckanext.etsin.benchmarks import print_result, time_per_call
+
+# Hits and misses in roughly the proportions the mappers see
+PART1_CODES = ['fi', 'en', 'sv', 'ru', 'de', 'FI', 'xx']
+PART3_CODES = ['fin', 'eng', 'swe', 'smi', 'yrk', 'und', 'zzz']
+
+
+def _iso639_convert_language(language):
+    try:
+        return languages.get(part1=language).terminology
+    except KeyError:
+        try:
+            return languages.get(part2b=language).terminology
+        except KeyError as ke:
+            utils.log.error('KeyError: key not found: {0}'.format(ke.args))
+            return ''
+
+
+def _iso639_convert_language_to_6391(language):
+    try:
+        return languages.get(part3=language).part1
+    except Exception:
+        return False
+
+
+def _iso639_validate_6391(language):
+    try:
+        return language == languages.get(part1=language).part1
+    except Exception:
+        return False
+
+
+def _iso639_get_language_identifier(language):
+    try:
+        languages.get(part5=language)
+        return 'http://lexvo.org/id/iso639-5/' + language
+    except KeyError:
+        return 'http://lexvo.org/id/iso639-3/' + language
+
+
+def main():
+    part1_args = [(code,) for code in PART1_CODES]
+    part3_args = [(code,) for code in PART3_CODES]
+
+    # Build tables and load iso639 data outside the measurements
+    utils.convert_language('fi')
+    languages.get(part3='fin')
+
+    for name, func, args in [
+            ('iso639 convert_language', _iso639_convert_language, part1_args),
+            ('utils.convert_language', utils.convert_language, part1_args),
+            ('iso639 convert_language_to_6391', _iso639_convert_language_to_6391, part3_args),
+            ('utils.convert_language_to_6391', utils.convert_language_to_6391, part3_args),
+            ('iso639 validate_6391', _iso639_validate_6391, part1_args),
+            ('utils.validate_6391', utils.validate_6391, part1_args),
+            ('iso639 get_language_identifier', _iso639_get_language_identifier, part3_args),
+            ('utils.get_language_identifier', utils.get_language_identifier, part3_args)]:
+        print_result(name, time_per_call(func, args))
+
+
+if __name__ == '__main__':
+    main()
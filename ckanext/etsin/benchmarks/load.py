@@ -0,0 +1,300 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+End-to-end load test of the harvest actions against the local Metax stand-in, eg.
+
+    python -m ckanext.etsin.benchmarks.load --records 5000 --concurrency 16 --latency 0.02 --error-rate 0.01
+
+Synthetic records (see corpus) are mapped, then created, updated and deleted with the actions of this
+extension, which refine, validate and send them to Metax with metax_api. The stand-in is started in a child
+process, unless --metax-host points to one already running. The CKAN database is replaced with an in-memory
+table, so the results are those of the harvester code and Metax. Needs CKAN to be importable.
+
+For each phase, the outcomes, records/sec and per record latency percentiles are reported, and at the end the
+requests the stand-in served and the most it served at once.
+"""
+
+import argparse
+import copy
+import json
+import logging
+import subprocess
+import sys
+import threading
+import timeit
+from multiprocessing.pool import ThreadPool
+
+import mock
+import requests
+from lxml import etree
+
+from ckanext.etsin import metax_api, metrics
+from ckanext.etsin.benchmarks.corpus import DEFAULT_SETTINGS, GENERATORS
+from ckanext.etsin.timing import Histogram
+
+# Harvest source of the records of each format, the refiner is chosen by it
+SOURCES = {
+    'cmdi': 'kielipankki',
+    'ddi25': 'fsd',
+    'iso19139': 'syke',
+}
+PERCENTILES = (50, 95, 99)
+
+
+class _HarvestObject(object):
+
+    def __init__(self, guid):
+        self.guid = guid
+
+
+class _CkanDatabase(object):
+    """
+    In-memory stand-in of the CKAN package table: package id -> name, which is the Metax catalog record identifier.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.packages = {}
+
+    def get_name(self, package_id):
+        with self._lock:
+            return self.packages[package_id]
+
+    def package_create(self, context, data_dict):
+        with self._lock:
+            self.packages[data_dict['id']] = data_dict['name']
+        # Lets the driver find the package of the record for the update and delete phases
+        context['load_test_package_id'] = data_dict['id']
+        return data_dict
+
+    def package_update(self, context, data_dict):
+        return self.package_create(context, data_dict)
+
+    def package_delete(self, context, data_dict):
+        with self._lock:
+            self.packages.pop(data_dict['id'], None)
+        return data_dict
+
+
+def _stub_ckan(database):
+    harvest_user = mock.Mock()
+    harvest_user.name = 'harvest'
+    model = mock.Mock()
+    model.User.get.return_value = harvest_user
+    patches = [
+        mock.patch('ckanext.etsin.actions.model', model),
+        mock.patch('ckanext.etsin.actions._get_metax_id_from_ckan_db', database.get_name),
+        mock.patch('ckan.logic.action.create.package_create', database.package_create),
+        mock.patch('ckan.logic.action.update.package_update', database.package_update),
+        mock.patch('ckan.logic.action.delete.package_delete', database.package_delete),
+    ]
+    for patch in patches:
+        patch.start()
+    return patches
+
+
+def _map(format_name, record):
+    """
+    Map a synthetic record like the harvesters do.
+
+    :return: (action context entries, package dict)
+    """
+    if format_name == 'iso19139':
+        from ckanext.etsin.mappers.iso_19139 import iso_19139_mapper
+        context = {'guid': record.guid}
+        return context, iso_19139_mapper(dict(context), {'iso_values': record.iso_values,
+                                                         'harvest_object': _HarvestObject(record.guid)})
+    xml = etree.fromstring(record.xml)
+    if format_name == 'cmdi':
+        from ckanext.etsin.mappers.cmdi import cmdi_mapper
+        return {'source_data': xml}, cmdi_mapper(xml)
+    from ckanext.etsin.mappers.ddi25 import ddi25_mapper
+    return {'source_data': xml}, ddi25_mapper(xml)
+
+
+def _run_phase(name, tasks, concurrency):
+    """
+    Run the tasks in a thread pool.
+
+    :param tasks: list of functions returning the context of the action they ran
+    :return: (dict of results, list of contexts)
+    """
+    latencies = Histogram()
+    lock = threading.Lock()
+    before = _outcomes()
+
+    def run(task):
+        start = timeit.default_timer()
+        try:
+            return task()
+        except Exception as e:
+            return {'load_test_error': repr(e)}
+        finally:
+            seconds = timeit.default_timer() - start
+            with lock:
+                latencies.add(seconds)
+
+    pool = ThreadPool(concurrency)
+    start = timeit.default_timer()
+    try:
+        contexts = pool.map(run, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    seconds = timeit.default_timer() - start
+
+    after = _outcomes()
+    result = {
+        'phase': name,
+        'records': len(tasks),
+        'errors': sum(1 for context in contexts if 'load_test_error' in context),
+        'outcomes': dict((k, v - before.get(k, 0)) for k, v in after.items() if v != before.get(k, 0)),
+        'seconds': seconds,
+        'records_per_second': len(tasks) / seconds if seconds else None,
+    }
+    for percent in PERCENTILES:
+        result['p{0}_ms'.format(percent)] = latencies.percentile(percent) * 1e3
+    return result, contexts
+
+
+def _outcomes():
+    """
+    :return: dict of outcome -> count of harvested records so far
+    """
+    outcomes = {}
+    for line in metrics.render().splitlines():
+        if line.startswith('etsin_harvest_records_total{'):
+            outcome = line.split('outcome="')[1].split('"')[0]
+            outcomes[outcome] = outcomes.get(outcome, 0) + int(line.rsplit(' ', 1)[1])
+    return outcomes
+
+
+def run_load_test(records, concurrency):
+    """
+    Create, update and delete the records with the harvest actions.
+
+    :param records: list of (format name, action context entries, package dict)
+    :return: list of phase results
+    """
+    from ckanext.etsin import actions
+
+    def context_for(format_name, entries):
+        return dict(entries, user='harvest', harvest_source_name=SOURCES[format_name])
+
+    def create(format_name, entries, package_dict):
+        def task():
+            context = context_for(format_name, entries)
+            actions.package_create(context, copy.deepcopy(package_dict))
+            return context
+        return task
+
+    def update(format_name, entries, package_dict, package_id):
+        def task():
+            context = context_for(format_name, entries)
+            # A new modification time, so that the record is not skipped as unchanged
+            actions.package_update(context, dict(copy.deepcopy(package_dict), id=package_id,
+                                                 modified='2018-12-31T00:00:00Z'))
+            return context
+        return task
+
+    def delete(format_name, package_id):
+        def task():
+            context = context_for(format_name, {})
+            actions.package_delete(context, {'id': package_id})
+            return context
+        return task
+
+    results = []
+    result, contexts = _run_phase('create', [create(*record) for record in records], concurrency)
+    results.append(result)
+    created = [(record, context['load_test_package_id']) for record, context in zip(records, contexts)
+               if 'load_test_package_id' in context]
+
+    result, _ = _run_phase('update', [update(format_name, entries, package_dict, package_id)
+                                      for (format_name, entries, package_dict), package_id in created], concurrency)
+    results.append(result)
+
+    result, _ = _run_phase('delete', [delete(record[0], package_id) for record, package_id in created], concurrency)
+    results.append(result)
+    return results
+
+
+def start_stand_in(args):
+    """
+    Start the Metax stand-in in a child process, on a free port.
+
+    :return: (Popen, host)
+    """
+    command = [sys.executable, '-m', 'ckanext.etsin.benchmarks.metax_server', '--port', '0',
+               '--latency', str(args.latency), '--latency-jitter', str(args.latency_jitter),
+               '--error-rate', str(args.error_rate), '--seed', str(args.seed)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    return process, process.stdout.readline().strip().rsplit(' ', 1)[1]
+
+
+def print_results(results):
+    print('{0:<8} {1:>8} {2:>7} {3:>10} {4:>9} {5:>9} {6:>9}  {7}'.format(
+        'phase', 'records', 'errors', 'records/s', 'p50 ms', 'p95 ms', 'p99 ms', 'outcomes'))
+    for r in results:
+        print('{0:<8} {1:>8} {2:>7} {3:>10.1f} {4:>9.2f} {5:>9.2f} {6:>9.2f}  {7}'.format(
+            r['phase'], r['records'], r['errors'], r['records_per_second'] or 0, r['p50_ms'], r['p95_ms'],
+            r['p99_ms'], ', '.join('{0}={1}'.format(k, v) for k, v in sorted(r['outcomes'].items()))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the harvest actions against the Metax stand-in')
+    parser.add_argument('--formats', default=','.join(sorted(SOURCES)), help='comma separated, default all')
+    parser.add_argument('--records', type=int, default=DEFAULT_SETTINGS.records, help='per format')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SETTINGS.seed)
+    parser.add_argument('--concurrency', type=int, default=8, help='actions run at once')
+    parser.add_argument('--metax-host', help='host:port of a running stand-in, by default one is started')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every Metax request')
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of Metax requests failing')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--log-level', default='critical', help='of the harvester code, default critical')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()))
+
+    process = None
+    host = args.metax_host
+    if not host:
+        process, host = start_stand_in(args)
+    config = {'metax.host': host, 'metax.protocol': 'http', 'metax.verify_ssl': 'false'}
+    patches = [mock.patch('ckanext.etsin.metax_api.config', config)] + _stub_ckan(_CkanDatabase())
+    patches[0].start()
+    metax_api.reset_settings()
+    try:
+        records = []
+        settings = DEFAULT_SETTINGS._replace(records=args.records, seed=args.seed)
+        for format_name in args.formats.split(','):
+            for record in GENERATORS[format_name](settings):
+                entries, package_dict = _map(format_name, record)
+                records.append((format_name, entries, package_dict))
+
+        results = run_load_test(records, args.concurrency)
+        print_results(results)
+        stats = requests.get('http://{0}/_standin/stats'.format(host)).json()
+        print('Metax stand-in served at most {0} requests at once'.format(stats['max_active']))
+        for key, count in sorted(stats['requests'].items()):
+            print('  {0:<30} {1:>8}'.format(key, count))
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump({'phases': results, 'metax': stats}, f, indent=2)
+    finally:
+        for patch in patches:
+            patch.stop()
+        metax_api.reset_settings()
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Benchmark of the mappers and refiners of all four formats over synthetic corpora, eg.
+
+    python -m ckanext.etsin.benchmarks.mappers --records 10000 --agents 1-50 --description-size 100-20000
+
+Each format is run in its own process, so that its peak RSS is its own. Metax and reference data queries are
+replaced with stubs. For every format, records/sec, per record latency percentiles (parsing, mapping and
+refining) and peak RSS are reported.
+
+With --save the results are written to a JSON file, and with --baseline compared against such a file; the
+exit status is 1 if the throughput of any format dropped more than --max-regression percent.
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import timeit
+
+import mock
+from lxml import etree
+
+from ckanext.etsin.benchmarks.corpus import CorpusSettings, DEFAULT_SETTINGS, GENERATORS
+from ckanext.etsin.timing import Histogram
+
+FORMATS = ('cmdi', 'datacite', 'ddi25', 'iso19139')
+PERCENTILES = (50, 95, 99)
+
+
+class _HarvestObject(object):
+    """ The part of a harvest object the ISO 19139 mapper uses """
+
+    def __init__(self, guid):
+        self.guid = guid
+
+
+def _cmdi_pipeline():
+    from ckanext.etsin.mappers.cmdi import cmdi_mapper
+    from ckanext.etsin.refiners.kielipankki import kielipankki_refiner
+
+    def run(record):
+        xml = etree.fromstring(record.xml)
+        return kielipankki_refiner({'source_data': xml}, cmdi_mapper(xml))
+    return run
+
+
+def _datacite_pipeline():
+    from ckanext.etsin.mappers.datacite import datacite_mapper
+
+    def run(record):
+        return datacite_mapper(etree.fromstring(record.xml))
+    return run
+
+
+def _ddi25_pipeline():
+    from ckanext.etsin.mappers.ddi25 import ddi25_mapper
+    from ckanext.etsin.refiners.fsd import fsd_refiner
+
+    def run(record):
+        xml = etree.fromstring(record.xml)
+        return fsd_refiner({'source_data': xml}, ddi25_mapper(xml))
+    return run
+
+
+def _iso19139_pipeline():
+    from ckanext.etsin.mappers.iso_19139 import iso_19139_mapper
+    from ckanext.etsin.refiners.syke import syke_refiner
+
+    def run(record):
+        context = {}
+        package_dict = iso_19139_mapper(context, {'iso_values': record.iso_values,
+                                                  'harvest_object': _HarvestObject(record.guid)})
+        return syke_refiner(context, package_dict)
+    return run
+
+
+PIPELINES = {
+    'cmdi': _cmdi_pipeline,
+    'datacite': _datacite_pipeline,
+    'ddi25': _ddi25_pipeline,
+    'iso19139': _iso19139_pipeline,
+}
+
+
+def _stub_metax():
+    """
+    Replace the Metax and reference data queries with stubs finding nothing, and make any other request fail.
+    """
+    def no_results(queries):
+        return [None] * len(queries)
+
+    def no_network(verb, url, **kwargs):
+        raise RuntimeError('No Metax in benchmarks: {0} {1}'.format(verb, url))
+
+    patches = [
+        mock.patch('ckanext.etsin.metax_api.get_ref_data', return_value=None),
+        mock.patch('ckanext.etsin.metax_api.get_ref_data_batch', side_effect=no_results),
+        mock.patch('ckanext.etsin.mappers.ddi25.get_ref_data_batch', side_effect=no_results),
+        mock.patch('ckanext.etsin.mappers.datacite.get_ref_data_batch', side_effect=no_results),
+        mock.patch('ckanext.etsin.transport.send', side_effect=no_network),
+    ]
+    for patch in patches:
+        patch.start()
+    return patches
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_format(format_name, settings):
+    """
+    Map and refine a synthetic corpus of a format in this process.
+
+    :return: dict of results
+    """
+    import ckanext.etsin.mappers.ddi25  # noqa, imported for patching
+    import ckanext.etsin.mappers.datacite  # noqa
+    patches = _stub_metax()
+    try:
+        pipeline = PIPELINES[format_name]()
+        latencies = Histogram()
+        failed = 0
+        total = 0.0
+        for record in GENERATORS[format_name](settings):
+            start = timeit.default_timer()
+            try:
+                pipeline(record)
+            except Exception:
+                failed += 1
+            seconds = timeit.default_timer() - start
+            latencies.add(seconds)
+            total += seconds
+    finally:
+        for patch in patches:
+            patch.stop()
+
+    result = {
+        'format': format_name,
+        'records': latencies.count,
+        'failed': failed,
+        'records_per_second': latencies.count / total if total else None,
+        'peak_rss_mib': peak_rss_mib(),
+    }
+    for percent in PERCENTILES:
+        result['p{0}_ms'.format(percent)] = latencies.percentile(percent) * 1e3
+    return result
+
+
+def run_format_in_child(format_name, args):
+    command = [sys.executable, '-m', 'ckanext.etsin.benchmarks.mappers', '--in-process', '--formats', format_name,
+               '--records', str(args.records), '--seed', str(args.seed), '--agents', args.agents,
+               '--languages', args.languages, '--description-size', args.description_size]
+    output = subprocess.check_output(command)
+    return json.loads(output.splitlines()[-1])
+
+
+def print_results(results):
+    print('{0:<10} {1:>8} {2:>7} {3:>10} {4:>9} {5:>9} {6:>9} {7:>10}'.format(
+        'format', 'records', 'failed', 'records/s', 'p50 ms', 'p95 ms', 'p99 ms', 'peak MiB'))
+    for r in results:
+        print('{0:<10} {1:>8} {2:>7} {3:>10.1f} {4:>9.2f} {5:>9.2f} {6:>9.2f} {7:>10.1f}'.format(
+            r['format'], r['records'], r['failed'], r['records_per_second'], r['p50_ms'], r['p95_ms'], r['p99_ms'],
+            r['peak_rss_mib']))
+
+
+def regressions(results, baseline, max_regression):
+    """
+    :return: list of (format, baseline records/sec, records/sec) of the formats slower than the baseline by more
+        than max_regression percent
+    """
+    baseline_by_format = dict((r['format'], r) for r in baseline)
+    slower = []
+    for r in results:
+        base = baseline_by_format.get(r['format'])
+        if base and r['records_per_second'] < base['records_per_second'] * (1 - max_regression / 100.0):
+            slower.append((r['format'], base['records_per_second'], r['records_per_second']))
+    return slower
+
+
+def _range(value):
+    low, _, high = value.partition('-')
+    return int(low), int(high or low)
+
+
+def _settings(args):
+    return CorpusSettings(records=args.records, seed=args.seed, agents=_range(args.agents),
+                          languages=tuple(args.languages.split(',')),
+                          description_size=_range(args.description_size))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the mappers over synthetic corpora')
+    parser.add_argument('--formats', default=','.join(FORMATS), help='comma separated, default all')
+    parser.add_argument('--records', type=int, default=DEFAULT_SETTINGS.records)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SETTINGS.seed)
+    parser.add_argument('--agents', default='{0}-{1}'.format(*DEFAULT_SETTINGS.agents), help='min-max per record')
+    parser.add_argument('--languages', default=','.join(DEFAULT_SETTINGS.languages))
+    parser.add_argument('--description-size', default='{0}-{1}'.format(*DEFAULT_SETTINGS.description_size),
+                        help='min-max characters')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare the results to this JSON file')
+    parser.add_argument('--max-regression', type=float, default=10.0, help='percent, default 10')
+    parser.add_argument('--in-process', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    formats = args.formats.split(',')
+    if args.in_process:
+        for format_name in formats:
+            print(json.dumps(run_format(format_name, _settings(args))))
+        return 0
+
+    results = [run_format_in_child(format_name, args) for format_name in formats]
+    print_results(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.max_regression)
+        for format_name, base, current in slower:
+            print('REGRESSION {0}: {1:.1f} -> {2:.1f} records/s'.format(format_name, base, current))
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
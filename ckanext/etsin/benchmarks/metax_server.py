@@ -0,0 +1,436 @@
+# coding=utf-8
+#
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Local stand-in for the parts of the Metax API the harvester uses, for load testing without a Metax host, eg.
+
+    python -m ckanext.etsin.benchmarks.metax_server --port 8000 --latency 0.05 --error-rate 0.01
+
+and in the CKAN config metax.host = localhost:8000, metax.protocol = http.
+
+Served, with in-memory storage:
+
+* /rest/datasets: create, read by identifier or preferred_identifier, list by data catalog, update, delete one
+  or many, unless the server is started with bulk_delete=False or --no-bulk-delete, when a DELETE of a list of
+  identifiers is answered 405. Like Metax, a POST or PUT of a preferred identifier already in the data catalog is
+  answered 400.
+* /rest/datacatalogs: create, read, update
+* /es/reference_data/_search and _msearch: matching of the reference data given with --reference-data, a JSON
+  list of documents eg. {"type": "license", "uri": "...", "id": "..."}, or a few built-in entries
+* /_standin/stats: request counts by method, resource and status, and the most requests served at once
+
+Authentication is not checked. Every request waits --latency seconds, plus up to --latency-jitter, and fails
+with --error-status with the probability --error-rate.
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from urlparse import parse_qs, urlparse
+
+import logging
+log = logging.getLogger(__name__)
+
+DEFAULT_REFERENCE_DATA = [
+    {'type': 'license', 'uri': 'info:eu-repo/semantics/openAccess', 'id': 'CC-BY-4.0',
+     'label': {'en': 'Creative Commons Attribution 4.0'}},
+    {'type': 'field_of_science', 'code': 'ta5', 'label': {'en': 'social sciences', 'fi': 'yhteiskuntatieteet'}},
+    {'type': 'location', 'code': 'http://www.yso.fi/onto/yso/p94426', 'label': {'en': 'Finland', 'fi': u'Suomi'}},
+]
+
+DATASETS_PATH = re.compile(r'^/rest/datasets/?(?P<id>[^/]+)?/?$')
+DATA_CATALOGS_PATH = re.compile(r'^/rest/datacatalogs/?(?P<id>[^/]+)?/?$')
+
+
+class MetaxError(Exception):
+
+    def __init__(self, status, detail):
+        super(MetaxError, self).__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class MetaxStore(object):
+    """
+    Catalog records, data catalogs and reference data of the stand-in. All methods are thread safe.
+    """
+
+    def __init__(self, reference_data=None):
+        self._lock = threading.Lock()
+        self.datasets = {}
+        # (data catalog, preferred identifier) -> catalog record identifier
+        self._preferred_identifiers = {}
+        # preferred identifier -> catalog record identifiers, in any data catalog
+        self._by_preferred_identifier = {}
+        self.data_catalogs = {}
+        self.reference_data = DEFAULT_REFERENCE_DATA if reference_data is None else reference_data
+
+    @staticmethod
+    def _unique_key(record):
+        return record.get('data_catalog'), record.get('research_dataset', {}).get('preferred_identifier')
+
+    def _check_unique(self, key, identifier=None):
+        if key[1] is not None and self._preferred_identifiers.get(key, identifier) != identifier:
+            raise MetaxError(400, {'research_dataset': [
+                'A catalog record with this research_dataset -> preferred_identifier already exists in this '
+                'data catalog: {0}'.format(key[1])]})
+
+    def create_dataset(self, record):
+        if not isinstance(record, dict) or 'research_dataset' not in record:
+            raise MetaxError(400, {'research_dataset': ['This field is required.']})
+        key = self._unique_key(record)
+        with self._lock:
+            self._check_unique(key)
+            record = dict(record, identifier=str(uuid.uuid4()))
+            self._add(key, record)
+        return record
+
+    def update_dataset(self, identifier, record):
+        key = self._unique_key(record)
+        with self._lock:
+            old = self.datasets.get(identifier)
+            if old is None:
+                raise MetaxError(404, 'Not found.')
+            self._check_unique(key, identifier)
+            self._remove(old)
+            record = dict(record, identifier=identifier)
+            self._add(key, record)
+        return record
+
+    def delete_dataset(self, identifier):
+        with self._lock:
+            record = self.datasets.get(identifier)
+            if record is None:
+                raise MetaxError(404, 'Not found.')
+            self._remove(record)
+
+    def _add(self, key, record):
+        self.datasets[record['identifier']] = record
+        self._preferred_identifiers[key] = record['identifier']
+        self._by_preferred_identifier.setdefault(key[1], set()).add(record['identifier'])
+
+    def _remove(self, record):
+        key = self._unique_key(record)
+        del self.datasets[record['identifier']]
+        self._preferred_identifiers.pop(key, None)
+        self._by_preferred_identifier.get(key[1], set()).discard(record['identifier'])
+
+    def get_dataset(self, identifier):
+        with self._lock:
+            record = self.datasets.get(identifier)
+        if record is None:
+            raise MetaxError(404, 'Not found.')
+        return record
+
+    def get_dataset_by_preferred_identifier(self, preferred_identifier):
+        with self._lock:
+            identifiers = self._by_preferred_identifier.get(preferred_identifier)
+            if identifiers:
+                return self.datasets[min(identifiers)]
+        raise MetaxError(404, 'Not found.')
+
+    def list_datasets(self, data_catalog=None):
+        with self._lock:
+            records = [r for r in self.datasets.itervalues()
+                       if data_catalog is None or r.get('data_catalog') == data_catalog]
+        return sorted(records, key=lambda r: r['identifier'])
+
+    def save_data_catalog(self, catalog, identifier=None):
+        identifier = identifier or catalog.get('catalog_json', {}).get('identifier') or str(uuid.uuid4())
+        catalog = dict(catalog, identifier=identifier)
+        with self._lock:
+            self.data_catalogs[identifier] = catalog
+        return catalog
+
+    def get_data_catalog(self, identifier):
+        with self._lock:
+            catalog = self.data_catalogs.get(identifier)
+        if catalog is None:
+            raise MetaxError(404, 'Not found.')
+        return catalog
+
+    def search_reference_data(self, query):
+        """
+        :param query: Elasticsearch query of the form metax_api sends: a bool query of match clauses
+        :return: Elasticsearch search response
+        """
+        clauses = [clause['match'] for clause in query.get('query', {}).get('bool', {}).get('must', [])
+                   if 'match' in clause]
+        hits = [{'_source': document} for document in self.reference_data
+                if all(_matches(document, field, term) for clause in clauses for field, term in clause.items())]
+        hits = hits[:query.get('size', 10)]
+        return {'hits': {'total': len(hits), 'hits': hits}}
+
+
+def _matches(document, field, term):
+    value = document
+    for part in field.split('.'):
+        if not isinstance(value, dict):
+            return False
+        value = value.get(part)
+    values = value if isinstance(value, list) else [value]
+    term = unicode(term).strip().lower()
+    return any(v is not None and unicode(v).strip().lower() == term for v in values)
+
+
+class Faults(object):
+    """
+    Latency and error injection, changeable while the server runs.
+    """
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, error_rate=0.0, error_status=503, seed=None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+
+    def delay(self):
+        return self.latency + (self._random.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+
+    def fail(self):
+        return self.error_rate > 0 and self._random.random() < self.error_rate
+
+
+class Stats(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.active = 0
+        self.max_active = 0
+
+    def begin(self):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+    def end(self, method, resource, status):
+        key = '{0} {1} {2}'.format(method, resource, status)
+        with self._lock:
+            self.active -= 1
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def as_dict(self):
+        with self._lock:
+            return {'requests': dict(self.requests), 'max_active': self.max_active}
+
+
+class MetaxRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_HEAD(self):
+        self._handle('HEAD')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        resource = url.path.split('/')[2] if url.path.count('/') > 1 else url.path
+        status = 500
+        self.server.stats.begin()
+        try:
+            body = self._read_body()
+            if url.path.startswith('/_standin/'):
+                status, response = 200, self.server.stats.as_dict()
+            else:
+                time.sleep(self.server.faults.delay())
+                if self.server.faults.fail():
+                    status, response = self.server.faults.error_status, {'detail': 'Injected error'}
+                else:
+                    status, response = self._route(method, url.path, parse_qs(url.query), body)
+        except MetaxError as e:
+            status, response = e.status, e.detail if isinstance(e.detail, dict) else {'detail': e.detail}
+        except ValueError as e:
+            status, response = 400, {'detail': 'Invalid JSON: {0}'.format(e)}
+        except Exception as e:
+            log.exception('Stand-in failed to serve {0} {1}'.format(method, self.path))
+            status, response = 500, {'detail': repr(e)}
+        finally:
+            self.server.stats.end(method, resource, status)
+        self._respond(method, status, response)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else ''
+
+    def _respond(self, method, status, response):
+        content = json.dumps(response) if response is not None else ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if method != 'HEAD':
+            self.wfile.write(content)
+
+    def _route(self, method, path, params, body):
+        store = self.server.store
+        if path.startswith('/es/reference_data/_search'):
+            return 200, store.search_reference_data(json.loads(body or '{}'))
+        if path.startswith('/es/reference_data/_msearch'):
+            # Every other line is a header, every other a query
+            queries = [json.loads(line) for line in body.splitlines() if line.strip()][1::2]
+            return 200, {'responses': [store.search_reference_data(query) for query in queries]}
+
+        match = DATASETS_PATH.match(path)
+        if match:
+            return self._datasets(method, match.group('id'), params, body)
+        match = DATA_CATALOGS_PATH.match(path)
+        if match:
+            return self._data_catalogs(method, match.group('id'), body)
+        raise MetaxError(404, 'Not found.')
+
+    def _datasets(self, method, identifier, params, body):
+        store = self.server.store
+        if identifier is None:
+            if method == 'POST':
+                return 201, store.create_dataset(json.loads(body))
+            if method == 'DELETE' and self.server.bulk_delete:
+                identifiers = json.loads(body)
+                for identifier in identifiers:
+                    try:
+                        store.delete_dataset(identifier)
+                    except MetaxError:
+                        pass
+                return 200, identifiers
+            if method in ('GET', 'HEAD'):
+                if 'preferred_identifier' in params:
+                    return 200, store.get_dataset_by_preferred_identifier(params['preferred_identifier'][0])
+                return 200, self._page(store.list_datasets(params.get('data_catalog', [None])[0]), params)
+        elif method in ('GET', 'HEAD'):
+            return 200, store.get_dataset(identifier)
+        elif method == 'PUT':
+            return 200, store.update_dataset(identifier, json.loads(body))
+        elif method == 'DELETE':
+            store.delete_dataset(identifier)
+            return 204, None
+        raise MetaxError(405, 'Method "{0}" not allowed.'.format(method))
+
+    def _page(self, records, params):
+        limit = int(params.get('limit', ['10'])[0])
+        offset = int(params.get('offset', ['0'])[0])
+        fields = params.get('fields', [''])[0].split(',') if 'fields' in params else None
+        research_dataset_fields = params.get('research_dataset_fields', [''])[0].split(',') \
+            if 'research_dataset_fields' in params else None
+        results = []
+        for record in records[offset:offset + limit]:
+            if fields:
+                record = dict((k, v) for k, v in record.items() if k in fields)
+            if research_dataset_fields and 'research_dataset' in record:
+                record = dict(record, research_dataset=dict(
+                    (k, v) for k, v in record['research_dataset'].items() if k in research_dataset_fields))
+            results.append(record)
+        next_url = None
+        if offset + limit < len(records):
+            query = dict((k, v[0]) for k, v in params.items())
+            query['offset'] = offset + limit
+            next_url = '{0}/rest/datasets?{1}'.format(self.server.base_url,
+                                                     '&'.join('{0}={1}'.format(k, v) for k, v in sorted(query.items())))
+        return {'count': len(records), 'next': next_url, 'results': results}
+
+    def _data_catalogs(self, method, identifier, body):
+        store = self.server.store
+        if identifier is None and method == 'POST':
+            return 201, store.save_data_catalog(json.loads(body))
+        if identifier is not None and method in ('GET', 'HEAD'):
+            return 200, store.get_data_catalog(identifier)
+        if identifier is not None and method == 'PUT':
+            store.get_data_catalog(identifier)
+            return 200, store.save_data_catalog(json.loads(body), identifier)
+        raise MetaxError(405, 'Method "{0}" not allowed.'.format(method))
+
+
+class MetaxServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    # Harvesters open many connections at once under load
+    request_queue_size = 128
+
+    def __init__(self, address, store=None, faults=None, bulk_delete=True):
+        HTTPServer.__init__(self, address, MetaxRequestHandler)
+        self.store = store or MetaxStore()
+        self.faults = faults or Faults()
+        self.bulk_delete = bulk_delete
+        self.stats = Stats()
+
+    @property
+    def host(self):
+        return '{0}:{1}'.format(*self.server_address[:2])
+
+    @property
+    def base_url(self):
+        return 'http://' + self.host
+
+
+def start_in_thread(store=None, faults=None, host='127.0.0.1', port=0, bulk_delete=True):
+    """
+    Start a stand-in server in a daemon thread, on a free port by default.
+
+    :return: MetaxServer, stop with shutdown()
+    """
+    server = MetaxServer((host, port), store, faults, bulk_delete)
+    thread = threading.Thread(target=server.serve_forever, name='metax-stand-in')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-in for the Metax API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000, help='0 for any free port')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='up to this many seconds more')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests failing')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--reference-data', help='JSON file of reference data documents')
+    parser.add_argument('--no-bulk-delete', dest='bulk_delete', action='store_false',
+                        help='answer 405 to deleting a list of catalog records')
+    args = parser.parse_args(argv)
+
+    reference_data = None
+    if args.reference_data:
+        with open(args.reference_data) as f:
+            reference_data = json.load(f)
+    server = MetaxServer((args.host, args.port), MetaxStore(reference_data),
+                         Faults(args.latency, args.latency_jitter, args.error_rate, args.error_status, args.seed),
+                         args.bulk_delete)
+    # The load driver reads the address from the first line
+    print('Metax stand-in listening on {0}'.format(server.host))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Recording of the requests to Metax and their responses to a cassette file, and replaying them offline, so that
+performance changes can be benchmarked reproducibly against real response bodies and latencies.
+
+Settings in the CKAN config:
+
+* etsin.cassette.mode: off (the default), record or replay
+* etsin.cassette.path: cassette file, JSON lines of a request and its response each
+* etsin.cassette.time_scale: in replay, responses are delayed by their recorded latency times this. Defaults
+  to 1.0, 0 replays without delays.
+
+A request is matched by its method, URL with query and body; JSON bodies are compared as data, not as text.
+Identical requests are answered with their recorded responses in order, the last one repeatedly. Requests not
+in the cassette fail with CassetteMissError, a requests ConnectionError, as if Metax could not be reached.
+"""
+
+import base64
+import json
+import threading
+import time
+from collections import deque, namedtuple
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from pylons import config
+
+import logging
+log = logging.getLogger(__name__)
+
+MODE_OFF = 'off'
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'
+
+# Exceptions recorded in place of a response, by name
+RECORDED_ERRORS = {
+    'timeout': requests.exceptions.Timeout,
+    'error': requests.exceptions.ConnectionError,
+}
+
+CassetteSettings = namedtuple('CassetteSettings', ['mode', 'path', 'time_scale'])
+
+_settings = None
+_cassette = None
+_lock = threading.Lock()
+
+
+class CassetteMissError(requests.exceptions.ConnectionError):
+    pass
+
+
+def _body_key(body):
+    if not body:
+        return None
+    if isinstance(body, str):
+        body = body.decode('utf-8', 'replace')
+    try:
+        return json.dumps(json.loads(body), sort_keys=True)
+    except ValueError:
+        # Eg. the newline separated queries of a reference data multi search
+        lines = body.splitlines()
+        if len(lines) > 1:
+            try:
+                return '\n'.join(json.dumps(json.loads(line), sort_keys=True) for line in lines if line.strip())
+            except ValueError:
+                pass
+        return body
+
+
+def _prepare(verb, url, kwargs):
+    return requests.Request(verb.upper(), url, params=kwargs.get('params'), data=kwargs.get('data'),
+                            json=kwargs.get('json'), headers=kwargs.get('headers')).prepare()
+
+
+def _key(request):
+    return request.method, request.url, _body_key(request.body)
+
+
+class Cassette(object):
+    """
+    Requests and responses of a cassette file.
+    """
+
+    def __init__(self, path, mode, time_scale=1.0):
+        self.path = path
+        self.mode = mode
+        self.time_scale = time_scale
+        self._lock = threading.Lock()
+        # request key -> deque of entries
+        self._entries = {}
+        if mode == MODE_REPLAY:
+            self._load()
+
+    @property
+    def recording(self):
+        return self.mode == MODE_RECORD
+
+    @property
+    def replaying(self):
+        return self.mode == MODE_REPLAY
+
+    def _load(self):
+        count = 0
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                key = (entry['method'], entry['url'], _body_key(entry.get('body')))
+                self._entries.setdefault(key, deque()).append(entry)
+                count += 1
+        log.info("Loaded {0} recorded requests from cassette {1}".format(count, self.path))
+
+    def record(self, verb, url, kwargs, response=None, seconds=0.0, error=None):
+        """
+        Append a request and its response, or the name of the error it failed with, to the cassette file.
+        """
+        request = _prepare(verb, url, kwargs)
+        entry = {'method': request.method, 'url': request.url, 'body': _text(request.body), 'elapsed': seconds}
+        if error is not None:
+            entry['error'] = error
+        else:
+            entry['status'] = response.status_code
+            entry['content_type'] = response.headers.get('Content-Type')
+            try:
+                entry['content'] = response.content.decode('utf-8')
+            except UnicodeDecodeError:
+                entry['content_base64'] = base64.b64encode(response.content)
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+    def play(self, verb, url, **kwargs):
+        """
+        Answer a request from the cassette, delayed by its recorded latency times time_scale.
+
+        :return: requests Response
+        """
+        request = _prepare(verb, url, kwargs)
+        with self._lock:
+            entries = self._entries.get(_key(request))
+            if not entries:
+                raise CassetteMissError('No recorded response to {0} {1}'.format(request.method, request.url),
+                                        request=request)
+            entry = entries.popleft() if len(entries) > 1 else entries[0]
+
+        if self.time_scale:
+            time.sleep(entry.get('elapsed', 0.0) * self.time_scale)
+        if 'error' in entry:
+            raise RECORDED_ERRORS.get(entry['error'], requests.exceptions.ConnectionError)(
+                'Recorded {0} of {1} {2}'.format(entry['error'], request.method, request.url), request=request)
+
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.url = request.url
+        response.request = request
+        response.encoding = 'utf-8'
+        response.headers = CaseInsensitiveDict()
+        if entry.get('content_type'):
+            response.headers['Content-Type'] = entry['content_type']
+        if 'content_base64' in entry:
+            response._content = base64.b64decode(entry['content_base64'])
+        else:
+            response._content = entry.get('content', u'').encode('utf-8')
+        return response
+
+
+def _text(body):
+    if body is None or isinstance(body, unicode):
+        return body
+    return body.decode('utf-8', 'replace')
+
+
+def get_settings():
+    """
+    Read the cassette settings from config on first use.
+
+    :return: CassetteSettings
+    """
+    global _settings
+    if _settings is None:
+        mode = config.get('etsin.cassette.mode', MODE_OFF) or MODE_OFF
+        path = config.get('etsin.cassette.path')
+        if mode not in (MODE_OFF, MODE_RECORD, MODE_REPLAY):
+            log.error("Unknown etsin.cassette.mode {0}, cassette is off".format(mode))
+            mode = MODE_OFF
+        if mode != MODE_OFF and not path:
+            log.error("etsin.cassette.mode is {0} but etsin.cassette.path is not set, cassette is off".format(mode))
+            mode = MODE_OFF
+        _settings = CassetteSettings(mode=mode, path=path,
+                                     time_scale=float(config.get('etsin.cassette.time_scale', 1.0)))
+    return _settings
+
+
+def get_cassette():
+    """
+    :return: Cassette of the config, or None if the cassette is off
+    """
+    global _cassette
+    settings = get_settings()
+    if settings.mode == MODE_OFF:
+        return None
+    with _lock:
+        if _cassette is None:
+            _cassette = Cassette(settings.path, settings.mode, settings.time_scale)
+    return _cassette
+
+
+def reset():
+    """
+    Forget the settings and cassette, eg. after the config has changed.
+    """
+    global _settings, _cassette
+    with _lock:
+        _settings = None
+        _cassette = None
@@ -8,6 +8,7 @@
 from functionally import first
 from pylons import config
 
+from .agents import Organization, Person
 from .utils import convert_language
 
 
@@ -41,6 +42,8 @@ class CmdiParseHelper:
         self.cmd = cmd
         self.resource_info = resource_info
         self.provider = provider or config.get('ckan.site_url')
+        # Strings shared by the agents of the record
+        self.strings = {}
 
     @staticmethod
     def _strip_first(elements):
@@ -62,100 +65,63 @@ class CmdiParseHelper:
         return [unicode(text).strip() for text in root.xpath(query, namespaces=cls.namespaces)]
 
     @classmethod
-    def _get_organizations(cls, root, xpath):
-        """ Extract organization dictionaries from XML using given Xpath.
+    def _get_organization_names(cls, organization):
+        """ Pair the organization names with their languages.
+
+        :param organization: organization element (lxml)
+        :return: tuple of (language, name) pairs
+        """
+        names = cls._text_xpath(organization, "cmd:organizationInfo/cmd:organizationName/text()")
+        langs = [lang.get('{http://www.w3.org/XML/1998/namespace}lang', 'und').strip() for lang in
+                 organization.xpath("cmd:organizationInfo/cmd:organizationName", namespaces=cls.namespaces)]
+        if len(langs) == len(names):
+            return tuple(zip(langs, names))
+        elif len(langs) == 1:
+            return tuple((langs[0], name) for name in names)
+        return tuple(('und', name) for name in names)
+
+    def _get_organizations(self, root, xpath):
+        """ Extract organizations from XML using given Xpath.
 
         :param root: parent element (lxml) where selection is done.
         :param xpath: xpath selector used to get data
-        :return: list of organization dictionaries
+        :return: list of Organization objects
         """
-        return [{'role': cls._strip_first(organization.xpath("cmd:role/text()", namespaces=cls.namespaces)),
-                 'name': cls._text_xpath(organization, "cmd:organizationInfo/cmd:organizationName/text()"),
-                 'lang': [lang.get('{http://www.w3.org/XML/1998/namespace}lang', 'und').strip() for lang in organization.xpath("cmd:organizationInfo/cmd:organizationName", namespaces=cls.namespaces)],
-                 'short_name': cls._strip_first(organization.xpath("cmd:organizationInfo/cmd:organizationShortName/text()", namespaces=cls.namespaces)),
-                 'email': cls._strip_first(organization.xpath("cmd:organizationInfo/cmd:communicationInfo/cmd:email/text()", namespaces=cls.namespaces)),
-                 'telephoneNumber': cls._strip_first(organization.xpath("cmd:organizationInfo/cmd:communicationInfo/cmd:telephoneNumber/text()", namespaces=cls.namespaces)),
-                 'url': cls._strip_first(organization.xpath("cmd:organizationInfo/cmd:communicationInfo/cmd:url/text()", namespaces=cls.namespaces))}
-
-                for organization in root.xpath(xpath, namespaces=cls.namespaces)]
-
-    @classmethod
-    def _get_persons(cls, root, xpath):
-        """ Extract person dictionary from XML using given Xpath.
+        return [Organization(
+            self._get_organization_names(organization),
+            email=self._strip_first(organization.xpath(
+                "cmd:organizationInfo/cmd:communicationInfo/cmd:email/text()", namespaces=self.namespaces)),
+            telephone=self._strip_first(organization.xpath(
+                "cmd:organizationInfo/cmd:communicationInfo/cmd:telephoneNumber/text()", namespaces=self.namespaces)),
+            homepage=self._strip_first(organization.xpath(
+                "cmd:organizationInfo/cmd:communicationInfo/cmd:url/text()", namespaces=self.namespaces)),
+            strings=self.strings)
+            for organization in root.xpath(xpath, namespaces=self.namespaces)]
+
+    def _get_persons(self, root, xpath):
+        """ Extract persons from XML using given Xpath.
 
         :param root: parent element (lxml) where selection is done
         :param xpath: xpath selector used to get data
-        :return: list of person dictionaries
-        """
-        return [{'role': cls._strip_first(person.xpath("cmd:role/text()", namespaces=cls.namespaces)),
-                 'surname': cls._strip_first(person.xpath("cmd:personInfo/cmd:surname/text()", namespaces=cls.namespaces)),
-                 'given_name': cls._strip_first(person.xpath("cmd:personInfo/cmd:givenName/text()", namespaces=cls.namespaces)),
-                 'email': cls._strip_first(person.xpath("cmd:personInfo/cmd:communicationInfo/cmd:email/text()", namespaces=cls.namespaces)),
-                 'telephoneNumber': cls._strip_first(person.xpath("cmd:personInfo/cmd:communicationInfo/cmd:telephoneNumber/text()", namespaces=cls.namespaces)),
-                 'url': cls._strip_first(person.xpath("cmd:personInfo/cmd:communicationInfo/cmd:url/text()", namespaces=cls.namespaces)),
-                 'organization': first(cls._get_organizations(person, "cmd:personInfo/cmd:affiliation"))}
-                for person in root.xpath(xpath, namespaces=cls.namespaces)]
-
-    @classmethod
-    def _get_person_as_agent(cls, person):
-        """ Converts a person dictionary to MetaX agent format.
-
-        :param person: dictionary produced by the _get_persons method
-        :return: dictionary in the MetaX agent format
-        """
-        member_of_org = cls._get_organization_as_agent(person['organization'])
-        ret_obj = {
-            "@type": "Person",
-            "name": u"{} {}".format(person['given_name'], person['surname']),
-            "email": person['email']
-        }
-
-        if len(person['telephoneNumber']):
-            ret_obj.update({"telephone": [person['telephoneNumber']]})
-
-        if len(person['url']):
-            ret_obj.update({"identifier": person['url']})
-
-        if member_of_org:
-            ret_obj.update({"member_of": member_of_org})
-
-        return ret_obj
-
-    @staticmethod
-    def _get_organization_as_agent(organization):
-        """ Converts an organization dictionary to MetaX agent format.
-
-        :param organization: dictionary produced by the _get_organizations method
-        :return: dictionary in the MetaX agent format
+        :return: list of Person objects
         """
-        if not organization:
-            return {}
-
-        name_obj = {}
-        org_langs = organization.get('lang', [])
-        org_names = organization.get('name', [])
-        if len(org_langs) == len(org_names):
-            for idx, name in enumerate(org_names):
-                name_obj.update({org_langs[idx]: name})
-        elif len(org_langs) == 1:
-            for name in org_names:
-                name_obj.update({org_langs[0]: name})
-        else:
-            for name in org_names:
-                name_obj.update({'und': name})
-
-        ret_obj = {
-            "@type": "Organization",
-            "name": name_obj,
-            "email": organization['email']
-        }
-
-        if len(organization['telephoneNumber']):
-            ret_obj.update({"telephone": [organization['telephoneNumber']]})
-        if len(organization['url']):
-            ret_obj.update({"homepage": {"identifier": organization['url']}})
-
-        return ret_obj
+        persons = []
+        for person in root.xpath(xpath, namespaces=self.namespaces):
+            surname = self._strip_first(person.xpath("cmd:personInfo/cmd:surname/text()", namespaces=self.namespaces))
+            given_name = self._strip_first(person.xpath("cmd:personInfo/cmd:givenName/text()",
+                                                        namespaces=self.namespaces))
+            url = self._strip_first(person.xpath("cmd:personInfo/cmd:communicationInfo/cmd:url/text()",
+                                                 namespaces=self.namespaces))
+            persons.append(Person(
+                u"{} {}".format(given_name, surname),
+                email=self._strip_first(person.xpath("cmd:personInfo/cmd:communicationInfo/cmd:email/text()",
+                                                     namespaces=self.namespaces)),
+                telephone=self._strip_first(person.xpath(
+                    "cmd:personInfo/cmd:communicationInfo/cmd:telephoneNumber/text()", namespaces=self.namespaces)),
+                identifier=url or None,
+                member_of=first(self._get_organizations(person, "cmd:personInfo/cmd:affiliation")),
+                strings=self.strings))
+        return persons
 
     def parse_dataset_languages(self):
         """ Find languages as defined in language info
@@ -237,7 +203,7 @@ class CmdiParseHelper:
         """
         distributor_persons = self._get_persons(
             self.resource_info, "//cmd:distributionInfo/cmd:licenceInfo/cmd:distributionRightsHolderPerson")
-        return self._get_person_as_agent(distributor_persons[0]) if distributor_persons else None
+        return distributor_persons[0].to_metax() if distributor_persons else None
 
     def parse_creators(self):
         """ Get a list of the creators (people or organizations) as agents. """
@@ -251,11 +217,7 @@ class CmdiParseHelper:
             self.resource_info, "//cmd:distributionInfo/cmd:iprHolderPerson")
         creator_organizations = self._get_organizations(
             self.resource_info, "//cmd:distributionInfo/cmd:iprHolderOrganization")
-        return [
-            self._get_person_as_agent(person) for person in creator_persons
-        ] + [
-            self._get_organization_as_agent(organization) for organization in creator_organizations
-        ]
+        return [agent.to_metax() for agent in creator_persons + creator_organizations]
 
     def parse_curators(self):
         """ Get the curators (contacts) as agents. Curators may be people or organizations. """
@@ -263,13 +225,7 @@ class CmdiParseHelper:
             self.resource_info, "//cmd:contactPerson")
         contact_orgs = self._get_organizations(
             self.resource_info, "//cmd:distributionInfo/cmd:licenceInfo/cmd:distributionRightsHolderOrganization")
-        return [
-            self._get_person_as_agent(person)
-            for person in contact_persons
-        ] + [
-            self._get_organization_as_agent(organization)
-            for organization in contact_orgs
-        ]
+        return [agent.to_metax() for agent in contact_persons + contact_orgs]
 
     def parse_metadata_identifiers(self):
         """ Get the metadata identifiers. """
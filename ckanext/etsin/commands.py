@@ -0,0 +1,142 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Paster commands
+"""
+
+import sys
+
+from ckan.lib.cli import CkanCommand
+
+
+class EtsinCommand(CkanCommand):
+    '''Etsin harvester maintenance commands
+
+    Usage:
+
+      etsin resume
+        - Finish or roll back harvest actions left half-done in the harvest journal
+          (requires etsin.journal.path to be set)
+
+      etsin reconcile <harvest source name> [<harvest source name> ...] [--repair]
+        - Compare the Metax data catalog of each harvest source with its CKAN packages.
+          With --repair, delete orphan catalog records from Metax and orphan packages from CKAN
+          so that the next harvest creates them again
+
+      etsin dry_run <harvest source name> <format> <path> [<path> ...] [--limit=<n>]
+        - Map, refine, validate and convert the records in the given XML files or directories as a harvest of
+          the source would, writing nothing to Metax or CKAN, and print what the harvest would do with them.
+          format is the OAI-PMH metadata prefix of the records (cmdi0571, oai_datacite, oai_ddi25) or iso19139.
+          A file may hold one record or an OAI-PMH ListRecords response
+
+      etsin compile_mappings
+        - Compile the identifier mapping CSV files of the refiners to their binary indexes. Indexes are
+          otherwise compiled on first use by each harvester that finds them missing or out of date
+
+    Run with: paster --plugin=ckanext-etsin etsin <command> -c <path to config file>
+    '''
+
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    min_args = 1
+
+    def __init__(self, name):
+        super(EtsinCommand, self).__init__(name)
+        self.parser.add_option('--repair', action='store_true', dest='repair', default=False,
+                               help='Repair the differences found by reconcile')
+        self.parser.add_option('--limit', type='int', dest='limit', default=None,
+                               help='Number of records to dry run at most')
+
+    def command(self):
+        from pylons import config
+
+        self._load_config()
+        # The metrics of a maintenance command are not those of the harvester, so they are not exported
+        config['etsin.metrics.textfile_path'] = None
+
+        cmd = self.args[0]
+        if cmd == 'resume':
+            self.resume()
+        elif cmd == 'reconcile':
+            self.reconcile()
+        elif cmd == 'dry_run':
+            self.dry_run()
+        elif cmd == 'compile_mappings':
+            self.compile_mappings()
+        else:
+            print('Command {0} not recognized'.format(cmd))
+            sys.exit(1)
+
+    def _get_harvest_context(self):
+        import ckan.model as model
+        return {
+            'model': model,
+            'session': model.Session,
+            'user': 'harvest',
+            'ignore_auth': True,
+        }
+
+    def resume(self):
+        from ckanext.etsin import actions, journal
+
+        harvest_journal = journal.get_journal()
+        if harvest_journal is None:
+            print('Harvest journal is not enabled. Set etsin.journal.path in the config file.')
+            sys.exit(1)
+
+        summary = actions.resume_journaled_actions(harvest_journal, self._get_harvest_context)
+        harvest_journal.compact()
+        print('Finished: {finished}, rolled back: {rolled_back}, failed: {failed}'.format(**summary))
+
+    def reconcile(self):
+        from ckanext.etsin.reconcile import reconcile_harvest_source
+
+        harvest_source_names = self.args[1:]
+        if not harvest_source_names:
+            print('Give at least one harvest source name')
+            sys.exit(1)
+
+        for harvest_source_name in harvest_source_names:
+            result = reconcile_harvest_source(harvest_source_name, self._get_harvest_context(), self.options.repair)
+            if result is None:
+                print('{0}: unknown data catalog'.format(harvest_source_name))
+                continue
+            print('{0}: {1} orphan catalog records in Metax, {2} orphan packages in CKAN, {3} stale'.format(
+                harvest_source_name, len(result.metax_orphans), len(result.ckan_orphans), len(result.stale)))
+            for pkg in result.stale:
+                print('  stale: {0} ({1})'.format(pkg.name, pkg.id))
+
+    def dry_run(self):
+        from ckanext.etsin import dry_run, timing
+        from ckanext.etsin.mapper_registry import OAIPMH_MAPPERS
+
+        if len(self.args) < 4:
+            print('Give the harvest source name, the format of the records and the files or directories of them')
+            sys.exit(1)
+        harvest_source_name, format = self.args[1:3]
+        if format not in OAIPMH_MAPPERS and format != dry_run.ISO_19139_FORMAT:
+            print('Unknown format {0}, use one of {1}'.format(
+                format, ', '.join(sorted(OAIPMH_MAPPERS.keys() + [dry_run.ISO_19139_FORMAT]))))
+            sys.exit(1)
+
+        summary = dry_run.dry_run(harvest_source_name, format, dry_run.iter_records(self.args[3:]),
+                                  self._get_harvest_context, self.options.limit)
+        print(summary.format().encode('utf-8'))
+        rows = [row for row in timing.summary() if row[0] == harvest_source_name]
+        if rows:
+            print(timing.format_summary(rows))
+
+    def compile_mappings(self):
+        import glob
+        import os
+        from ckanext.etsin import mapping_index
+
+        resources = os.path.join(os.path.dirname(__file__), 'refiners', 'resources')
+        for csv_path in sorted(glob.glob(os.path.join(resources, '*.csv'))):
+            count = mapping_index.compile_index(csv_path)
+            print('{0}: {1} rows'.format(os.path.basename(csv_path), count))
@@ -0,0 +1,25 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Controllers of the routes added by the plugin
+"""
+
+from pylons import response
+
+from ckan.lib.base import BaseController
+
+from ckanext.etsin import metrics
+
+
+class MetricsController(BaseController):
+
+    def metrics(self):
+        """ Metrics of this web process in the Prometheus text format. The harvester processes count their own
+        metrics, see etsin.metrics.textfile_path. """
+        response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        return metrics.render()
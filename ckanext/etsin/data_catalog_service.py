@@ -7,21 +7,26 @@
 
 import os
 import requests
-from requests import exceptions, put, post, head
+from requests import exceptions
 import json
 from pylons import config
 import logging
 
+from ckanext.etsin import transport
+from ckanext.etsin.refiner_registry import get_data_catalog_filename
+
 log = logging.getLogger(__name__)
 
 
 class DataCatalogMetaxAPIService:
 
-    METAX_HOST = config.get('metax.host')
-    METAX_DATA_CATALOG_API_POST_URL = 'https://{0}/rest/datacatalogs'.format(METAX_HOST)
-    METAX_DATA_CATALOG_DETAIL_URL = METAX_DATA_CATALOG_API_POST_URL + '/{id}'
-
     def __init__(self):
+        # Config is read when the service is created, not when this module is imported
+        self.METAX_HOST = config.get('metax.host')
+        self.METAX_PROTOCOL = config.get('metax.protocol', 'https')
+        self.METAX_DATA_CATALOG_API_POST_URL = '{0}://{1}/rest/datacatalogs'.format(self.METAX_PROTOCOL,
+                                                                                   self.METAX_HOST)
+        self.METAX_DATA_CATALOG_DETAIL_URL = self.METAX_DATA_CATALOG_API_POST_URL + '/{id}'
         self.api_user = config.get('metax.api_user')
         self.api_password = config.get('metax.api_password')
         from ckanext.etsin.utils import str_to_bool
@@ -69,8 +74,8 @@ class DataCatalogMetaxAPIService:
             return True
         log.info("Checking if data catalog with identifier " + data_catalog_id + " already exists in Metax..")
         try:
-            r = head(self.METAX_DATA_CATALOG_DETAIL_URL.format(id=data_catalog_id), verify=self.verify_ssl,
-                     auth=(self.api_user, self.api_password))
+            r = transport.send('head', self.METAX_DATA_CATALOG_DETAIL_URL.format(id=data_catalog_id),
+                               verify=self.verify_ssl, auth=(self.api_user, self.api_password))
             return r.status_code == requests.codes.ok
         except Exception:
             log.error("Checking existence failed for some reason most likely in Metax data catalog API. "
@@ -78,16 +83,16 @@ class DataCatalogMetaxAPIService:
         return True
 
     def _do_put_request(self, url, data):
-        return self._handle_request_response_with_raise(put(url,
-                                                            json=data,
-                                                            auth=(self.api_user, self.api_password),
-                                                            verify=self.verify_ssl))
+        return self._handle_request_response_with_raise(transport.send('put', url,
+                                                                       json=data,
+                                                                       auth=(self.api_user, self.api_password),
+                                                                       verify=self.verify_ssl))
 
     def _do_post_request(self, url, data):
-        return self._handle_request_response_with_raise(post(url,
-                                                             json=data,
-                                                             auth=(self.api_user, self.api_password),
-                                                             verify=self.verify_ssl))
+        return self._handle_request_response_with_raise(transport.send('post', url,
+                                                                       json=data,
+                                                                       auth=(self.api_user, self.api_password),
+                                                                       verify=self.verify_ssl))
 
     @staticmethod
     def _handle_request_response_with_raise(response):
@@ -151,12 +156,8 @@ def ensure_data_catalog_ok(harvest_source_name):
 
 
 def get_data_catalog_filename_for_harvest_source(harvest_source_name):
-    if harvest_source_name == 'syke':
-        return 'syke_data_catalog.json'
-    elif harvest_source_name == 'kielipankki':
-        return 'kielipankki_data_catalog.json'
-    elif harvest_source_name == 'fsd':
-        return 'fsd_data_catalog.json'
-    else:
+    data_catalog_filename = get_data_catalog_filename(harvest_source_name)
+    if data_catalog_filename is None:
         log.error("Unknown harvest source name, unable to do any data catalog related operations. Aborting")
-        return False
\ No newline at end of file
+        return False
+    return data_catalog_filename
@@ -0,0 +1,179 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Index of a DDI 2.5 codeBook built in one walk of the tree, shared by the DDI 2.5 mapper and the FSD refiner.
+The mapper sets the index it built to ddi_index of the context of the harvest actions, when it is given one.
+"""
+
+import logging
+log = logging.getLogger(__name__)
+
+NAMESPACES = {'oai': "http://www.openarchives.org/OAI/2.0/",
+              'ddi': "ddi:codebook:2_5"}
+
+# Top level sections of the codeBook used in mapping
+INDEXED_SECTIONS = ('stdyDscr', 'fileDscr')
+
+# Attributes elements can be looked up by, by their name in find_by and findall_by
+INDEXED_ATTRIBUTES = {
+    'lang': '{http://www.w3.org/XML/1998/namespace}lang',
+    'event': 'event',
+    'vocab': 'vocab',
+}
+
+
+# Paths by (parent path, tag), shared by all indexes so that each distinct path string is built only once
+_path_keys = {}
+MAX_PATH_KEYS = 10000
+
+
+class DDIIndex(object):
+    """
+    Elements of a codeBook by their path of local names relative to the codeBook, eg.
+    'stdyDscr/citation/titlStmt/titl', in document order. Elements can also be looked up by the value of
+    their lang, event or vocab attribute; those sub-indexes are built per path on first use.
+
+    Only the sections of the codeBook used in mapping are indexed, and only the first stdyDscr, since the
+    mapping uses only that. The variable descriptions in dataDscr can be large and are not walked.
+    """
+
+    def __init__(self, codebook, sections=INDEXED_SECTIONS):
+        self.codebook = codebook
+        self._paths = {}
+        self._attributes = {}
+        self._walk(sections)
+
+    def _walk(self, sections):
+        paths = self._paths
+        keys = _path_keys
+        if len(keys) > MAX_PATH_KEYS:
+            keys.clear()
+        stack = []
+        for section in self.codebook:
+            tag = section.tag
+            if not isinstance(tag, basestring):  # pass comments
+                continue
+            key = tag[tag.find('}') + 1:]
+            if key not in sections or (key == 'stdyDscr' and key in paths):
+                continue
+            paths.setdefault(key, []).append(section)
+            stack.append((section, key + '/'))
+        stack.reverse()
+
+        while stack:
+            elem, prefix = stack.pop()
+            children = []
+            for child in elem:
+                tag = child.tag
+                key = keys.get((prefix, tag))
+                if key is None:
+                    if not isinstance(tag, basestring):  # pass comments
+                        continue
+                    key = keys[(prefix, tag)] = prefix + tag[tag.find('}') + 1:]
+                if key in paths:
+                    paths[key].append(child)
+                else:
+                    paths[key] = [child]
+                if len(child):
+                    children.append((child, key + '/'))
+            # Depth first, so that each path list is in document order
+            children.reverse()
+            stack.extend(children)
+
+    def findall(self, path):
+        """
+        :param path: path of local names relative to the codeBook
+        :return: list of elements in document order
+        """
+        return self._paths.get(path, [])
+
+    def find(self, path):
+        """
+        :return: first element of path or None
+        """
+        elements = self._paths.get(path)
+        return elements[0] if elements else None
+
+    def findall_by(self, path, attr_name, value):
+        """
+        :param attr_name: one of lang, event and vocab
+        :return: list of elements of path whose attribute has the given value, in document order
+        """
+        key = (path, attr_name)
+        if key not in self._attributes:
+            by_value = {}
+            attr = INDEXED_ATTRIBUTES[attr_name]
+            for elem in self._paths.get(path, []):
+                by_value.setdefault(elem.get(attr), []).append(elem)
+            self._attributes[key] = by_value
+        return self._attributes[key].get(value, [])
+
+    def find_by(self, path, attr_name, value):
+        """
+        :return: first element of path whose attribute has the given value or None
+        """
+        elements = self.findall_by(path, attr_name, value)
+        return elements[0] if elements else None
+
+    def findall_within(self, ancestor, *paths):
+        """
+        :param ancestor: indexed element
+        :param paths: paths relative to the codeBook, below the path of ancestor
+        :return: list of elements of any of the paths inside ancestor, in document order
+        """
+        elements = []
+        for path in paths:
+            # Number of levels from the elements of path up to ancestor
+            levels = path.count('/') - self._depth(ancestor)
+            for elem in self._paths.get(path, []):
+                parent = elem
+                for _ in range(levels):
+                    parent = parent.getparent()
+                if parent is ancestor:
+                    elements.append(elem)
+        if len(paths) > 1:
+            # Restore document order
+            found = set(elements)
+            tags = set(elem.tag for elem in elements)
+            elements = [elem for elem in ancestor.iter(*tags) if elem in found]
+        return elements
+
+    def _depth(self, elem):
+        depth = 0
+        parent = elem.getparent()
+        while parent is not None and parent is not self.codebook:
+            depth += 1
+            parent = parent.getparent()
+        return depth
+
+
+def build_ddi_index(xml):
+    """
+    Index the codeBook of an OAI-PMH record.
+
+    :param xml: OAI-PMH record xml (lxml)
+    :return: DDIIndex
+    """
+    return DDIIndex(_find_codebook(xml))
+
+
+def _find_codebook(xml):
+    """
+    Find the first codeBook of an OAI-PMH record, like the XPath //oai:record/oai:metadata/ddi:codeBook but
+    stopping at the first match instead of walking the whole document.
+    """
+    metadata_tag = '{{{0}}}metadata'.format(NAMESPACES['oai'])
+    record_tag = '{{{0}}}record'.format(NAMESPACES['oai'])
+    for codebook in xml.getroottree().iter('{{{0}}}codeBook'.format(NAMESPACES['ddi'])):
+        metadata = codebook.getparent()
+        if metadata is None or metadata.tag != metadata_tag:
+            continue
+        record = metadata.getparent()
+        if record is not None and record.tag == record_tag:
+            return codebook
+    return None
@@ -0,0 +1,173 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Dry run of a harvest source over records on disk, eg. to measure mapping throughput or to find records that
+would fail before a production harvest.
+
+Records are mapped like the harvesters map them, then created, updated or deleted with the harvest actions with
+dry_run set in the context (see actions), so they are refined, validated and converted to Metax catalog records
+but nothing is written to Metax, the CKAN database or the harvest journal.
+
+Whether a record would be created or updated is found from the harvest objects of the source in the CKAN
+database. The update action reads the catalog record of an existing package from Metax to tell updated records
+from unchanged ones, and the mappers query reference data from Metax; with etsin.cassette.mode = replay these
+are answered from a recorded cassette instead.
+"""
+
+import threading
+import timeit
+
+from lxml import etree
+
+from ckanext.etsin import dumps, timing
+from ckanext.etsin.mapper_registry import ISO_19139_MAPPER, get_mapper, get_oaipmh_mapper
+
+import logging
+log = logging.getLogger(__name__)
+
+ISO_19139_FORMAT = 'iso19139'
+
+# Problems kept for the summary, the rest are only counted
+MAX_PROBLEMS = 100
+
+
+class DryRunSummary(object):
+    """
+    Outcomes of the records of a dry run.
+
+    :ivar outcomes: dict of outcome -> number of records, eg. would_create, would_update, unchanged or invalid
+    :ivar problems: list of (guid, error message) of the first MAX_PROBLEMS records that were invalid or failed
+    """
+
+    def __init__(self):
+        self.outcomes = {}
+        self.problems = []
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, outcome, guid=None, error=None):
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            if error is not None and len(self.problems) < MAX_PROBLEMS:
+                self.problems.append((guid, unicode(error)))
+
+    @property
+    def records(self):
+        return sum(self.outcomes.values())
+
+    def format(self):
+        """
+        :return: the outcome counts, throughput and problems as text
+        """
+        lines = ['{0} records in {1:.1f} s, {2:.1f} records/s'.format(
+            self.records, self.seconds, self.records / self.seconds if self.seconds else 0.0)]
+        for outcome, count in sorted(self.outcomes.items()):
+            lines.append('  {0:<14} {1:>8}'.format(outcome, count))
+        for guid, error in self.problems:
+            lines.append(u'{0}: {1}'.format(guid, error))
+        return u'\n'.join(lines)
+
+
+def iter_records(paths):
+    """
+    Read the records of XML files of single OAI-PMH records, OAI-PMH ListRecords responses or ISO 19139
+    documents, or of directories or archives of them, see dumps.
+
+    :return: iterator of lxml elements, each the root of its own tree
+    """
+    for xml in dumps.iter_records(paths):
+        yield etree.fromstring(xml)
+
+
+def _get_existing_package_ids(harvest_source_name):
+    """
+    :return: dict of harvest object guid -> CKAN package id of the current harvest objects of the source
+    """
+    import ckan.model as model
+    from ckanext.harvest.model import HarvestObject
+
+    source = model.Package.get(harvest_source_name)
+    if source is None:
+        log.warning("Harvest source {0} not found, every record would be created".format(harvest_source_name))
+        return {}
+    rows = model.Session.query(HarvestObject.guid, HarvestObject.package_id) \
+                        .filter(HarvestObject.harvest_source_id == source.id) \
+                        .filter(HarvestObject.current == True) \
+                        .all()
+    return dict(rows)
+
+
+def _map(format, xml, context):
+    """
+    Map a record like the harvester of its format does.
+
+    :return: (guid, deleted, package dict)
+    """
+    if format == ISO_19139_FORMAT:
+        from ckanext.spatial.model import ISODocument
+
+        iso_values = ISODocument(etree.tostring(xml)).read_values()
+
+        class HarvestObject(object):
+            guid = iso_values['guid']
+
+        with timing.timer('map', source=context['harvest_source_name']):
+            package_dict = get_mapper(*ISO_19139_MAPPER)(context, {'iso_values': iso_values,
+                                                                     'harvest_object': HarvestObject()})
+        return iso_values['guid'], False, package_dict
+
+    guid, deleted = dumps.oaipmh_header(xml)
+    if deleted:
+        return guid, True, None
+    with timing.timer('map', source=context['harvest_source_name']):
+        package_dict = get_oaipmh_mapper(format)(xml, context)
+    return guid, False, package_dict
+
+
+def dry_run(harvest_source_name, format, records, get_context, limit=None):
+    """
+    Run records through a dry run of the harvest actions.
+
+    :param harvest_source_name: name of the harvest source, choosing the refiner and the data catalog
+    :param format: OAI-PMH metadata format of the records, eg. oai_ddi25, or iso19139
+    :param records: iterable of lxml record elements, see iter_records
+    :param get_context: function returning a new action context of the harvest user
+    :param limit: number of records to run at most
+    :return: DryRunSummary
+    """
+    from ckanext.etsin import actions
+
+    summary = DryRunSummary()
+    existing = _get_existing_package_ids(harvest_source_name)
+    start = timeit.default_timer()
+    for count, xml in enumerate(records):
+        if limit is not None and count >= limit:
+            break
+        context = dict(get_context(), harvest_source_name=harvest_source_name, source_data=xml,
+                       dry_run=True, dry_run_summary=summary)
+        guid = None
+        try:
+            guid, deleted, package_dict = _map(format, xml, context)
+            context['guid'] = guid
+            package_id = existing.get(guid)
+            if deleted:
+                if package_id:
+                    actions.package_delete(context, {'id': package_id})
+                else:
+                    summary.add('skipped')
+            elif not package_dict:
+                summary.add('unmapped', guid, 'Mapper returned no package')
+            elif package_id:
+                actions.package_update(context, dict(package_dict, id=package_id))
+            else:
+                actions.package_create(context, package_dict)
+        except Exception as e:
+            log.exception("Dry run of record {0} failed".format(guid))
+            summary.add('failed', guid, repr(e))
+    summary.seconds = timeit.default_timer() - start
+    return summary
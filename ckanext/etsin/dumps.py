@@ -0,0 +1,99 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Reading records from dumps of harvest sources: XML files, directories of them, and tar and zip archives of them.
+
+A file holds a single record or OAI-PMH responses, eg. ListRecords, with many. Responses are parsed
+incrementally and each record is serialized on its own, so that large dumps are not held in memory and the
+records can be handed to other processes.
+"""
+
+import os
+import tarfile
+import zipfile
+
+from lxml import etree
+
+import logging
+log = logging.getLogger(__name__)
+
+OAI_NS = '{http://www.openarchives.org/OAI/2.0/}'
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2')
+ZIP_SUFFIXES = ('.zip',)
+
+
+def iter_files(paths):
+    """
+    :param paths: XML files, tar or zip archives, or directories searched for .xml files
+    :return: iterator of (name, file object) of the XML files, each closed when the next one is read
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, directories, files in os.walk(path):
+                directories.sort()
+                for name in sorted(files):
+                    if name.endswith('.xml'):
+                        with open(os.path.join(directory, name), 'rb') as f:
+                            yield os.path.join(directory, name), f
+        elif path.endswith(TAR_SUFFIXES):
+            with tarfile.open(path) as archive:
+                for member in archive:
+                    if member.isfile() and member.name.endswith('.xml'):
+                        f = archive.extractfile(member)
+                        try:
+                            yield '{0}:{1}'.format(path, member.name), f
+                        finally:
+                            f.close()
+        elif path.endswith(ZIP_SUFFIXES):
+            with zipfile.ZipFile(path) as archive:
+                for info in archive.infolist():
+                    if info.filename.endswith('.xml'):
+                        f = archive.open(info)
+                        try:
+                            yield '{0}:{1}'.format(path, info.filename), f
+                        finally:
+                            f.close()
+        else:
+            with open(path, 'rb') as f:
+                yield path, f
+
+
+def iter_records(paths):
+    """
+    Read the records of dump files. OAI-PMH record elements are read one at a time; a file without them, eg. an
+    ISO 19139 document, is a record as such.
+
+    :param paths: see iter_files
+    :return: iterator of serialized records
+    """
+    for name, f in iter_files(paths):
+        count = 0
+        try:
+            records = etree.iterparse(f, events=('end',), tag=OAI_NS + 'record')
+            for _, record in records:
+                count += 1
+                yield etree.tostring(record)
+                # Free the records read so far
+                record.clear()
+                while record.getprevious() is not None:
+                    del record.getparent()[0]
+            if not count:
+                yield etree.tostring(records.root)
+        except etree.XMLSyntaxError as e:
+            log.error("Unable to parse {0}: {1}".format(name, e))
+
+
+def oaipmh_header(xml):
+    """
+    :param xml: lxml element of an OAI-PMH record
+    :return: (identifier, deleted) of the record, or (None, False) if it has no header
+    """
+    header = xml.find(OAI_NS + 'header')
+    if header is None:
+        return None, False
+    return header.findtext(OAI_NS + 'identifier'), header.get('status') == 'deleted'
@@ -13,4 +13,16 @@ class DatasetFieldsMissingError(Exception):
         if msg is None:
             # Set some default useful error message
             msg = "Package missing relevant fields: %s" % package_dict
-        super(DatasetFieldsMissingError, self).__init__(msg)
\ No newline at end of file
+        super(DatasetFieldsMissingError, self).__init__(msg)
+
+
+class ResearchDatasetInvalidError(Exception):
+    """Exception for situation when a dataset can't be
+      sent to Metax because it does not conform to the research dataset schema"""
+
+    def __init__(self, package_dict, errors):
+        self.errors = errors
+        msg = "Research dataset {0} is invalid: {1}".format(
+            package_dict.get('preferred_identifier', None),
+            '; '.join(u"{0}: {1}".format(e['path'] or '/', e['message']) for e in errors))
+        super(ResearchDatasetInvalidError, self).__init__(msg)
@@ -0,0 +1,191 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Write-ahead journal for harvest actions.
+
+Every harvest package_create, package_update and package_delete writes its
+progress into a local append-only SQLite journal before and after each
+external side effect (Metax, CKAN database). If the harvest process dies in
+the middle of a record, the journal tells which records were left half-done
+so that they can be finished or rolled back without re-mapping them.
+
+The journal is enabled by setting etsin.journal.path in the CKAN config. The entries of finished actions are
+dropped every etsin.journal.compact_interval (default 1000) finished or aborted actions, so that the journal
+does not grow over harvests.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from pylons import config
+
+log = logging.getLogger(__name__)
+
+ACTION_CREATE = 'create'
+ACTION_UPDATE = 'update'
+ACTION_DELETE = 'delete'
+
+# Record accepted, nothing sent anywhere yet
+STEP_BEGIN = 'begin'
+# Metax side done, CKAN database not yet
+STEP_METAX_DONE = 'metax_done'
+# Both Metax and CKAN database done
+STEP_DONE = 'done'
+# Given up, nothing left to finish
+STEP_ABORTED = 'aborted'
+
+TERMINAL_STEPS = (STEP_DONE, STEP_ABORTED)
+
+DEFAULT_COMPACT_INTERVAL = 1000
+
+JournalEntry = namedtuple('JournalEntry', ['seq', 'package_id', 'action', 'step', 'harvest_source_name',
+                                           'preferred_identifier', 'metax_cr_id', 'created', 'guid'])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    package_id TEXT NOT NULL,
+    action TEXT NOT NULL,
+    step TEXT NOT NULL,
+    harvest_source_name TEXT,
+    preferred_identifier TEXT,
+    metax_cr_id TEXT,
+    created REAL NOT NULL,
+    guid TEXT
+);
+CREATE INDEX IF NOT EXISTS journal_package_id_idx ON journal (package_id, seq);
+"""
+
+_LATEST_ENTRIES_SQL = """
+SELECT j.seq, j.package_id, j.action, j.step, j.harvest_source_name,
+       j.preferred_identifier, j.metax_cr_id, j.created, j.guid
+FROM journal j
+JOIN (SELECT package_id, MAX(seq) AS seq FROM journal GROUP BY package_id) latest
+  ON j.seq = latest.seq
+"""
+
+
+class HarvestJournal(object):
+    """
+    Append-only journal of harvest action steps, one row per step.
+
+    The latest row of a package tells how far its action got.
+
+    :param compact_interval: number of actions reaching a terminal step after which the journal is compacted,
+        0 to compact only when compact is called
+    """
+
+    def __init__(self, path, compact_interval=DEFAULT_COMPACT_INTERVAL):
+        self.path = path
+        self.compact_interval = compact_interval
+        self._terminal_steps = 0
+        self._lock = threading.Lock()
+        # Autocommit: each step must be durable as soon as record() returns
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        # Journals written before the guid of the harvest object was recorded
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(journal)')]
+        if 'guid' not in columns:
+            self._conn.execute('ALTER TABLE journal ADD COLUMN guid TEXT')
+
+    def record(self, package_id, action, step, harvest_source_name=None, preferred_identifier=None,
+               metax_cr_id=None, guid=None):
+        """
+        Append a step of an action to the journal.
+
+        :param package_id: CKAN package id the action concerns
+        :param action: one of the ACTION_* constants
+        :param step: one of the STEP_* constants
+        :param harvest_source_name: name of the harvest source the record came from
+        :param preferred_identifier: preferred identifier of the research dataset, if known
+        :param metax_cr_id: Metax catalog record identifier, if known
+        :param guid: guid of the harvest object of the record, if known
+        """
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO journal (package_id, action, step, harvest_source_name, preferred_identifier, '
+                'metax_cr_id, created, guid) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (package_id, action, step, harvest_source_name, preferred_identifier, metax_cr_id, time.time(),
+                 guid))
+            due = False
+            if step in TERMINAL_STEPS and self.compact_interval:
+                self._terminal_steps += 1
+                due = self._terminal_steps >= self.compact_interval
+                if due:
+                    self._terminal_steps = 0
+        if due:
+            removed = self.compact()
+            log.debug("Compacted harvest journal {0}, removed {1} entries".format(self.path, removed))
+
+    def pending(self):
+        """
+        Get the latest entry of every package whose action was left half-done.
+
+        :return: list of JournalEntry objects, oldest first
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                _LATEST_ENTRIES_SQL + ' WHERE j.step NOT IN (?, ?) ORDER BY j.seq', TERMINAL_STEPS).fetchall()
+        return [JournalEntry(*row) for row in rows]
+
+    def history(self, package_id):
+        """
+        Get all entries of a package, oldest first.
+
+        :param package_id: CKAN package id
+        :return: list of JournalEntry objects
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT seq, package_id, action, step, harvest_source_name, preferred_identifier, metax_cr_id, '
+                'created, guid FROM journal WHERE package_id = ? ORDER BY seq', (package_id,)).fetchall()
+        return [JournalEntry(*row) for row in rows]
+
+    def compact(self):
+        """
+        Drop the entries of packages whose latest action has reached a terminal step.
+
+        :return: number of removed rows
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                'DELETE FROM journal WHERE package_id IN '
+                '(SELECT package_id FROM (' + _LATEST_ENTRIES_SQL + ' WHERE j.step IN (?, ?)))', TERMINAL_STEPS)
+            return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    """
+    Get the process wide harvest journal.
+
+    :return: HarvestJournal or None, if etsin.journal.path is not configured
+    """
+    global _journal
+    if _journal is None:
+        path = config.get('etsin.journal.path')
+        if not path:
+            return None
+        with _journal_lock:
+            if _journal is None:
+                log.info("Opening harvest journal {0}".format(path))
+                _journal = HarvestJournal(path, int(config.get('etsin.journal.compact_interval',
+                                                               DEFAULT_COMPACT_INTERVAL)))
+    return _journal
@@ -0,0 +1,38 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Mappers by metadata format.
+
+The mappers are imported on first use, so that CKAN workers and paster commands not harvesting do not pay for
+importing them. This module does not need CKAN, so the mappers can also be run without it, see batch.
+"""
+
+import importlib
+
+# Mapper modules and functions by OAI-PMH metadata format
+OAIPMH_MAPPERS = {
+    'cmdi0571': ('ckanext.etsin.mappers.cmdi', 'cmdi_mapper'),
+    'oai_datacite': ('ckanext.etsin.mappers.datacite', 'datacite_mapper'),
+    'oai_ddi25': ('ckanext.etsin.mappers.ddi25', 'ddi25_mapper'),
+}
+ISO_19139_MAPPER = ('ckanext.etsin.mappers.iso_19139', 'iso_19139_mapper')
+
+
+def get_mapper(module_name, function_name):
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def get_oaipmh_mapper(format):
+    """
+    :param format: OAI-PMH metadata format, eg. oai_ddi25
+    :return: mapper function of the record xml and optionally the context of the harvest actions of the record,
+        to which the mapper may set values for the refiner, or None if the format is not supported
+    """
+    if format not in OAIPMH_MAPPERS:
+        return None
+    return get_mapper(*OAIPMH_MAPPERS[format])
@@ -103,6 +103,6 @@ class CmdiMetaxMapper:
         return package_dict
 
 
-def cmdi_mapper(xml):
+def cmdi_mapper(xml, context=None):
     """ Maps a CMDI record in xml format into a MetaX format dict. """
     return CmdiMetaxMapper.map(xml)
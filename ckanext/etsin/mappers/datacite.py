@@ -11,9 +11,9 @@ Map Datacite 3.1 and 4.0 xml to Metax values
 
 # NOTE: This mapper should be fixed to work with the data model. Currently would break.
 
-from lxml import objectify
+from collections import defaultdict
 
-from ..metax_api import get_ref_data
+from ..metax_api import get_ref_data_batch
 from ..utils import validate_6391, get_language_identifier, is_uri
 
 import logging
@@ -22,12 +22,11 @@ log = logging.getLogger(__name__)
 # Mapper receives an LXML element and maps it to Metax format
 
 
-def datacite_mapper(xml):
+def datacite_mapper(xml, context=None):
 
-    from lxml import etree
-
-    # Strip element prefixes
-    xml = _strip_prefixes(xml)
+    # Index the descendants by local name once. Zenodo uses {namespace}element and OpenAire namespace:element.
+    # The input tree is not modified.
+    index = _index_by_local_name(xml)
 
     # Start with an empty slate
     package_dict = {}
@@ -35,8 +34,8 @@ def datacite_mapper(xml):
     # Map identifier
     # According to DataCite 4.0 schema, IdentifierType should always be "DOI",
     # but OpenAire seems to use URLs as well
-    identifier = xml.find('.//identifier')
-    identifier_type = xml.find('.//identifier').get('identifierType')
+    identifier = _first(index, 'identifier')
+    identifier_type = identifier.get('identifierType')
     if identifier_type == "URL":
         package_dict['preferred_identifier'] = identifier.text
     elif identifier_type == "DOI":
@@ -47,20 +46,20 @@ def datacite_mapper(xml):
 
     # Map creators
     package_dict['creator'] = []
-    for creator in xml.findall('.//creator'):
+    for creator in index['creator']:
         person = _get_person(creator)
         if not person:
             continue
         package_dict['creator'].append(person)
 
     # Map language
-    language = xml.find('.//identifier')
-    if language is not None:
+    language = _text(_first(index, 'language'))
+    if language:
         # Language should be either ISO 639-1 or IETF BCP 47. The first two
         # characters of IETF BCP 47 should be same as ISO 639-1 code.
         if validate_6391(language[0:2]):
-            language = get_language_identifier(language[0:2])
-            package_dict['language'] = language
+            package_dict['language'] = get_language_identifier(language[0:2])
+            language = language[0:2]
         else:
             language = "und"
     else:
@@ -70,33 +69,33 @@ def datacite_mapper(xml):
 
     # Map title
     # In case of multiple primary titles, pick only the first one
-    for title in xml.findall('.//title'):
-        title_type = xml.find('.//title').get('titleType')
+    for title in index['title']:
+        title_type = title.get('titleType')
         if not title_type:
             # Title is primary when there's no titleType
             package_dict['title'] = {language: title.text}
             break
 
     # Map publisher
-    publisher = xml.find('.//publisher').text
+    publisher = _first(index, 'publisher').text
     package_dict['publisher'] = []
     if publisher:
         package_dict['publisher'].append({'name': publisher})
 
     # Map publication year
-    publication_year = xml.find('.//publicationYear').text
+    publication_year = _first(index, 'publicationYear').text
     package_dict['issued'] = publication_year
 
     # Map subject
     package_dict['keyword'] = []
     package_dict['theme'] = []
-    for subject in xml.findall('.//subject'):
+    for subject in index['subject']:
         subject_scheme = subject.get('subjectScheme')
         scheme_URI = subject.get('schemeURI')
         value_URI = subject.get('valueURI')
         if subject_scheme is None and scheme_URI is None:
             package_dict['keyword'].append(subject.text)
-        elif subject_scheme == "YSO" or "finto.fi/yso" in scheme_URI:
+        elif subject_scheme == "YSO" or (scheme_URI and "finto.fi/yso" in scheme_URI):
             if value_URI is not None:
                 package_dict['theme'].append({'identifier': value_URI})
             elif is_uri(subject.text):
@@ -106,8 +105,10 @@ def datacite_mapper(xml):
     package_dict['contributor'] = []
     package_dict['curator'] = []
     package_dict['rights_holder'] = []
-    for contributor in xml.findall('.//contributor'):
-        contributor_type = contributor.find('.//contributorType').text
+    for contributor in index['contributor']:
+        # contributorType is an attribute in DataCite 3.1 and 4.0
+        contributor_type = contributor.get('contributorType') or \
+            _text(_first(_index_by_local_name(contributor), 'contributorType'))
         if contributor_type in ["DataCollector", "DataCurator", "DataManager", "Editor", "Producer", "ProjectLeader", "ProjectMember", "Researcher", "ResearchGroup", "Supervisor"]:
             metax_contributor_type = "contributor"
         elif contributor_type == "Distributor":
@@ -137,7 +138,7 @@ def datacite_mapper(xml):
 
     # Map date
     package_dict['provenance'] = []
-    for date in xml.findall('.//date'):
+    for date in index['date']:
         date_type = date.get('dateType')
         if date_type in ['todo: find correct reference data']:  # TODO
             package_dict['provenance'].append({
@@ -149,7 +150,7 @@ def datacite_mapper(xml):
 
     # Map alternate identifier
     package_dict['other_identifier'] = []
-    for alternate_identifier in xml.findall('.//alternateIdentifier'):
+    for alternate_identifier in index['alternateIdentifier']:
         alternate_identifier_type = alternate_identifier.get(
             'alternateIdentifierType')
         if alternate_identifier_type == "URL":
@@ -160,7 +161,7 @@ def datacite_mapper(xml):
 
     # Map related identifier
     package_dict['related_entity'] = []
-    for related_identifier in xml.findall('.//relatedIdentifier'):
+    for related_identifier in index['relatedIdentifier']:
         related_identifier_type = related_identifier.get('relatedIdentifierType')
         if related_identifier_type == "URL":
             relation_type = related_identifier.get('relationType')
@@ -170,17 +171,16 @@ def datacite_mapper(xml):
             })
 
     # Map version
-    version = xml.find('.//publicationYear')
+    version = _first(index, 'version')
     if version is not None:
         package_dict['version_info'] = version.text
 
     # Map rights
     package_dict['access_rights'] = []
-    for right in xml.findall('.//rights'):
-        rights_URI = right.get('rightsURI')
-
-        # Query reference data for identifier matching this URI
-        rights_identifier = get_ref_data('license', 'uri', rights_URI, 'id')
+    # Query reference data for identifiers matching the rights URIs
+    rights_identifiers = get_ref_data_batch(
+        [('license', 'uri', right.get('rightsURI'), 'id') for right in index['rights']])
+    for right, rights_identifier in zip(index['rights'], rights_identifiers):
         if rights_identifier is not None:
             package_dict['access_rights'].append({
                 'description': right.text,
@@ -193,73 +193,92 @@ def datacite_mapper(xml):
 
     # Map description
     full_description = ""
-    for description in xml.findall('.//description'):
+    for description in index['description']:
         full_description += description.get('descriptionType') + \
             ': ' + description.text + ' '
     package_dict['description'] = [{language: full_description}]
 
     # Map geolocation
     package_dict['location'] = []
-    for location in xml.findall('.//geoLocation'):
-        point = location.find('.//geoLocationPoint')
+    for location in index['geoLocation']:
+        location_index = _index_by_local_name(location)
+        point = _first(location_index, 'geoLocationPoint')
         if point is not None:
-            longitude = point.find('.//pointLongitude').text
-            latitude = point.find('.//pointLatitude').text
+            longitude = _first(location_index, 'pointLongitude').text
+            latitude = _first(location_index, 'pointLatitude').text
             package_dict['location'].append({
                 "as_wkt": "POINT (" + longitude + " " + latitude + ")"})
-        box = location.find('.//geoLocationBox')
+        box = _first(location_index, 'geoLocationBox')
         if box is not None:
-            west = point.find('.//westBoundLongitude').text
-            east = point.find('.//eastBoundLongitude').text
-            north = point.find('.//northBoundLatitude').text
-            south = point.find('.//soundBoundLatitude').text
+            west = _first(location_index, 'westBoundLongitude').text
+            east = _first(location_index, 'eastBoundLongitude').text
+            north = _first(location_index, 'northBoundLatitude').text
+            south = _first(location_index, 'southBoundLatitude').text
             package_dict['location'].append({
                 "as_wkt": "POLYGON ((" + west + " " + south + ", " + west + " " + north + ", " + east + " " + north + ", " + east + " " + south + ", " + west + " " + south + "))"})
-        place = location.find('.//geoLocationPlace')
+        place = _first(location_index, 'geoLocationPlace')
         if place is not None:
             package_dict['location'].append({"geographic_name": place.text})
-        polygon = location.find('.//geoLocationPolygon')
+        polygon = _first(location_index, 'geoLocationPolygon')
         if polygon is not None:
-            polygon_string = "POLYGON (("
-            for point in xml.findall('.//polygonPoint'):
-                longitude = point.find('.//pointLongitude').text
-                latitude = point.find('.//pointLatitude').text
-                polygon_string += longitude + " " + latitude + ", "
-            polygon_string[-2:] = "))"  # replace last ", "
+            polygon_points = []
+            for point in _index_by_local_name(polygon)['polygonPoint']:
+                point_index = _index_by_local_name(point)
+                polygon_points.append(_first(point_index, 'pointLongitude').text + " " +
+                                      _first(point_index, 'pointLatitude').text)
+            package_dict['location'].append({
+                "as_wkt": "POLYGON ((" + ", ".join(polygon_points) + "))"})
 
     return {
         "research_dataset": package_dict}
 
 
-def _strip_prefixes(xml):
-    root = xml.getroottree()
+def _local_name(tag):
+    i = tag.find('}')
+    if i >= 0:
+        return tag[i + 1:]
+    i = tag.find(':')
+    if i >= 0:
+        return tag[i + 1:]
+    return tag
 
-    # Zenodo uses {namespace}element
-    for elem in root.getiterator():
-        if not hasattr(elem.tag, 'find'):  # pass comments
+
+def _index_by_local_name(element):
+    '''
+    Index the descendants of element by their local name, in document order, in one walk of the subtree.
+    Missing names give an empty list.
+    '''
+    index = defaultdict(list)
+    for elem in element.iterdescendants():
+        if not isinstance(elem.tag, basestring):  # pass comments
             continue
+        index[_local_name(elem.tag)].append(elem)
+    return index
+
 
-        i = elem.tag.find('}')
-        if i >= 0:
-            elem.tag = elem.tag[i + 1:]
+def _first(index, name):
+    elements = index.get(name)
+    return elements[0] if elements else None
 
-    # OpenAire uses namespace:element
-    objectify.deannotate(root, cleanup_namespaces=True)
 
-    return xml
+def _text(element):
+    return element.text if element is not None else None
 
 
 def _get_person(person):
     '''
     Input: LXML element that contains either DataCite creator or contributor.
     '''
+    index = _index_by_local_name(person)
     person_dict = {'@type': 'Person'}
-    name = person.find('.//creatorName')
+    name = _first(index, 'creatorName')
     if name is None:
-        name = person.find('.//contributorName')
+        name = _first(index, 'contributorName')
+    if name is None:
+        return {}
     family_name = name.get('familyName')
     given_name = name.get('givenName')
-    if name is not None and name.text:
+    if name.text:
         person_dict['name'] = name.text
     elif family_name:
         person_dict['name'] = family_name
@@ -269,16 +288,17 @@ def _get_person(person):
         person_dict['name'] = given_name
     else:
         return {}
-    if person.find('.//nameIdentifier') is not None:
-        identifier = person.find('.//nameIdentifier')
+    identifier = _first(index, 'nameIdentifier')
+    if identifier is not None:
         identifier_scheme = identifier.get('nameIdentifierScheme')
         # TODO: There are some more schemes we want to map. Waiting for the
         # list.
-        if identifier is not None and identifier_scheme == "URL":
+        if identifier_scheme == "URL":
             person_dict['identifier'] = identifier.text
 
-    if person.find('.//affiliation') is not None:
-        affiliation = person.find('.//affiliation').text
+    affiliation = _first(index, 'affiliation')
+    if affiliation is not None:
+        affiliation = affiliation.text
         if affiliation is not None:
             person_dict['member_of'] = {
                 "@type": 'Organization',
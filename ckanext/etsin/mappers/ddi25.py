@@ -9,36 +9,37 @@
 
 from functionally import first
 
-from ..metax_api import get_ref_data
-from ..utils import get_tag_lang, get_string_as_valid_datetime_string
+from ..ddi_index import build_ddi_index
+from ..metax_api import get_ref_data_batch
+from ..utils import get_tag_lang, get_string_as_valid_datetime_string, normalize_dates
 
 # For development use
 import logging
 log = logging.getLogger(__name__)
 
 
-def ddi25_mapper(xml):
+def ddi25_mapper(xml, context=None):
     """ Convert given DDI 2.5 XML into MetaX format dict.
     :param xml: xml element (lxml)
+    :param context: context of the harvest actions of the record, if known. The DDIIndex of the record is set
+                    to its ddi_index, so that the refiner does not index the record again.
     :return: dictionary
     """
 
-    namespaces = {'oai': "http://www.openarchives.org/OAI/2.0/",
-                  'ddi': "ddi:codebook:2_5"}
-
-    cb = first(xml.xpath('//oai:record/oai:metadata/ddi:codeBook', namespaces=namespaces))
-    stdy = cb.find('ddi:stdyDscr', namespaces)
+    index = build_ddi_index(xml)
+    if context is not None:
+        context['ddi_index'] = index
 
     # Preferred identifier
     pref_id = None
-    id_nos = stdy.findall('ddi:citation/ddi:titlStmt/ddi:IDNo', namespaces)
+    id_nos = index.findall('stdyDscr/citation/titlStmt/IDNo')
     id_no = first(filter(lambda x: x.get('agency') == 'URN', id_nos))
     if id_no is not None:
         pref_id = id_no.text
 
     # Title
     title = {}
-    titl = stdy.findall('ddi:citation/ddi:titlStmt/ddi:titl', namespaces)
+    titl = index.findall('stdyDscr/citation/titlStmt/titl')
     if len(titl):
         for t in titl:
             title[get_tag_lang(t)] = t.text
@@ -47,10 +48,9 @@ def ddi25_mapper(xml):
     # Assume that 'AuthEnty' tags for different language 'citations' are in same order
     creators = []
     try:
-        for i, citation in enumerate(stdy.findall('ddi:citation', namespaces)):
-            for j, author in enumerate(citation.xpath(
-                    'ddi:rspStmt/ddi:AuthEnty|ddi:rspStmt/ddi:othId',
-                    namespaces=namespaces)):
+        for i, citation in enumerate(index.findall('stdyDscr/citation')):
+            for j, author in enumerate(index.findall_within(
+                    citation, 'stdyDscr/citation/rspStmt/AuthEnty', 'stdyDscr/citation/rspStmt/othId')):
                 agent_obj = {'name': None}
                 if 'affiliation' in author.keys():
                     org = author.get('affiliation')
@@ -82,14 +82,14 @@ def ddi25_mapper(xml):
 
     # Modified
     modified = None
-    ver_stmt = stdy.find('ddi:citation/ddi:verStmt/ddi:version', namespaces)
+    ver_stmt = index.find('stdyDscr/citation/verStmt/version')
     if ver_stmt is not None and ver_stmt.get('date'):
         modified = get_string_as_valid_datetime_string(ver_stmt.get('date'), '01-01')
 
     # Description
     description = {}
     try:
-        for abstract in stdy.findall('ddi:stdyInfo/ddi:abstract', namespaces):
+        for abstract in index.findall('stdyDscr/stdyInfo/abstract'):
             description[get_tag_lang(abstract)] = unicode(abstract.text).strip()
     except Exception as e:
         log.error('Error parsing "description": {0}: {1}'.format(e.__class__.__name__, e))
@@ -97,17 +97,25 @@ def ddi25_mapper(xml):
 
     # Keywords
     keywords = []
-    for kw in stdy.findall('ddi:stdyInfo/ddi:subject/ddi:keyword', namespaces):
+    for kw in index.findall('stdyDscr/stdyInfo/subject/keyword'):
         keywords.append(kw.text.strip())
     vocab = 'CESSDA Topic Classification'
-    for cterm in stdy.findall("ddi:stdyInfo/ddi:subject/ddi:topcClas[@vocab='{0}']".format(vocab), namespaces):
+    for cterm in index.findall_by('stdyDscr/stdyInfo/subject/topcClas', 'vocab', vocab):
         keywords.append(cterm.text.strip())
 
-    # Field of science
-    codes = set()
-    for fos in stdy.findall("ddi:stdyInfo/ddi:subject/ddi:topcClas[@vocab='OKM']", namespaces):
+    # Reference data: field of science terms, and Finnish nation name assuming Finland, so search ES for
+    # Finnish place names. Resolved together with one multi search request.
+    ref_data_queries = []
+    for fos in index.findall_by('stdyDscr/stdyInfo/subject/topcClas', 'vocab', 'OKM'):
         field = 'label.' + get_tag_lang(fos)
-        codes.add(get_ref_data('field_of_science', field, fos.text.strip(), 'code'))
+        ref_data_queries.append(('field_of_science', field, fos.text.strip(), 'code'))
+    nat_fi = index.find_by('stdyDscr/stdyInfo/sumDscr/nation', 'lang', 'fi')
+    if nat_fi is not None:
+        ref_data_queries.append(('location', 'label.fi', nat_fi.text.strip(), 'code'))
+    ref_data = get_ref_data_batch(ref_data_queries)
+
+    # Field of science
+    codes = set(ref_data[:-1] if nat_fi is not None else ref_data)
     field_of_science = [{'identifier': c} for c in codes ]
     if not len(field_of_science):
         log.debug("No 'field of science' found.")
@@ -123,28 +131,35 @@ def ddi25_mapper(xml):
                             "fi": "Julkaisijan kotisivu"},
                         "identifier": ""}
     }
-    for dist in stdy.findall('ddi:citation/ddi:distStmt', namespaces):
-        distr = dist.find('ddi:distrbtr', namespaces)
+    for dist in index.findall('stdyDscr/citation/distStmt'):
+        distr = first(index.findall_within(dist, 'stdyDscr/citation/distStmt/distrbtr'))
         publisher['name'][get_tag_lang(distr)] = distr.text.strip()
         publisher['homepage']['identifier'] = distr.get('URI')
 
     # Temporal coverage
-    tpath = "ddi:stdyInfo/ddi:sumDscr/ddi:{tag}[@event='{ev}']"
-    tstart = stdy.find(tpath.format(tag='timePrd', ev='start'), namespaces) or\
-        stdy.find(tpath.format(tag='collDate', ev='start'), namespaces)
-    tend = stdy.find(tpath.format(tag='timePrd', ev='end'), namespaces) or\
-        stdy.find(tpath.format(tag='collDate', ev='end'), namespaces)
+    tpath = 'stdyDscr/stdyInfo/sumDscr/{tag}'
+    tstart = index.find_by(tpath.format(tag='timePrd'), 'event', 'start') or\
+        index.find_by(tpath.format(tag='collDate'), 'event', 'start')
+    tend = index.find_by(tpath.format(tag='timePrd'), 'event', 'end') or\
+        index.find_by(tpath.format(tag='collDate'), 'event', 'end')
     if tstart is None and tend is None:
-        tstart = stdy.find(tpath.format(tag='timePrd', ev='single'), namespaces) or\
-                 stdy.find(tpath.format(tag='collDate', ev='single'), namespaces)
+        tstart = index.find_by(tpath.format(tag='timePrd'), 'event', 'single') or\
+                 index.find_by(tpath.format(tag='collDate'), 'event', 'single')
         tend = tstart
     elif tstart is None or tend is None:
         log.error('No temporal coverage or only start or end date in dataset!')
 
+    # Normalize the collection and production dates together
+    prod = index.find('stdyDscr/citation/prodStmt/prodDate')
+    prod_date = prod.text.strip() if prod is not None and prod.text else None
+    start_dt, prod_start_dt = normalize_dates([tstart.get('date') if tstart is not None else None, prod_date],
+                                              '01-01', '00:00:00')
+    end_dt, prod_end_dt = normalize_dates([tend.get('date') if tend is not None else None, prod_date],
+                                          '12-31', '23:59:59')
+
     temporal_coverage_obj_1 = {}
 
     if tstart is not None and tstart.get('date'):
-        start_dt = get_string_as_valid_datetime_string(tstart.get('date'), '01-01', '00:00:00')
         if start_dt is None:
             temporal_coverage_obj_1['temporal_coverage'] = tstart.get('date')
             if tend is not None and tend.get('date'):
@@ -152,13 +167,12 @@ def ddi25_mapper(xml):
         else:
             temporal_coverage_obj_1['start_date'] = start_dt
             if tend is not None and tend.get('date'):
-                end_dt = get_string_as_valid_datetime_string(tend.get('date'), '12-31', '23:59:59')
                 if end_dt is not None:
                     temporal_coverage_obj_1['end_date'] = end_dt
 
     # Provenance
     universe = {}
-    univ = stdy.findall("ddi:stdyInfo/ddi:sumDscr/ddi:universe", namespaces)
+    univ = index.findall('stdyDscr/stdyInfo/sumDscr/universe')
     for u in univ:
         universe[get_tag_lang(u)] = u.text.strip()
     provenance = [{'title': {'en': 'Collection'},
@@ -170,18 +184,15 @@ def ddi25_mapper(xml):
         provenance[0]['temporal'] = temporal_coverage_obj_1
 
     # Production
-    prod = stdy.find('ddi:citation/ddi:prodStmt/ddi:prodDate', namespaces)
     if prod is not None:
         temporal_coverage_obj_2 = {}
 
         if prod.text:
-            start_dt = get_string_as_valid_datetime_string(prod.text.strip(), '01-01', '00:00:00')
-            if start_dt is None:
-                temporal_coverage_obj_2['temporal_coverage'] = prod.text.strip()
+            if prod_start_dt is None:
+                temporal_coverage_obj_2['temporal_coverage'] = prod_date
             else:
-                temporal_coverage_obj_2['start_date'] = start_dt
-                temporal_coverage_obj_2['end_date'] = get_string_as_valid_datetime_string(prod.text.strip(), '12-31',
-                                                                                      '23:59:59')
+                temporal_coverage_obj_2['start_date'] = prod_start_dt
+                temporal_coverage_obj_2['end_date'] = prod_end_dt
         provenance.append(
             {'title': {'en': 'Production'},
              'description': {'en': 'Date when the data collection were'
@@ -191,16 +202,11 @@ def ddi25_mapper(xml):
 
     # Geographical coverage
     spatial = [{}]
-    lang_attr = '{http://www.w3.org/XML/1998/namespace}lang'
-    lang_path = "ddi:stdyInfo/ddi:sumDscr/ddi:nation[@{la}='{lt}']"
-    nat_fi = stdy.find(lang_path.format(la=lang_attr, lt='fi'), namespaces)
-    nat_en = stdy.find(lang_path.format(la=lang_attr, lt='en'), namespaces)
+    nat_en = index.find_by('stdyDscr/stdyInfo/sumDscr/nation', 'lang', 'en')
     if nat_en is not None:
         spatial = [{'geographic_name': nat_en.text.strip()}]
     if nat_fi is not None:
-        # Assume Finland so search ES for Finnish place names: 'nat_fi'
-        spat_id = get_ref_data('location', 'label.fi', nat_fi.text.strip(),
-                               'code')
+        spat_id = ref_data[-1]
         if spat_id is not None:
             spatial[0]['place_uri'] = {'identifier': spat_id}
         if spatial[0].get('geographic_name') is None:
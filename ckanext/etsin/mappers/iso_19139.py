@@ -9,12 +9,13 @@
 Map ISO 19139 dicts to Metax values
 """
 
-from iso639 import languages
 from ..utils import get_language_identifier,\
                     convert_language_to_6391,\
                     convert_bbox_to_polygon, \
                     get_string_as_valid_datetime_string, \
-                    get_string_as_valid_date_string
+                    get_string_as_valid_date_string, \
+                    normalize_dates
+from .spec import Field, OMIT, compile_spec, first_item
 
 import logging
 
@@ -34,230 +35,191 @@ def iso_19139_mapper(context, data_dict):
     context['guid'] = data_dict['harvest_object'].guid
 
     # Find out metadata language
-    # Use und, if language code not given or isn't valid ISO 639-3
-    try:
-        lang = languages.get(part3=iso_values['metadata-language']).part3
-        meta_lang = convert_language_to_6391(lang)
-    except Exception:
-        meta_lang = 'und'
+    # Use und, if language code not given or isn't valid ISO 639-3 or has no ISO 639-1 code
+    meta_lang = convert_language_to_6391(iso_values.get('metadata-language', None)) or 'und'
 
-    # Ensure meta_lang exists
-    if not meta_lang:
-        meta_lang = 'und'
+    env = {'meta_lang': meta_lang, 'context': context}
+    errors = ISO_19139_SPEC.apply(iso_values, package_dict, env)
+    if errors:
+        log.error("Unable to map fields {0} of {1}".format([target for target, e in errors], context['guid']))
 
-    # Find title
-    try:
-        package_dict['title'] = {meta_lang: iso_values['title']}
-    except KeyError:
-        package_dict['title'] = {'und': ''}
+    # Group responsible parties by role once, the agent fields below are built from the groups
+    agents_by_role = _group_agents_by_role(iso_values.get('responsible-organisation', []))
 
-    # Dataset language
-    package_dict['language'] = []
-    try:
-        dataset_lang = (lang for lang in iso_values['dataset-language'])
-        for ds_lang in dataset_lang:
-            package_dict['language'].append({'identifier': get_language_identifier(ds_lang)})
-    except Exception:
-        pass
+    # Dataset creators
+    for creator in agents_by_role['author'] + agents_by_role['originator']:
+        _set_agent_details_to_package_dict_field(package_dict, 'creator', creator, True, meta_lang)
 
-    # Description
-    try:
-        package_dict['description'] = {meta_lang: iso_values['abstract']}
-    except KeyError:
-        pass
+    # Dataset curator
+    for curator in agents_by_role['pointOfContact'] + agents_by_role['custodian']:
+        _set_agent_details_to_package_dict_field(package_dict, 'curator', curator, True, meta_lang)
 
-    # Field of Science
-    try:
-        if len(iso_values['topic-category']):
-            topic_cat = iso_values['topic-category'][0]
-            if topic_cat == 'environment':
-                package_dict['field_of_science'] = [{'identifier': 'ta1172'}]
-            elif topic_cat == 'planningCadastre':
-                package_dict['field_of_science'] = [{'identifier': 'ta212'}]
-            elif topic_cat == 'transportation':
-                package_dict['field_of_science'] = [{'identifier': 'ta212'}]
-            elif topic_cat == 'economy':
-                package_dict['field_of_science'] = [{'identifier': 'ta5'}]
-            elif topic_cat == 'biota':
-                package_dict['field_of_science'] = [{'identifier': 'ta1181'}, {'identifier': 'ta1183'}]
-            elif topic_cat == 'utilitiesCommunication':
-                package_dict['field_of_science'] = [{'identifier': 'ta218'}, {'identifier': 'ta213'}]
-            elif topic_cat == 'geoscientificInformation':
-                package_dict['field_of_science'] = [{'identifier': 'ta1171'}]
-            elif topic_cat == 'climatologyMeteorologyAtmosphere':
-                package_dict['field_of_science'] = [{'identifier': 'ta1171'}]
-            elif topic_cat == 'farming':
-                package_dict['field_of_science'] = [{'identifier': 'ta412'}, {'identifier': 'ta4111'}]
-            elif topic_cat == 'inlandWaters':
-                package_dict['field_of_science'] = [{'identifier': 'ta1171'}]
-            elif topic_cat == 'health':
-                package_dict['field_of_science'] = [{'identifier': 'ta316'}, {'identifier': 'ta3142'}]
-            elif topic_cat == 'society':
-                package_dict['field_of_science'] = [{'identifier': 'ta5'}]
-            else:
-                package_dict['field_of_science'] = []
-    except KeyError:
-        package_dict['field_of_science'] = []
+    # Dataset publisher / distributor
+    # Only one publisher can be set in target data model. If there is no distributor, try another role for
+    # dataset publisher
+    publishers = agents_by_role['distributor'] or agents_by_role['publisher']
+    if publishers:
+        _set_agent_details_to_package_dict_field(package_dict, 'publisher', publishers[0], False, meta_lang)
 
-    # Dataset creators
-    try:
-        authors = (org for org in iso_values['responsible-organisation'] if 'author' in org['role'])
-        for author in authors:
-            _set_agent_details_to_package_dict_field(package_dict, 'creator', author, True, meta_lang)
+    # Dataset rights holder
+    for owner in agents_by_role['owner']:
+        _set_agent_details_to_package_dict_field(package_dict, 'rights_holder', owner, True, meta_lang)
 
-        originators = (org for org in iso_values['responsible-organisation'] if 'originator' in org['role'])
-        for originator in originators:
-            _set_agent_details_to_package_dict_field(package_dict, 'creator', originator, True, meta_lang)
-    except KeyError:
-        pass
+    # Dataset contributor
+    for contributor in agents_by_role['contributor']:
+        _set_agent_details_to_package_dict_field(package_dict, 'contributor', contributor, True, meta_lang)
 
-    # Dataset curator
-    try:
-        pocs = (org for org in iso_values['responsible-organisation'] if 'pointOfContact' in org['role'])
-        for poc in pocs:
-            _set_agent_details_to_package_dict_field(package_dict, 'curator', poc, True, meta_lang)
+    return package_dict
 
-        custodians = (org for org in iso_values['responsible-organisation'] if 'custodian' in org['role'])
-        for custodian in custodians:
-            _set_agent_details_to_package_dict_field(package_dict, 'curator', custodian, True, meta_lang)
-    except KeyError:
-        pass
 
-    # Dataset publisher / distributor
-    try:
-        distributors = (org for org in iso_values['responsible-organisation'] if 'distributor' in org['role'])
-        for distributor in distributors:
-            _set_agent_details_to_package_dict_field(package_dict, 'publisher', distributor, False, meta_lang)
-            # Only one publisher can be set in target data model
-            break
-    except KeyError:
-        pass
+# Field of science identifiers for ISO 19139 topic categories
+TOPIC_CATEGORY_FIELDS_OF_SCIENCE = {
+    'environment': ('ta1172',),
+    'planningCadastre': ('ta212',),
+    'transportation': ('ta212',),
+    'economy': ('ta5',),
+    'biota': ('ta1181', 'ta1183'),
+    'utilitiesCommunication': ('ta218', 'ta213'),
+    'geoscientificInformation': ('ta1171',),
+    'climatologyMeteorologyAtmosphere': ('ta1171',),
+    'farming': ('ta412', 'ta4111'),
+    'inlandWaters': ('ta1171',),
+    'health': ('ta316', 'ta3142'),
+    'society': ('ta5',),
+}
 
-    # If publisher has not been set, try another role for dataset publisher
-    if 'publisher' not in package_dict:
-        try:
-            publishers = (org for org in iso_values['responsible-organisation'] if 'publisher' in org['role'])
-            for publisher in publishers:
-                _set_agent_details_to_package_dict_field(package_dict, 'publisher', publisher, False, meta_lang)
-                # Only one publisher can be set in target data model
-                break
-        except KeyError:
-            pass
 
-    # Dataset rights holder
-    try:
-        owners = (org for org in iso_values['responsible-organisation'] if 'owner' in org['role'])
-        for owner in owners:
-            _set_agent_details_to_package_dict_field(package_dict, 'rights_holder', owner, True, meta_lang)
-    except KeyError:
-        pass
+def _lang_string(value, env):
+    return {env['meta_lang']: value}
 
-    # Dataset contributor
+
+def _languages(dataset_languages, env):
+    return [{'identifier': get_language_identifier(ds_lang)} for ds_lang in dataset_languages]
+
+
+def _identifiers(identifiers, env):
+    return [{'identifier': identifier} for identifier in identifiers]
+
+
+def _datetime(value, env):
+    modified = get_string_as_valid_datetime_string(value)
+    if modified is None:
+        log.error("Unable to interpret {0} {1} as datetime".format(env['source_key'], value))
+        return OMIT
+    return modified
+
+
+def _date(value, env):
+    issued = get_string_as_valid_date_string(value)
+    if issued is None:
+        log.error("Unable to interpret {0} {1} as date".format(env['source_key'], value))
+        return OMIT
+    return issued
+
+
+def _spatial(bboxes, env):
+    spatial = []
+    for bbox in bboxes:
+        if 'north' in bbox and 'east' in bbox and 'south' in bbox and 'west' in bbox:
+            polygon = convert_bbox_to_polygon(bbox['north'], bbox['east'], bbox['south'], bbox['west'])
+            spatial.append({'as_wkt': [polygon]})
+    return spatial
+
+
+def _temporal(iso_values, env):
+    # Assumption is same index within temporal-extent-begin and -end are related
+    begins = iso_values.get('temporal-extent-begin', [])
+    ends = iso_values.get('temporal-extent-end', [])
+    if len(begins) != len(ends) or not len(begins):
+        return OMIT
+
+    temporal = []
+    start_dts = normalize_dates(begins, '01-01', '00:00:00')
+    end_dts = normalize_dates(ends, '12-31', '23:59:59')
     try:
-        contributors = (org for org in iso_values['responsible-organisation'] if 'processor' in org['role'] or
-                        'user' in org['role'])
-        for contributor in contributors:
-            _set_agent_details_to_package_dict_field(package_dict, 'contributor', contributor, True, meta_lang)
+        for start_date, end_date, start_dt, end_dt in zip(begins, ends, start_dts, end_dts):
+            temporal_obj = {}
+            if start_date:
+                if start_dt is None:
+                    temporal_obj['temporal_coverage'] = start_date
+                else:
+                    temporal_obj['start_date'] = start_dt
+            if end_date:
+                if end_dt is None:
+                    temporal_obj['temporal_coverage'] += ' - ' + end_date
+                else:
+                    temporal_obj['end_date'] = end_dt
+
+            if temporal_obj:
+                temporal.append(temporal_obj)
     except KeyError:
+        # Unparseable end without start, keep the periods found so far
         pass
+    return temporal
+
 
+def _access_rights(use_constraints, env):
+    return {'description': {env['meta_lang']: use_constraints[0]}}
 
+
+def _provenance(lineage, env):
+    return [{'description': {env['meta_lang']: lineage}}]
+
+
+# Fields mapped directly from iso_values. The agent fields are mapped separately in iso_19139_mapper.
+ISO_19139_SPEC = compile_spec([
+    Field('title', 'title', transform=_lang_string, default={'und': ''}),
+    Field('language', 'dataset-language', transform=_languages, default=[]),
+    Field('description', 'abstract', transform=_lang_string),
+    Field('field_of_science', 'topic-category', select=first_item, lookup=TOPIC_CATEGORY_FIELDS_OF_SCIENCE,
+          lookup_default=(), transform=_identifiers, default=[]),
     # modified: Last known time when a research dataset or metadata about the research dataset
     # has been significantly modified.
     # date-updated: the date of last revision for the dataset
     # metadata-date: either creation or update date of metadata
-    try:
-        if 'date-updated' in iso_values and iso_values['date-updated']:
-            modified = get_string_as_valid_datetime_string(iso_values['date-updated'])
-            if modified is None:
-                log.error("Unable to interpret date-updated {0} as datetime".format(iso_values['date-updated']))
-            else:
-                package_dict['modified'] = modified
-        elif 'metadata-date' in iso_values and iso_values['metadata-date']:
-            modified = get_string_as_valid_datetime_string(iso_values['metadata-date'])
-            if modified is None:
-                log.error("Unable to interpret metadata-date {0} as datetime".format(iso_values['metadata-date']))
-            else:
-                package_dict['modified'] = modified
-    except KeyError:
-        pass
-
+    Field('modified', ('date-updated', 'metadata-date'), transform=_datetime),
     # Dataset freeform keywords
-    package_dict['keyword'] = []
-    try:
-        for tag in iso_values['tags']:
-            package_dict['keyword'].append(tag)
-    except KeyError:
-        pass
-
+    Field('keyword', 'tags', transform=lambda tags, env: list(tags), default=[]),
     # Spatial information, assuming a bbox value
-    package_dict['spatial'] = []
-    try:
-        for bbox in iso_values['bbox']:
-            if 'north' in bbox and 'east' in bbox and 'south' in bbox and 'west' in bbox:
-                polygon = convert_bbox_to_polygon(bbox['north'], bbox['east'], bbox['south'], bbox['west'])
-                package_dict['spatial'].append({'as_wkt': [polygon]})
-    except KeyError:
-        pass
-
-    # Temporal extent, assumption is same index within temporal-extent-begin and -end are related
-    # No dataset have had values on these.
-    try:
-        if len(iso_values['temporal-extent-begin']) == len(iso_values['temporal-extent-end']) and \
-        len(iso_values['temporal-extent-begin']) > 0:
-            package_dict['temporal'] = []
-            for idx, start_date in enumerate(iso_values['temporal-extent-begin']):
-                end_date = iso_values['temporal-extent-end'][idx]
-                if start_date:
-                    start_dt = get_string_as_valid_datetime_string(start_date, '01-01', '00:00:00')
-                if end_date:
-                    end_dt = get_string_as_valid_datetime_string(end_date, '12-31', '23:59:59')
-
-                temporal_obj = {}
-                if start_date:
-                    if start_dt is None:
-                        temporal_obj['temporal_coverage'] = start_date
-                    else:
-                        temporal_obj['start_date'] = start_dt
-                if end_date:
-                    if end_dt is None:
-                        temporal_obj['temporal_coverage'] += ' - ' + end_date
-                    else:
-                        temporal_obj['end_date'] = end_dt
-
-                if temporal_obj:
-                    package_dict['temporal'].append(temporal_obj)
-    except KeyError:
-        pass
-
+    Field('spatial', 'bbox', transform=_spatial, default=[]),
+    Field('temporal', None, transform=_temporal),
     # issued: Date of formal issuance for the dataset
     # date-released: date of publication of dataset
-    try:
-        if 'date-released' in iso_values and iso_values['date-released']:
-            issued = get_string_as_valid_date_string(iso_values['date-released'])
-            if issued is None:
-                log.error("Unable to interpret date-released {0} as date".format(iso_values['date-released']))
-            else:
-                package_dict['issued'] = issued
-    except KeyError:
-        pass
-
+    Field('issued', 'date-released', transform=_date, omit_empty=True),
     # Access rights description as a text
-    if 'use-constraints' in iso_values and len(iso_values['use-constraints']):
-        description = {}
-        for use_constraint in iso_values['use-constraints']:
-            description = {meta_lang: use_constraint}
-            break
-        package_dict['access_rights'] = {'description': description}
-
+    Field('access_rights', 'use-constraints', transform=_access_rights, omit_empty=True),
     # Use lineage as description for provenance
-    package_dict['provenance'] = []
-    try:
-        package_dict['provenance'].append({'description': {meta_lang: iso_values['lineage']}})
-    except KeyError:
-        pass
+    Field('provenance', 'lineage', transform=_provenance, default=[]),
+])
 
-    return package_dict
+
+# Roles of responsible parties used in the mapping
+AGENT_ROLES = ('author', 'originator', 'pointOfContact', 'custodian', 'distributor', 'publisher', 'owner')
+CONTRIBUTOR_ROLES = ('processor', 'user')
+
+
+def _group_agents_by_role(responsible_orgs):
+    """
+    Group responsible parties by role in one pass. A party with several roles is in each of their groups,
+    but only once in the contributor group. Parties after one having no role are not grouped.
+
+    :param responsible_orgs: list of responsible party dicts from iso_values
+    :return: dict of role: list of parties in source order, for each of AGENT_ROLES and contributor
+    """
+    agents_by_role = dict((role, []) for role in AGENT_ROLES)
+    agents_by_role['contributor'] = []
+
+    for org in responsible_orgs:
+        if 'role' not in org:
+            break
+        org_role = org['role']
+        for role in AGENT_ROLES:
+            if role in org_role:
+                agents_by_role[role].append(org)
+        if any(role in org_role for role in CONTRIBUTOR_ROLES):
+            agents_by_role['contributor'].append(org)
+
+    return agents_by_role
 
 
 def _set_agent_details_to_package_dict_field(package_dict, field, agent, is_array, meta_lang):
@@ -0,0 +1,160 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Declarative mapping specs. A spec is a list of Fields, each telling where a value is read from in the source
+dict, how it is transformed and where it is written in the package dict. A spec is compiled once into a
+MappingSpec, which maps source dicts field by field, capturing errors per field.
+"""
+
+import copy
+import logging
+import timeit
+
+log = logging.getLogger(__name__)
+
+
+class _Omit(object):
+    def __repr__(self):
+        return 'OMIT'
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+# Returned by transforms and used as default to leave the target field out of the package dict
+OMIT = _Omit()
+
+
+class Field(object):
+    """
+    Mapping of one target field.
+
+    :param target: key of the field in the package dict
+    :param source: key of the value in the source dict, a tuple of keys to use the first one having a non-empty
+        value, or None to give the whole source dict to transform
+    :param select: function picking the value to use from the source value, eg. the first item of a list
+    :param lookup: dict the selected value is looked up from
+    :param lookup_default: value used when the selected value is not in lookup
+    :param transform: function of (value, env) returning the value of the target field or OMIT
+    :param default: value of the target field when the source value is missing or mapping it fails,
+        OMIT to leave the target field out. Each package dict gets its own copy.
+    :param omit_empty: treat empty source values as missing
+    """
+
+    def __init__(self, target, source, select=None, lookup=None, lookup_default=None, transform=None,
+                 default=OMIT, omit_empty=False):
+        self.target = target
+        self.source = source
+        self.select = select
+        self.lookup = lookup
+        self.lookup_default = lookup_default
+        self.transform = transform
+        self.default = default
+        self.omit_empty = omit_empty
+
+
+class _Missing(Exception):
+    pass
+
+
+def _compile_reader(field):
+    """
+    Build a function of (source_dict, env) returning the value for the field, raising _Missing when there is no
+    value.
+    """
+    source = field.source
+    select = field.select
+    lookup = field.lookup
+    lookup_default = field.lookup_default
+    transform = field.transform
+    omit_empty = field.omit_empty
+
+    def read(source_dict, env):
+        if source is None:
+            value = source_dict
+        elif isinstance(source, tuple):
+            for key in source:
+                if source_dict.get(key):
+                    env['source_key'] = key
+                    value = source_dict[key]
+                    break
+            else:
+                raise _Missing()
+        else:
+            env['source_key'] = source
+            try:
+                value = source_dict[source]
+            except KeyError:
+                raise _Missing()
+            if omit_empty and not value:
+                raise _Missing()
+
+        if select is not None:
+            value = select(value)
+            if value is OMIT:
+                return OMIT
+        if lookup is not None:
+            value = lookup.get(value, lookup_default)
+        if transform is not None:
+            value = transform(value, env)
+        return value
+
+    return read
+
+
+class MappingSpec(object):
+    """
+    Compiled mapping spec.
+    """
+
+    def __init__(self, fields):
+        self.fields = [(field.target, _compile_reader(field), field.default) for field in fields]
+
+    def apply(self, source_dict, package_dict, env, timings=None):
+        """
+        Map source_dict to package_dict.
+
+        :param source_dict: source values
+        :param package_dict: dict the target fields are set to
+        :param env: dict of values shared by the transforms, eg. metadata language. Key source_key is set to the
+            source key of the value being transformed.
+        :param timings: if a dict is given, the time spent on each target field is added to it in seconds
+        :return: list of (target, exception) for the fields whose mapping failed
+        """
+        errors = []
+        for target, read, default in self.fields:
+            if timings is not None:
+                start = timeit.default_timer()
+            try:
+                value = read(source_dict, env)
+            except _Missing:
+                value = copy.deepcopy(default)
+            except Exception as e:
+                log.error("Unable to map {0}: {1}".format(target, e))
+                errors.append((target, e))
+                value = copy.deepcopy(default)
+
+            if value is not OMIT:
+                package_dict[target] = value
+            if timings is not None:
+                timings[target] = timings.get(target, 0.0) + timeit.default_timer() - start
+        return errors
+
+
+def compile_spec(fields):
+    """
+    Compile a list of Fields into a MappingSpec.
+    """
+    return MappingSpec(fields)
+
+
+def first_item(values):
+    """
+    Select the first item of a list, omitting the field if the list is empty.
+    """
+    return values[0] if len(values) else OMIT
@@ -0,0 +1,229 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+On-disk cache of mapped OAI-PMH records.
+
+A full re-harvest maps every record again, though most of them have not changed. The cache stores the
+package dict mapped from a record, keyed by the metadata format, the mapper version and the SHA-256 of the
+canonicalized (C14N) record XML, so an unchanged record is not mapped again.
+
+The mapper version is a digest of the code and resource files of this extension, so any change to them
+invalidates the whole cache. Mapped dicts also contain reference data from Metax; entries older than
+etsin.mapping_cache.max_age seconds are mapped again, so that reference data changes are picked up. Mappings
+made while a reference data lookup failed are not cached, as they lack the reference data.
+
+Settings in the CKAN config:
+
+* etsin.mapping_cache.path: SQLite file of the cache. The cache is off if this is not set.
+* etsin.mapping_cache.max_bytes: size of the cached dicts above which the least recently used are evicted.
+  Defaults to 256 MiB.
+* etsin.mapping_cache.max_age: seconds an entry is used for. Defaults to a week, 0 for no limit.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from lxml import etree
+from pylons import config
+
+from ckanext.etsin import metax_api, metrics
+
+import logging
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+
+# Directories of this extension not affecting mapping, left out of the mapper version
+_UNVERSIONED_DIRECTORIES = ('tests', 'test_fixtures', 'benchmarks', 'templates', 'public', 'fanstatic')
+_VERSIONED_EXTENSIONS = ('.py', '.json', '.csv')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mapping (
+    key TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    package_dict TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mapping_last_used_idx ON mapping (last_used);
+"""
+
+_mapper_version = None
+
+
+def get_mapper_version():
+    """
+    Digest of the code and resource files of the extension, computed once per process.
+    """
+    global _mapper_version
+    if _mapper_version is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for directory, directories, files in os.walk(root):
+            directories[:] = sorted(d for d in directories if d not in _UNVERSIONED_DIRECTORIES)
+            for name in sorted(files):
+                if name.endswith(_VERSIONED_EXTENSIONS):
+                    path = os.path.join(directory, name)
+                    digest.update(os.path.relpath(path, root))
+                    with open(path, 'rb') as f:
+                        digest.update(f.read())
+        _mapper_version = digest.hexdigest()
+    return _mapper_version
+
+
+def record_digest(xml):
+    """
+    :param xml: lxml element of the record
+    :return: SHA-256 of the canonicalized XML without comments, the same for equivalent serializations of the
+        record
+    """
+    return hashlib.sha256(etree.tostring(xml, method='c14n', with_comments=False)).hexdigest()
+
+
+class MappingCache(object):
+    """
+    Mapped package dicts by format and record XML, with least recently used eviction.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE, version=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.version = version or get_mapper_version()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        removed = self._conn.execute('DELETE FROM mapping WHERE version != ?', (self.version,)).rowcount
+        if removed:
+            log.info("Removed {0} mappings of other mapper versions from {1}".format(removed, path))
+        self._size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM mapping').fetchone()[0]
+
+    def _key(self, format, xml):
+        return hashlib.sha256('\0'.join((format, self.version, record_digest(xml)))).hexdigest()
+
+    def get(self, format, xml):
+        """
+        :return: the cached package dict of the record, or None
+        """
+        return self._get(self._key(format, xml))
+
+    def _get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT package_dict, created FROM mapping WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if self.max_age and now - row[1] > self.max_age:
+                self._delete([key])
+                return None
+            self._conn.execute('UPDATE mapping SET last_used = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    def put(self, format, xml, package_dict):
+        """
+        Cache the package dict mapped from a record, evicting the least recently used dicts if the cache grows
+        over max_bytes. Dicts that are not JSON serializable are not cached.
+        """
+        self._put(self._key(format, xml), format, package_dict)
+
+    def _put(self, key, format, package_dict):
+        try:
+            value = json.dumps(package_dict)
+        except (TypeError, ValueError) as e:
+            log.warning("Not caching the mapping of a {0} record: {1}".format(format, repr(e)))
+            return
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute('SELECT size FROM mapping WHERE key = ?', (key,)).fetchone()
+            self._conn.execute('INSERT OR REPLACE INTO mapping (key, version, package_dict, size, created, last_used) '
+                               'VALUES (?, ?, ?, ?, ?, ?)', (key, self.version, value, len(value), now, now))
+            self._size += len(value) - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def get_or_map(self, format, xml, mapper):
+        """
+        :param mapper: function of xml returning the package dict, called if the record is not cached. The dict is
+            not cached if a reference data lookup of the mapper fails.
+        :return: package dict of the record
+        """
+        # The XML is canonicalized and hashed once for both the lookup and the insert
+        key = self._key(format, xml)
+        package_dict = self._get(key)
+        if package_dict is not None:
+            metrics.inc('etsin_mapping_cache_total', {'format': format, 'result': 'hit'})
+            return package_dict
+        metrics.inc('etsin_mapping_cache_total', {'format': format, 'result': 'miss'})
+        with metax_api.track_ref_data_failures() as failures:
+            package_dict = mapper(xml)
+        if failures.count:
+            log.debug("Not caching the mapping of a {0} record, {1} reference data lookups failed".format(
+                format, failures.count))
+        elif package_dict:
+            self._put(key, format, package_dict)
+        return package_dict
+
+    def _evict(self):
+        # Down to 90% of max_bytes, so that every insert does not evict
+        excess = self._size - self.max_bytes * 0.9
+        keys = []
+        for key, size in self._conn.execute('SELECT key, size FROM mapping ORDER BY last_used'):
+            if excess <= 0:
+                break
+            keys.append(key)
+            excess -= size
+        self._delete(keys)
+        log.debug("Evicted {0} mappings from {1}".format(len(keys), self.path))
+
+    def _delete(self, keys):
+        for key in keys:
+            row = self._conn.execute('SELECT size FROM mapping WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self._conn.execute('DELETE FROM mapping WHERE key = ?', (key,))
+                self._size -= row[0]
+
+    @property
+    def size(self):
+        with self._lock:
+            return self._size
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_mapping_cache():
+    """
+    Get the process wide mapping cache.
+
+    :return: MappingCache or None, if etsin.mapping_cache.path is not configured
+    """
+    global _cache
+    if _cache is None:
+        path = config.get('etsin.mapping_cache.path')
+        if not path:
+            return None
+        with _cache_lock:
+            if _cache is None:
+                log.info("Opening mapping cache {0}".format(path))
+                _cache = MappingCache(path,
+                                      int(config.get('etsin.mapping_cache.max_bytes', DEFAULT_MAX_BYTES)),
+                                      float(config.get('etsin.mapping_cache.max_age', DEFAULT_MAX_AGE)))
+    return _cache
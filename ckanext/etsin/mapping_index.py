@@ -0,0 +1,210 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Sorted, memory-mapped binary indexes of the identifier mapping CSV files of the refiners.
+
+A mapping CSV, eg. refiners/resources/fsd_pid_to_kata_urn.csv, is compiled to an index file next to it, with
+the suffix .idx. Its rows are sorted by the first column and looked up by binary search, so a lookup reads a
+few pages of the file instead of parsing the whole CSV. The index is memory-mapped read-only, so the worker
+processes of a harvest share the same pages of the page cache instead of each holding its own copy.
+
+An index records the size and modification time of its CSV and is compiled again when they change. Indexes
+can be compiled ahead, eg. when deploying, with `paster --plugin=ckanext-etsin etsin compile_mappings`. If
+an index cannot be written next to its CSV, the CSV is searched as such.
+
+Index file layout, integers little-endian:
+
+* header: magic, CSV modification time (double), CSV size (uint64), number of rows (uint32)
+* row offsets: number of rows + 1 uint32 offsets of the rows from the start of the row data
+* row data: the columns of each row joined by NUL characters, sorted by the first column
+"""
+
+import csv
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+INDEX_SUFFIX = '.idx'
+
+_MAGIC = 'ETSINIX1'
+_HEADER = struct.Struct('<8sdQI')
+_OFFSET = struct.Struct('<I')
+_SEPARATOR = '\0'
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def _source_stat(csv_path):
+    stat = os.stat(csv_path)
+    return stat.st_mtime, stat.st_size
+
+
+def compile_index(csv_path, index_path=None):
+    """
+    Compile a mapping CSV to an index file. The file is replaced atomically, so processes reading the old
+    index are not disturbed.
+
+    :param csv_path: path of the mapping CSV
+    :param index_path: path of the index, defaults to the CSV path with the suffix .idx
+    :return: number of rows in the index
+    """
+    index_path = index_path or csv_path + INDEX_SUFFIX
+    mtime, size = _source_stat(csv_path)
+    with open(csv_path, 'rb') as f:
+        rows = [_SEPARATOR.join(row) for row in csv.reader(f, delimiter=',') if row]
+    # Stable sort, so that the first of rows with the same key is found, as when searching the CSV
+    rows.sort(key=lambda row: row.split(_SEPARATOR, 1)[0])
+
+    offsets = [0]
+    for row in rows:
+        offsets.append(offsets[-1] + len(row))
+
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(index_path), dir=os.path.dirname(index_path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, mtime, size, len(rows)))
+            f.write(struct.pack('<{0}I'.format(len(offsets)), *offsets))
+            f.write(''.join(rows))
+        # Readable by the harvester user when compiled by another user when deploying
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, index_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    log.debug("Compiled {0} rows of {1} to {2}".format(len(rows), csv_path, index_path))
+    return len(rows)
+
+
+class MappingIndex(object):
+    """
+    A memory-mapped index file.
+    """
+
+    def __init__(self, index_path):
+        with open(index_path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.source_mtime, self.source_size, self.count = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC:
+            self._map.close()
+            raise ValueError('{0} is not a mapping index'.format(index_path))
+        self._offsets_start = _HEADER.size
+        self._data_start = self._offsets_start + (self.count + 1) * _OFFSET.size
+
+    def is_current(self, mtime, size):
+        """
+        :return: True if the index was compiled from a CSV of this modification time and size
+        """
+        return self.source_mtime == mtime and self.source_size == size
+
+    def _bounds(self, i):
+        start, end = struct.unpack_from('<2I', self._map, self._offsets_start + i * _OFFSET.size)
+        return self._data_start + start, self._data_start + end
+
+    def _key(self, start, end):
+        separator = self._map.find(_SEPARATOR, start, end)
+        return self._map[start:end if separator == -1 else separator]
+
+    def find(self, key):
+        """
+        :return: the columns of the first row whose first column is key, or None
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(*self._bounds(middle)) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count:
+            return None
+        start, end = self._bounds(low)
+        if self._key(start, end) != key:
+            return None
+        return self._map[start:end].split(_SEPARATOR)
+
+    def close(self):
+        self._map.close()
+
+
+class UnindexedMapping(object):
+    """
+    A mapping CSV whose index could not be written, searched row by row.
+    """
+
+    def __init__(self, csv_path, mtime, size):
+        self.csv_path = csv_path
+        self.source_mtime = mtime
+        self.source_size = size
+
+    def is_current(self, mtime, size):
+        return self.source_mtime == mtime and self.source_size == size
+
+    def find(self, key):
+        with open(self.csv_path, 'rb') as f:
+            for row in csv.reader(f, delimiter=','):
+                if row and row[0] == key:
+                    return row
+        return None
+
+
+def _open_index(csv_path, mtime, size):
+    index_path = csv_path + INDEX_SUFFIX
+    try:
+        index = MappingIndex(index_path)
+        if index.is_current(mtime, size):
+            return index
+        index.close()
+    except (IOError, OSError, ValueError, struct.error):
+        pass
+    try:
+        compile_index(csv_path, index_path)
+        return MappingIndex(index_path)
+    except (IOError, OSError) as e:
+        log.warning("Could not compile mapping index of {0}, searching the CSV: {1}".format(csv_path, repr(e)))
+        return UnindexedMapping(csv_path, mtime, size)
+
+
+def get_index(csv_path):
+    """
+    Get the index of a mapping CSV, compiling it if it is missing or older than the CSV.
+
+    :return: MappingIndex, or UnindexedMapping if the index cannot be written
+    """
+    mtime, size = _source_stat(csv_path)
+    index = _indexes.get(csv_path)
+    if index is not None and index.is_current(mtime, size):
+        return index
+    with _lock:
+        index = _indexes.get(csv_path)
+        if index is None or not index.is_current(mtime, size):
+            # An index replaced here may still be read by another thread, so it is left for the GC to close
+            index = _indexes[csv_path] = _open_index(csv_path, mtime, size)
+    return index
+
+
+def find_row(csv_path, key):
+    """
+    :return: the columns of the first row of a mapping CSV whose first column is key, or None
+    """
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return get_index(csv_path).find(key)
+
+
+def reset():
+    """
+    Forget the opened indexes, eg. in tests.
+    """
+    with _lock:
+        _indexes.clear()
@@ -8,19 +8,59 @@
 import requests
 from requests import HTTPError, exceptions
 import json
+from multiprocessing.pool import ThreadPool
 from pylons import config
 import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
 
+from ckanext.etsin import metrics, timing, transport
 from ckanext.etsin.utils import str_to_bool
 
 log = logging.getLogger(__name__)
 
 TIMEOUT = 30
-METAX_BASE_URL = 'https://{0}'.format(config.get('metax.host'))
-METAX_DATASETS_BASE_URL = METAX_BASE_URL + '/rest/datasets'
-METAX_REFERENCE_DATA_URL = METAX_BASE_URL + '/es/reference_data/_search?size=1'
-VERIFY_SSL = str_to_bool(config.get('metax.verify_ssl'))
 HEADERS = {'Content-Type': 'application/json'}
+REF_DATA_THREADS = 8
+
+MetaxSettings = namedtuple('MetaxSettings', ['datasets_url', 'reference_data_url', 'reference_data_msearch_url',
+                                             'verify_ssl'])
+
+_settings = None
+
+_ref_data_pool = None
+_ref_data_pool_lock = threading.Lock()
+
+# RefDataFailures of the current thread, see track_ref_data_failures
+_ref_data_tracking = threading.local()
+
+
+def get_settings():
+    """
+    Read the MetaX URLs and SSL verification setting from config on first use, so that importing this module does not
+    need the CKAN config to be loaded.
+
+    :return: MetaxSettings
+    """
+    global _settings
+    if _settings is None:
+        base_url = '{0}://{1}'.format(config.get('metax.protocol', 'https'), config.get('metax.host'))
+        _settings = MetaxSettings(
+            datasets_url=base_url + '/rest/datasets',
+            reference_data_url=base_url + '/es/reference_data/_search?size=1',
+            reference_data_msearch_url=base_url + '/es/reference_data/_msearch',
+            verify_ssl=str_to_bool(config.get('metax.verify_ssl')))
+    return _settings
+
+
+def reset_settings():
+    """
+    Forget the settings read from config, eg. after the config has changed.
+    """
+    global _settings
+    _settings = None
+
 
 def json_or_empty(response):
     response_json = ""
@@ -30,6 +70,7 @@ def json_or_empty(response):
         pass
     return response_json
 
+@timing.timed('metax.get_catalog_record_identifier_using_preferred_identifier')
 def get_catalog_record_identifier_using_preferred_identifier(metax_pref_id):
     """
     Get catalog record identifier for a record from MetaX using preferred identifier.
@@ -37,11 +78,13 @@ def get_catalog_record_identifier_using_preferred_identifier(metax_pref_id):
     :param metax_pref_id: MetaX catalog record preferred identifier
     :return: catalog record identifier
     """
-    r = requests.get(METAX_DATASETS_BASE_URL + '?preferred_identifier={0}'.format(metax_pref_id),
-                     headers={'Accept': 'application/json'},
-                     auth=(config.get('metax.api_user'), config.get('metax.api_password')),
-                     verify=VERIFY_SSL,
-                     timeout=TIMEOUT)
+    settings = get_settings()
+    r = transport.send('get',
+                       settings.datasets_url + '?preferred_identifier={0}'.format(metax_pref_id),
+                       headers={'Accept': 'application/json'},
+                       auth=(config.get('metax.api_user'), config.get('metax.api_password')),
+                       verify=settings.verify_ssl,
+                       timeout=TIMEOUT)
     try:
         r.raise_for_status()
     except HTTPError as e:
@@ -51,6 +94,7 @@ def get_catalog_record_identifier_using_preferred_identifier(metax_pref_id):
         return None
     return json.loads(r.text)['identifier']
 
+@timing.timed('metax.get_catalog_record_research_dataset_modified_using_preferred_identifier')
 def get_catalog_record_research_dataset_modified_using_preferred_identifier(metax_pref_id):
     """
     Get catalog record identifier for a record from MetaX using preferred identifier.
@@ -58,11 +102,13 @@ def get_catalog_record_research_dataset_modified_using_preferred_identifier(meta
     :param metax_pref_id: MetaX catalog record preferred identifier
     :return: catalog record research_dataset.modified
     """
-    r = requests.get(METAX_DATASETS_BASE_URL + '?preferred_identifier={0}'.format(metax_pref_id),
-                     headers={'Accept': 'application/json'},
-                     auth=(config.get('metax.api_user'), config.get('metax.api_password')),
-                     verify=VERIFY_SSL,
-                     timeout=TIMEOUT)
+    settings = get_settings()
+    r = transport.send('get',
+                       settings.datasets_url + '?preferred_identifier={0}'.format(metax_pref_id),
+                       headers={'Accept': 'application/json'},
+                       auth=(config.get('metax.api_user'), config.get('metax.api_password')),
+                       verify=settings.verify_ssl,
+                       timeout=TIMEOUT)
     try:
         r.raise_for_status()
     except HTTPError as e:
@@ -73,6 +119,7 @@ def get_catalog_record_research_dataset_modified_using_preferred_identifier(meta
     return json.loads(r.text)['research_dataset']['modified']
 
 
+@timing.timed('metax.create_catalog_record')
 def create_catalog_record(cr_json):
     """
     Create a catalog record in MetaX.
@@ -80,12 +127,13 @@ def create_catalog_record(cr_json):
     :param cr_json: MetaX catalog record json
     :return: catalog record identifier of the created catalog record.
     """
-    r = requests.post(METAX_DATASETS_BASE_URL,
-                      headers={'Content-Type': 'application/json'},
-                      json=cr_json,
-                      auth=(config.get('metax.api_user'), config.get('metax.api_password')),
-                      verify=VERIFY_SSL,
-                      timeout=TIMEOUT)
+    settings = get_settings()
+    r = transport.send('post', settings.datasets_url,
+                       headers={'Content-Type': 'application/json'},
+                       json=cr_json,
+                       auth=(config.get('metax.api_user'), config.get('metax.api_password')),
+                       verify=settings.verify_ssl,
+                       timeout=TIMEOUT)
     try:
         r.raise_for_status()
     except HTTPError as e:
@@ -95,6 +143,7 @@ def create_catalog_record(cr_json):
     return json.loads(r.text)['identifier']
 
 
+@timing.timed('metax.update_catalog_record')
 def update_catalog_record(metax_cr_id, cr_json):
     """
     Update existing catalog record in MetaX
@@ -102,12 +151,13 @@ def update_catalog_record(metax_cr_id, cr_json):
     :param metax_cr_id: MetaX catalog record identifier
     :param cr_json: MetaX catalog record json
     """
-    r = requests.put(METAX_DATASETS_BASE_URL + '/{id}'.format(id=metax_cr_id),
-                     headers={'Content-Type': 'application/json'},
-                     json=cr_json,
-                     auth=(config.get('metax.api_user'), config.get('metax.api_password')),
-                     verify=VERIFY_SSL,
-                     timeout=TIMEOUT)
+    settings = get_settings()
+    r = transport.send('put', settings.datasets_url + '/{id}'.format(id=metax_cr_id),
+                       headers={'Content-Type': 'application/json'},
+                       json=cr_json,
+                       auth=(config.get('metax.api_user'), config.get('metax.api_password')),
+                       verify=settings.verify_ssl,
+                       timeout=TIMEOUT)
     try:
         r.raise_for_status()
     except HTTPError as e:
@@ -117,16 +167,18 @@ def update_catalog_record(metax_cr_id, cr_json):
         raise
 
 
+@timing.timed('metax.delete_catalog_record')
 def delete_catalog_record(metax_cr_id):
     """
     Delete a catalog record from MetaX.
 
     :param metax_cr_id: MetaX catalog record identifier
     """
-    r = requests.delete(METAX_DATASETS_BASE_URL + '/{id}'.format(id=metax_cr_id),
-                        auth=(config.get('metax.api_user'), config.get('metax.api_password')),
-                        verify=VERIFY_SSL,
-                        timeout=TIMEOUT)
+    settings = get_settings()
+    r = transport.send('delete', settings.datasets_url + '/{id}'.format(id=metax_cr_id),
+                       auth=(config.get('metax.api_user'), config.get('metax.api_password')),
+                       verify=settings.verify_ssl,
+                       timeout=TIMEOUT)
     try:
         r.raise_for_status()
     except HTTPError as e:
@@ -135,6 +187,92 @@ def delete_catalog_record(metax_cr_id):
         raise
 
 
+@timing.timed('metax.delete_catalog_records')
+def delete_catalog_records(metax_cr_ids):
+    """
+    Delete many catalog records from MetaX, with one request if MetaX accepts a bulk delete of a list of identifiers
+    and otherwise one request per catalog record. Catalog records already deleted are skipped.
+
+    :param metax_cr_ids: list of MetaX catalog record identifiers
+    """
+    try:
+        _bulk_delete_catalog_records(metax_cr_ids)
+        return
+    except HTTPError as e:
+        log.warning('Bulk delete of {count} catalog records failed with {error}, deleting them one by one'.format(
+            count=len(metax_cr_ids), error=repr(e)))
+
+    for metax_cr_id in metax_cr_ids:
+        try:
+            delete_catalog_record(metax_cr_id)
+        except HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+
+
+def _bulk_delete_catalog_records(metax_cr_ids):
+    settings = get_settings()
+    r = transport.send('delete', settings.datasets_url,
+                       headers={'Content-Type': 'application/json'},
+                       json=metax_cr_ids,
+                       auth=(config.get('metax.api_user'), config.get('metax.api_password')),
+                       verify=settings.verify_ssl,
+                       timeout=TIMEOUT)
+    try:
+        r.raise_for_status()
+    except HTTPError as e:
+        log.info('Failed to bulk delete {count} catalog records: \nerror={error}, \njson={json}'.format(
+            count=len(metax_cr_ids), error=repr(e), json=json_or_empty(r)))
+        raise
+
+
+@timing.timed('metax.get_catalog_records_for_data_catalog')
+def get_catalog_records_for_data_catalog(data_catalog_id, page_size=1000):
+    """
+    Get identifier, preferred identifier and modified date of every catalog record in a data catalog
+    from MetaX. Records are read in pages, so this makes count / page_size requests.
+
+    :param data_catalog_id: MetaX data catalog identifier
+    :param page_size: number of catalog records per request
+    :return: dictionary of catalog record identifier -> dict with keys preferred_identifier and modified
+    """
+    records = {}
+    settings = get_settings()
+    url = settings.datasets_url
+    params = {
+        'data_catalog': data_catalog_id,
+        'fields': 'identifier,research_dataset',
+        'research_dataset_fields': 'preferred_identifier,modified',
+        'limit': page_size,
+        'offset': 0,
+    }
+    while url:
+        r = transport.send('get', url,
+                           params=params,
+                           headers={'Accept': 'application/json'},
+                           auth=(config.get('metax.api_user'), config.get('metax.api_password')),
+                           verify=settings.verify_ssl,
+                           timeout=TIMEOUT)
+        try:
+            r.raise_for_status()
+        except HTTPError as e:
+            log.error('Failed to get catalog records of data catalog {id}: \nerror={error}, \njson={json}'.format(
+                id=data_catalog_id, error=repr(e), json=json_or_empty(r)))
+            raise
+        page = json.loads(r.text)
+        for cr in page.get('results', []):
+            research_dataset = cr.get('research_dataset', {})
+            records[cr['identifier']] = {
+                'preferred_identifier': research_dataset.get('preferred_identifier', None),
+                'modified': research_dataset.get('modified', None),
+            }
+        # The next link already contains all query parameters
+        url = page.get('next', None)
+        params = None
+    return records
+
+
+@timing.timed('metax.check_catalog_record_exists')
 def check_catalog_record_exists(metax_cr_id):
     """
     Ask MetaX whether the catalog record already exists in MetaX by using metax catalog record identifier.
@@ -142,11 +280,13 @@ def check_catalog_record_exists(metax_cr_id):
     :param metax_cr_id: MetaX catalog record identifier
     :return: True/False
     """
-    r = requests.head(METAX_DATASETS_BASE_URL + '/{id}'.format(id=metax_cr_id),
-                      verify=VERIFY_SSL)
+    settings = get_settings()
+    r = transport.send('head', settings.datasets_url + '/{id}'.format(id=metax_cr_id),
+                       verify=settings.verify_ssl)
     return r.status_code == requests.codes.ok
 
 
+@timing.timed('metax.get_ref_data')
 def get_ref_data(topic, field, term, result_field):
     """ Query MetaX Elastic search API for all kinds of reference data
 
@@ -158,7 +298,24 @@ def get_ref_data(topic, field, term, result_field):
     :type term: string
     :return:
     """
-    query = json.dumps({
+    query = json.dumps(_ref_data_query(topic, field, term))
+    settings = get_settings()
+    try:
+        response = transport.send('get', settings.reference_data_url, data=query, verify=settings.verify_ssl,
+                                  headers=HEADERS)
+        results = json.loads(response.text)
+    except Exception:
+        _ref_data_failed()
+        raise
+    if response.status_code != requests.codes.ok:
+        log.warning('Reference data query of {0} {1} failed with status {2}'.format(
+            topic, term, response.status_code))
+        _ref_data_failed()
+    return _ref_data_result(results, result_field)
+
+
+def _ref_data_query(topic, field, term):
+    return {
         "query": {
             "bool": {
                 "must": [
@@ -175,11 +332,129 @@ def get_ref_data(topic, field, term, result_field):
                 ]
             }
         }
-    })
-    response = requests.get(METAX_REFERENCE_DATA_URL, data=query, verify=VERIFY_SSL, headers=HEADERS)
-    results = json.loads(response.text)
+    }
+
+
+def _ref_data_result(results, result_field):
     try:
         result = results['hits']['hits'][0]['_source'][result_field]
         return result
     except:
         return None
+
+
+@timing.timed('metax.get_ref_data_batch')
+def get_ref_data_batch(queries):
+    """ Query MetaX Elastic search API for many reference data terms with one multi search request.
+    If the multi search fails, the terms are queried one by one, concurrently.
+
+    :param queries: list of (topic, field, term, result_field) tuples, as the arguments of get_ref_data
+    :type queries: list
+    :return: list of results of get_ref_data, in the order of queries
+    """
+    if not queries:
+        return []
+    distinct_queries = list(set(queries))
+
+    lines = []
+    for topic, field, term, result_field in distinct_queries:
+        query = _ref_data_query(topic, field, term)
+        query['size'] = 1
+        lines.append('{}')
+        lines.append(json.dumps(query))
+    settings = get_settings()
+    try:
+        response = transport.send('post', settings.reference_data_msearch_url, data='\n'.join(lines) + '\n',
+                                  verify=settings.verify_ssl, headers={'Content-Type': 'application/x-ndjson'},
+                                  timeout=TIMEOUT)
+        response.raise_for_status()
+        responses = json.loads(response.text)['responses']
+        if len(responses) != len(distinct_queries):
+            raise ValueError('Expected {0} responses, got {1}'.format(len(distinct_queries), len(responses)))
+    except (exceptions.RequestException, ValueError, KeyError) as e:
+        log.warning('Reference data multi search failed, querying terms one by one: {0}'.format(repr(e)))
+        metrics.inc('etsin_metax_retries_total', {'operation': 'get_ref_data_batch'})
+        return get_ref_data_concurrently(queries)
+
+    for query, results in zip(distinct_queries, responses):
+        if 'error' in results:
+            log.warning('Reference data query of {0} {1} failed: {2}'.format(query[0], query[2], results['error']))
+            _ref_data_failed()
+    results_by_query = dict((query, _ref_data_result(results, query[3]))
+                            for query, results in zip(distinct_queries, responses))
+    return [results_by_query[query] for query in queries]
+
+
+def _get_ref_data_pool():
+    global _ref_data_pool
+    with _ref_data_pool_lock:
+        if _ref_data_pool is None:
+            _ref_data_pool = ThreadPool(REF_DATA_THREADS)
+    return _ref_data_pool
+
+
+def get_ref_data_concurrently(queries):
+    """ Query MetaX Elastic search API for many reference data terms at once. The queries are sent
+    concurrently, so the time taken is about that of the slowest query.
+
+    :param queries: list of (topic, field, term, result_field) tuples, as the arguments of get_ref_data
+    :type queries: list
+    :return: list of results of get_ref_data, in the order of queries
+    """
+    if not queries:
+        return []
+    distinct_queries = list(set(queries))
+    if len(distinct_queries) == 1:
+        results = [get_ref_data(*distinct_queries[0])]
+    else:
+        harvest_source_name = timing.current_source()
+        failures = getattr(_ref_data_tracking, 'failures', None)
+
+        def get(query):
+            # The pool threads time the queries for the harvest source of the calling thread, and count their
+            # failures for it
+            with timing.source(harvest_source_name), track_ref_data_failures(failures):
+                return get_ref_data(*query)
+        results = _get_ref_data_pool().map(get, distinct_queries)
+    results_by_query = dict(zip(distinct_queries, results))
+    return [results_by_query[query] for query in queries]
+
+
+class RefDataFailures(object):
+    """
+    Number of reference data lookups that failed, see track_ref_data_failures.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self):
+        with self._lock:
+            self.count += 1
+
+
+@contextmanager
+def track_ref_data_failures(failures=None):
+    """
+    Count the reference data lookups of the current thread that fail, eg. because Metax is unreachable. Lookups
+    that fail this way return None, as if the term had no reference data. Lookups get_ref_data_concurrently
+    sends to its pool threads are counted too.
+
+    :param failures: RefDataFailures to add the failures to, a new one by default
+    :return: context manager giving the RefDataFailures
+    """
+    if failures is None:
+        failures = RefDataFailures()
+    previous = getattr(_ref_data_tracking, 'failures', None)
+    _ref_data_tracking.failures = failures
+    try:
+        yield failures
+    finally:
+        _ref_data_tracking.failures = previous
+
+
+def _ref_data_failed():
+    failures = getattr(_ref_data_tracking, 'failures', None)
+    if failures is not None:
+        failures.add()
@@ -0,0 +1,242 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Counters and latency summaries of the Metax client and the harvest actions, exported in the Prometheus text
+format.
+
+The metrics are counted per process. They are exposed in two ways, both optional:
+
+* etsin.metrics.textfile_path: eg. /var/lib/node_exporter/etsin.prom, for the node exporter textfile collector.
+  Each process writes its own file, with its process id before the extension (etsin.1234.prom) and as the pid
+  label of its metrics, at most every etsin.metrics.write_interval seconds (default 15) and at exit; sum them
+  by the other labels in queries. The files of processes that are no longer running are removed when a
+  process writes its first file. The paster commands do not write metrics.
+* etsin.metrics.route = true: the CKAN route /etsin/metrics. It shows only the metrics of the web process
+  serving the request, not those of the harvester processes.
+"""
+
+import atexit
+import errno
+import glob
+import os
+import tempfile
+import threading
+import time
+
+from pylons import config
+
+from ckanext.etsin.timing import Histogram
+
+import logging
+log = logging.getLogger(__name__)
+
+DEFAULT_WRITE_INTERVAL = 15
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Help text of the metrics, by name
+METRICS_HELP = {
+    'etsin_metax_requests_total': 'Requests sent to Metax, by verb and response status',
+    'etsin_metax_request_seconds': 'Latency of requests to Metax, by verb',
+    'etsin_metax_request_bytes_total': 'Bytes of request bodies sent to Metax, by verb',
+    'etsin_metax_response_bytes_total': 'Bytes of response bodies received from Metax, by verb',
+    'etsin_metax_timeouts_total': 'Requests to Metax that timed out, by verb',
+    'etsin_metax_retries_total': 'Metax operations retried in another way after a failure, by operation',
+    'etsin_harvest_records_total': 'Harvested records by harvest source, action and outcome',
+    'etsin_mapping_cache_total': 'Lookups of mapped records in the mapping cache, by format and result',
+}
+
+_counters = {}
+_summaries = {}
+_lock = threading.Lock()
+_last_write = 0.0
+# Process whose stale textfiles were removed, see _remove_stale_textfiles
+_cleaned_pid = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted((labels or {}).items()))
+
+
+def inc(name, labels=None, value=1):
+    """
+    Increase a counter.
+
+    :param name: metric name, eg. 'etsin_metax_requests_total'
+    :param labels: dict of label name -> value
+    :param value: amount to add
+    """
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    _write_textfile_if_due()
+
+
+def observe(name, labels, seconds):
+    """
+    Add a duration to a latency summary.
+    """
+    key = _key(name, labels)
+    with _lock:
+        summary = _summaries.get(key)
+        if summary is None:
+            summary = _summaries[key] = Histogram()
+        summary.add(seconds)
+
+
+def get_counter(name, labels=None):
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def reset():
+    global _last_write, _cleaned_pid
+    with _lock:
+        _counters.clear()
+        _summaries.clear()
+        _last_write = 0.0
+        _cleaned_pid = None
+
+
+def record_harvest_outcome(harvest_source_name, action, outcome):
+    """
+    Count a harvested record.
+
+    :param action: 'create', 'update' or 'delete'
+    :param outcome: eg. 'created', 'updated', 'unchanged', 'failed'
+    """
+    inc('etsin_harvest_records_total', {'source': harvest_source_name or 'unknown', 'action': action,
+                                        'outcome': outcome})
+
+
+def _format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, _escape(value)) for name, value in labels) + '}'
+
+
+def _escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(extra_labels=()):
+    """
+    :param extra_labels: (name, value) pairs of labels added to every metric
+    :return: all metrics in the Prometheus text exposition format
+    """
+    with _lock:
+        counters = sorted(_counters.items())
+        summaries = []
+        for key, summary in sorted(_summaries.items()):
+            copy = Histogram()
+            copy.merge(summary)
+            summaries.append((key, copy))
+
+    lines = []
+    described = set()
+
+    def describe(name, metric_type):
+        if name not in described:
+            described.add(name)
+            if name in METRICS_HELP:
+                lines.append('# HELP {0} {1}'.format(name, METRICS_HELP[name]))
+            lines.append('# TYPE {0} {1}'.format(name, metric_type))
+
+    extra_labels = tuple(extra_labels)
+    for (name, labels), value in counters:
+        describe(name, 'counter')
+        lines.append('{0}{1} {2}'.format(name, _format_labels(labels, extra_labels), value))
+    for (name, labels), summary in summaries:
+        describe(name, 'summary')
+        for quantile in QUANTILES:
+            lines.append('{0}{1} {2!r}'.format(name, _format_labels(labels, extra_labels + (('quantile', quantile),)),
+                                               summary.percentile(quantile * 100)))
+        lines.append('{0}_sum{1} {2!r}'.format(name, _format_labels(labels, extra_labels), summary.total))
+        lines.append('{0}_count{1} {2}'.format(name, _format_labels(labels, extra_labels), summary.count))
+    return '\n'.join(lines) + '\n'
+
+
+def get_process_textfile_path(path, pid=None):
+    """
+    :param path: etsin.metrics.textfile_path, eg. etsin.prom
+    :return: the textfile of a process, eg. etsin.1234.prom
+    """
+    root, extension = os.path.splitext(path)
+    return '{0}.{1}{2}'.format(root, pid or os.getpid(), extension)
+
+
+def write_textfile(path, extra_labels=()):
+    """
+    Write the metrics to path atomically, so that the collector never reads a half written file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.etsin_metrics')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(render(extra_labels).encode('utf-8'))
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def _remove_stale_textfiles(path):
+    """
+    Remove the textfiles of processes that are no longer running, so that they do not pile up over restarts.
+    """
+    root, extension = os.path.splitext(path)
+    for process_path in glob.glob('{0}.*{1}'.format(root, extension)):
+        pid = process_path[len(root) + 1:len(process_path) - len(extension)]
+        if pid.isdigit() and not _is_running(int(pid)):
+            try:
+                os.remove(process_path)
+            except OSError:
+                pass
+
+
+def _write_textfile_if_due(force=False):
+    global _last_write, _cleaned_pid
+    path = config.get('etsin.metrics.textfile_path')
+    if not path:
+        return
+    interval = float(config.get('etsin.metrics.write_interval', DEFAULT_WRITE_INTERVAL))
+    now = time.time()
+    pid = os.getpid()
+    with _lock:
+        if not force and now - _last_write < interval:
+            return
+        _last_write = now
+        # Checked by process id, as forked processes inherit the state of their parent
+        clean = _cleaned_pid != pid
+        _cleaned_pid = pid
+    process_path = get_process_textfile_path(path, pid)
+    try:
+        if clean:
+            _remove_stale_textfiles(path)
+        write_textfile(process_path, [('pid', pid)])
+    except (IOError, OSError) as e:
+        log.error("Unable to write metrics to {0}: {1}".format(process_path, repr(e)))
+
+
+def _write_textfile_at_exit():
+    try:
+        _write_textfile_if_due(force=True)
+    except Exception:
+        # Config may not be available anymore at exit
+        pass
+
+
+atexit.register(_write_textfile_at_exit)
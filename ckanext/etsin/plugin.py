@@ -9,22 +9,27 @@
 
 import ckan.plugins as plugins
 import ckan.plugins.toolkit as toolkit
+from pylons import config
 
 from ckanext.oaipmh.interfaces import IOAIPMHHarvester
 from ckanext.spatial.interfaces import ISpatialHarvester
 
 from ckanext.etsin import actions
-from ckanext.etsin.mappers import cmdi
-from ckanext.etsin.mappers import datacite
-from ckanext.etsin.mappers import iso_19139
-from ckanext.etsin.mappers import ddi25
+from ckanext.etsin import mapping_cache
+from ckanext.etsin import profiling
+from ckanext.etsin import timing
+from ckanext.etsin.mapper_registry import ISO_19139_MAPPER, get_mapper, get_oaipmh_mapper
+from ckanext.etsin.refine import RECORD_CONTEXT_KEY
+from ckanext.etsin.utils import get_oaipmh_identifier
 
 import logging
 log = logging.getLogger(__name__)
 
+
 class EtsinPlugin(plugins.SingletonPlugin):
     plugins.implements(plugins.IActions)
     plugins.implements(plugins.IConfigurer)
+    plugins.implements(plugins.IRoutes, inherit=True)
     plugins.implements(ISpatialHarvester)
     plugins.implements(IOAIPMHHarvester)
 
@@ -45,23 +50,43 @@ class EtsinPlugin(plugins.SingletonPlugin):
         toolkit.add_public_directory(config_, 'public')
         toolkit.add_resource('fanstatic', 'etsin')
 
+    # IRoutes
+
+    def before_map(self, map):
+        if toolkit.asbool(config.get('etsin.metrics.route', False)):
+            map.connect('etsin_metrics', '/etsin/metrics',
+                        controller='ckanext.etsin.controllers:MetricsController', action='metrics')
+        return map
+
     # IOAIPMHHarvester
 
     def get_oaipmh_package_dict(self, format, xml):
         # OAI-PMH comes in several formats
-        if format == 'cmdi0571':
-            return cmdi.cmdi_mapper(xml)
-        elif format == 'oai_datacite':
-            return datacite.datacite_mapper(xml)
-        elif format == 'oai_ddi25':
-            return ddi25.ddi25_mapper(xml)
-        else:
+        mapper = get_oaipmh_mapper(format)
+        if mapper is None:
             return {}
+        cache = mapping_cache.get_mapping_cache()
+        # Values the mapper sets for the refiner, eg. the DDI index of the record, handed to the harvest actions
+        # in the package dict
+        record_context = {}
+        with timing.timer('map', source=format), \
+                profiling.profile('map', format, lambda: get_oaipmh_identifier(xml)):
+            if cache is None:
+                package_dict = mapper(xml, record_context)
+            else:
+                # Unchanged records of a re-harvest are not mapped again
+                package_dict = cache.get_or_map(format, xml, lambda xml: mapper(xml, record_context))
+        if package_dict and record_context:
+            package_dict[RECORD_CONTEXT_KEY] = record_context
+        return package_dict
 
     # ISpatialHarvester
 
     def get_package_dict(self, context, data_dict):
-        return iso_19139.iso_19139_mapper(context, data_dict)
+        harvest_source_name = context.get('harvest_source_name') or 'iso19139'
+        with timing.timer('map', source=harvest_source_name), \
+                profiling.profile('map', harvest_source_name, lambda: data_dict['harvest_object'].guid):
+            return get_mapper(*ISO_19139_MAPPER)(context, data_dict)
 
     # This needs to be here - otherwise ckanext-spatial fails silently
     def get_validators(self):
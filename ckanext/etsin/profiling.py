@@ -0,0 +1,141 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Opt-in profiling of a sampled fraction of harvested records.
+
+Settings in the CKAN config:
+
+* etsin.profile.sample_rate: fraction of records to profile, 0.0-1.0. Defaults to 0, profiling off.
+* etsin.profile.dir: directory the profiles are written to, as <dir>/<harvest source>/<stage>-<guid>-<time>.*
+* etsin.profile.mode: cpu, memory or both. Defaults to cpu.
+
+CPU profiles are cProfile stats (.prof), readable with pstats or snakeviz. Memory profiles need tracemalloc
+(the pytracemalloc backport on Python 2) and are the top allocations of the stage (.txt).
+"""
+
+import cProfile
+import os
+import random
+import re
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from pylons import config
+
+import logging
+log = logging.getLogger(__name__)
+
+MODE_CPU = 'cpu'
+MODE_MEMORY = 'memory'
+MODE_BOTH = 'both'
+
+# Number of allocation sites listed in memory profiles
+MEMORY_TOP_STATS = 50
+
+ProfileSettings = namedtuple('ProfileSettings', ['sample_rate', 'directory', 'cpu', 'memory'])
+
+_settings = None
+_random = random.Random()
+
+
+def get_settings():
+    """
+    Read the profiling settings from config on first use.
+
+    :return: ProfileSettings
+    """
+    global _settings
+    if _settings is None:
+        sample_rate = float(config.get('etsin.profile.sample_rate', 0) or 0)
+        directory = config.get('etsin.profile.dir')
+        mode = config.get('etsin.profile.mode', MODE_CPU)
+        if sample_rate > 0 and not directory:
+            log.error("etsin.profile.sample_rate is set but etsin.profile.dir is not, profiling is off")
+            sample_rate = 0.0
+        memory = mode in (MODE_MEMORY, MODE_BOTH)
+        if sample_rate > 0 and memory and _get_tracemalloc() is None:
+            log.warning("tracemalloc is not available, memory profiling is off")
+            memory = False
+        _settings = ProfileSettings(sample_rate=sample_rate, directory=directory,
+                                    cpu=mode in (MODE_CPU, MODE_BOTH), memory=memory)
+    return _settings
+
+
+def reset_settings():
+    global _settings
+    _settings = None
+
+
+def _get_tracemalloc():
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    return tracemalloc
+
+
+def _file_name_part(value):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', unicode(value or 'unknown'))[:100]
+
+
+def _profile_path(settings, stage, harvest_source_name, guid, extension):
+    directory = os.path.join(settings.directory, _file_name_part(harvest_source_name))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return os.path.join(directory, '{0}-{1}-{2:.6f}.{3}'.format(_file_name_part(stage), _file_name_part(guid),
+                                                                time.time(), extension))
+
+
+@contextmanager
+def profile(stage, harvest_source_name, guid):
+    """
+    Profile the block, if the record is sampled.
+
+    :param stage: name of the profiled stage, eg. 'map'
+    :param harvest_source_name: harvest source of the record
+    :param guid: identifier of the record, or a function returning it, called only if the record is sampled
+    """
+    settings = get_settings()
+    if not settings.sample_rate or _random.random() >= settings.sample_rate:
+        yield
+        return
+
+    if callable(guid):
+        guid = guid()
+
+    profiler = None
+    tracemalloc = None
+    started_tracing = False
+    snapshot = None
+    if settings.memory:
+        tracemalloc = _get_tracemalloc()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+        snapshot = tracemalloc.take_snapshot()
+    if settings.cpu:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        try:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(_profile_path(settings, stage, harvest_source_name, guid, 'prof'))
+            if tracemalloc is not None:
+                stats = tracemalloc.take_snapshot().compare_to(snapshot, 'lineno')
+                if started_tracing:
+                    tracemalloc.stop()
+                path = _profile_path(settings, stage, harvest_source_name, guid, 'txt')
+                with open(path, 'w') as f:
+                    for stat in stats[:MEMORY_TOP_STATS]:
+                        f.write('{0}\n'.format(stat))
+        except (IOError, OSError) as e:
+            log.error("Unable to write profile of {0} of {1}: {2}".format(stage, guid, repr(e)))
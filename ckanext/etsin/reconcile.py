@@ -0,0 +1,232 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Reconcile Metax catalog records and CKAN packages of a harvest source.
+
+Instead of finding out one record at a time that a catalog record has vanished
+from Metax, read all catalog records of the data catalog and all CKAN packages
+of the harvest source in bulk and compare them as sets.
+"""
+
+import logging
+from collections import namedtuple
+
+from dateutil import parser, tz
+from sqlalchemy import func
+
+import ckan.model as model
+import ckan.logic.action.delete
+from ckanext.harvest.model import HarvestObject
+
+import ckanext.etsin.metax_api as metax_api
+from ckanext.etsin.data_catalog_service import DataCatalogMetaxAPIService, \
+    get_data_catalog_filename_for_harvest_source
+from ckanext.etsin.journal import get_journal
+
+log = logging.getLogger(__name__)
+
+METAX_DELETE_BATCH_SIZE = 1000
+
+CkanPackage = namedtuple('CkanPackage', ['id', 'name', 'source_modified'])
+
+
+class ReconciliationResult(object):
+    """
+    Differences between the catalog records of a data catalog and the CKAN packages of a harvest source.
+
+    :ivar metax_orphans: identifiers of catalog records no CKAN package refers to
+    :ivar ckan_orphans: CkanPackages whose catalog record does not exist in Metax
+    :ivar stale: CkanPackages whose source was modified after the catalog record in Metax
+    """
+
+    def __init__(self, metax_orphans, ckan_orphans, stale):
+        self.metax_orphans = metax_orphans
+        self.ckan_orphans = ckan_orphans
+        self.stale = stale
+
+    def __repr__(self):
+        return '<ReconciliationResult metax_orphans={0} ckan_orphans={1} stale={2}>'.format(
+            len(self.metax_orphans), len(self.ckan_orphans), len(self.stale))
+
+
+def diff_catalog_records(metax_records, ckan_packages, in_progress_cr_ids=(), in_progress_preferred_identifiers=()):
+    """
+    Compare catalog records in Metax with CKAN packages. CKAN package name is the Metax catalog record identifier.
+
+    :param metax_records: dictionary of catalog record identifier -> dict with key modified, as returned by
+                          metax_api.get_catalog_records_for_data_catalog
+    :param ckan_packages: list of CkanPackages
+    :param in_progress_cr_ids: catalog record identifiers of harvest actions still in progress,
+                               never reported as orphans
+    :param in_progress_preferred_identifiers: preferred identifiers of harvest actions still in progress, whose
+                                              catalog records are never reported as orphans. A create in progress
+                                              may have created its catalog record before its identifier is known.
+    :return: ReconciliationResult
+    """
+    ckan_by_cr_id = dict((pkg.name, pkg) for pkg in ckan_packages)
+
+    metax_cr_ids = set(metax_records)
+    ckan_cr_ids = set(ckan_by_cr_id)
+
+    in_progress_preferred_identifiers = set(in_progress_preferred_identifiers)
+    in_progress = set(in_progress_cr_ids)
+    in_progress.update(cr_id for cr_id, record in metax_records.iteritems()
+                       if record.get('preferred_identifier', None) in in_progress_preferred_identifiers)
+
+    metax_orphans = sorted(metax_cr_ids - ckan_cr_ids - in_progress)
+    ckan_orphans = [ckan_by_cr_id[cr_id] for cr_id in sorted(ckan_cr_ids - metax_cr_ids)]
+
+    stale = []
+    for cr_id in sorted(metax_cr_ids & ckan_cr_ids):
+        pkg = ckan_by_cr_id[cr_id]
+        if _is_older(metax_records[cr_id].get('modified', None), pkg.source_modified):
+            stale.append(pkg)
+
+    return ReconciliationResult(metax_orphans, ckan_orphans, stale)
+
+
+def _is_older(metax_modified, source_modified):
+    if not metax_modified or source_modified is None:
+        return False
+    try:
+        metax_modified = parser.isoparse(metax_modified)
+    except ValueError:
+        log.debug("Unable to parse modified {0}".format(metax_modified))
+        return False
+    # Harvest object dates are naive UTC
+    if metax_modified.tzinfo is not None:
+        metax_modified = metax_modified.astimezone(tz.tzutc()).replace(tzinfo=None)
+    return metax_modified < source_modified
+
+
+def get_ckan_packages_for_harvest_source(harvest_source_name):
+    """
+    Get all active CKAN packages harvested from a harvest source with one query, also those whose harvest
+    objects are no longer current, eg. superseded by an import that did not finish.
+
+    :param harvest_source_name: name of the harvest source
+    :return: list of CkanPackages, with the source modified date of the latest harvest object of each
+    """
+    source = model.Package.get(harvest_source_name)
+    if source is None:
+        log.error("Harvest source {0} not found".format(harvest_source_name))
+        return []
+
+    rows = model.Session.query(model.Package.id, model.Package.name, func.max(HarvestObject.metadata_modified_date)) \
+                        .join(HarvestObject, HarvestObject.package_id == model.Package.id) \
+                        .filter(HarvestObject.harvest_source_id == source.id) \
+                        .filter(model.Package.state == u'active') \
+                        .group_by(model.Package.id, model.Package.name) \
+                        .all()
+    return [CkanPackage(*row) for row in rows]
+
+
+def get_active_package_names(names):
+    """
+    :param names: CKAN package names, ie. Metax catalog record identifiers
+    :return: set of the names that are names of active CKAN packages, whatever their harvest objects
+    """
+    names = list(names)
+    found = set()
+    for i in range(0, len(names), METAX_DELETE_BATCH_SIZE):
+        rows = model.Session.query(model.Package.name) \
+                            .filter(model.Package.name.in_(names[i:i + METAX_DELETE_BATCH_SIZE])) \
+                            .filter(model.Package.state == u'active') \
+                            .all()
+        found.update(row[0] for row in rows)
+    return found
+
+
+def _get_in_progress():
+    """
+    :return: (catalog record identifiers, preferred identifiers) of the harvest actions still in progress
+    """
+    harvest_journal = get_journal()
+    pending = harvest_journal.pending() if harvest_journal else []
+    return ([entry.metax_cr_id for entry in pending if entry.metax_cr_id],
+            [entry.preferred_identifier for entry in pending if entry.preferred_identifier])
+
+
+def _find_metax_orphans(metax_records, ckan_packages):
+    result = diff_catalog_records(metax_records, ckan_packages, *_get_in_progress())
+    # A catalog record is not an orphan if any active package refers to it, eg. one left without a current
+    # harvest object
+    named = get_active_package_names(result.metax_orphans)
+    result.metax_orphans = [cr_id for cr_id in result.metax_orphans if cr_id not in named]
+    return result
+
+
+def reconcile_harvest_source(harvest_source_name, context=None, repair=False):
+    """
+    Compare the Metax data catalog of a harvest source with its CKAN packages and optionally repair the differences.
+
+    Repairing deletes orphan catalog records from Metax in batches, and deletes orphan CKAN packages and marks
+    their harvest objects not current, so that the next harvest creates them again. Stale records are only
+    reported; the next harvest updates them.
+
+    :param harvest_source_name: name of the harvest source
+    :param context: CKAN action context used for deleting CKAN packages, required when repairing
+    :param repair: whether to repair the differences
+    :return: ReconciliationResult or None, if the data catalog of the harvest source is unknown
+    """
+    data_catalog_id = DataCatalogMetaxAPIService.get_data_catalog_id_from_file(
+        get_data_catalog_filename_for_harvest_source(harvest_source_name))
+    if not data_catalog_id:
+        log.error("No data catalog found for harvest source {0}".format(harvest_source_name))
+        return None
+
+    metax_records = metax_api.get_catalog_records_for_data_catalog(data_catalog_id)
+    ckan_packages = get_ckan_packages_for_harvest_source(harvest_source_name)
+
+    result = _find_metax_orphans(metax_records, ckan_packages)
+    log.info("Reconciled harvest source {0}: {1} catalog records in Metax, {2} packages in CKAN, {3}"
+             .format(harvest_source_name, len(metax_records), len(ckan_packages), result))
+
+    if repair:
+        _delete_metax_orphans(metax_records, result.metax_orphans)
+        _delete_ckan_orphans(context, result.ckan_orphans)
+
+    return result
+
+
+def _confirm_metax_orphans(metax_records, metax_cr_ids):
+    """
+    Check orphans again right before deleting them, since a harvest running meanwhile may have created or be
+    creating their packages.
+
+    :return: the catalog record identifiers that are still orphans
+    """
+    in_progress_cr_ids, in_progress_preferred_identifiers = _get_in_progress()
+    in_progress_preferred_identifiers = set(in_progress_preferred_identifiers)
+    excluded = set(in_progress_cr_ids) | get_active_package_names(metax_cr_ids)
+    return [cr_id for cr_id in metax_cr_ids if cr_id not in excluded and
+            metax_records[cr_id].get('preferred_identifier', None) not in in_progress_preferred_identifiers]
+
+
+def _delete_metax_orphans(metax_records, metax_cr_ids):
+    for i in range(0, len(metax_cr_ids), METAX_DELETE_BATCH_SIZE):
+        batch = _confirm_metax_orphans(metax_records, metax_cr_ids[i:i + METAX_DELETE_BATCH_SIZE])
+        if not batch:
+            continue
+        log.info("Deleting {0} orphan catalog records from MetaX".format(len(batch)))
+        metax_api.delete_catalog_records(batch)
+
+
+def _delete_ckan_orphans(context, ckan_packages):
+    if not ckan_packages:
+        return
+
+    for pkg in ckan_packages:
+        log.info("Deleting orphan package from CKAN database with ID: %s and name: %s", pkg.id, pkg.name)
+        ckan.logic.action.delete.package_delete(dict(context), {'id': pkg.id})
+
+    model.Session.query(HarvestObject) \
+                 .filter(HarvestObject.package_id.in_([pkg.id for pkg in ckan_packages])) \
+                 .filter(HarvestObject.current == True) \
+                 .update({'current': False}, synchronize_session=False)
+    model.Session.commit()
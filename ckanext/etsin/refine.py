@@ -5,26 +5,28 @@
 # :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
 # :license: GNU Affero General Public License version 3
 
-import ckanext.etsin.refiners.kielipankki as kielipankki
-import ckanext.etsin.refiners.syke as syke
-import ckanext.etsin.refiners.fsd as fsd
+from ckanext.etsin import refiner_registry, timing
 from ckanext.etsin.exceptions import DatasetFieldsMissingError
 
+# Key of a package dict holding the context the mapper of the record was given. The OAI-PMH harvester builds the
+# context of the harvest actions only after mapping, so the values the mapper set for the refiner travel in the
+# package dict to refine, which moves them to the context of the actions.
+RECORD_CONTEXT_KEY = '__etsin_record_context'
+
 
 def refine(context, package_dict):
     '''
     Chooses refiner function based on harvest source name.
     '''
 
+    for key, value in package_dict.pop(RECORD_CONTEXT_KEY, {}).items():
+        context.setdefault(key, value)
+
     harvest_source_name = context.get('harvest_source_name', '')
 
-    if harvest_source_name == "kielipankki":
-        package_dict = kielipankki.kielipankki_refiner(context, package_dict)
-    elif harvest_source_name == "syke":
-        package_dict = syke.syke_refiner(context, package_dict)
-    elif harvest_source_name == "fsd":
-        package_dict = fsd.fsd_refiner(context, package_dict)
-    else:
+    refiner = refiner_registry.get_refiner(harvest_source_name)
+    if refiner is None:
         raise DatasetFieldsMissingError(package_dict, "Unable to identify harvest source in refiner: %s", package_dict)
 
-    return package_dict
+    with timing.timer('refine', source=harvest_source_name):
+        return refiner(context, package_dict)
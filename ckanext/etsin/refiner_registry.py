@@ -0,0 +1,123 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Registry of refiners by harvest source name.
+
+Refiners are registered in setup.py in the entry point group ckanext.etsin.refiners, eg.
+
+    [ckanext.etsin.refiners]
+    fsd=ckanext.etsin.refiners.fsd:fsd_refiner
+
+The entry points are the only source of refiners in an installed package. BUILTIN_REFINERS is used only when no
+entry points are found, eg. in a checkout whose package metadata has not been generated.
+Refiner modules are imported only when the refiner of the source is first needed.
+
+The data catalog json file of a source in resources is, in order, the one given to register_refiner, the
+data_catalog_filename attribute of the refiner function, or <harvest source name>_data_catalog.json.
+"""
+
+from collections import namedtuple
+import importlib
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = 'ckanext.etsin.refiners'
+
+# Fallback for checkouts without package metadata, keep in sync with setup.py
+BUILTIN_REFINERS = {
+    'kielipankki': 'ckanext.etsin.refiners.kielipankki:kielipankki_refiner',
+    'syke': 'ckanext.etsin.refiners.syke:syke_refiner',
+    'fsd': 'ckanext.etsin.refiners.fsd:fsd_refiner',
+}
+
+DEFAULT_DATA_CATALOG_FILENAME = '{0}_data_catalog.json'
+
+# module_name and function_name of the refiner function, data_catalog_filename in resources or None for the default
+RefinerRegistration = namedtuple('RefinerRegistration', ['module_name', 'function_name', 'data_catalog_filename'])
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def _iter_entry_points():
+    try:
+        import pkg_resources
+    except ImportError:
+        return []
+    return pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)
+
+
+def _load_registry():
+    registry = {}
+    for entry_point in _iter_entry_points():
+        registry[entry_point.name] = RefinerRegistration(entry_point.module_name, '.'.join(entry_point.attrs), None)
+    if registry:
+        return registry
+
+    log.warning("No refiners found in entry point group {0}, using the built-in refiners".format(ENTRY_POINT_GROUP))
+    for harvest_source_name, target in BUILTIN_REFINERS.items():
+        module_name, function_name = target.split(':')
+        registry[harvest_source_name] = RefinerRegistration(module_name, function_name, None)
+    return registry
+
+
+def _get_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = _load_registry()
+    return _registry
+
+
+def register_refiner(harvest_source_name, module_name, function_name, data_catalog_filename=None):
+    """
+    Register a refiner for a harvest source, replacing any earlier registration.
+
+    :param harvest_source_name: harvest source name
+    :param module_name: name of the module of the refiner function
+    :param function_name: name of the refiner function in the module
+    :param data_catalog_filename: name of the data catalog json file of the source in resources, or None for the
+        data_catalog_filename attribute of the refiner function or <harvest source name>_data_catalog.json
+    """
+    _get_registry()[harvest_source_name] = RefinerRegistration(module_name, function_name, data_catalog_filename)
+
+
+def get_refiner(harvest_source_name):
+    """
+    Get the refiner function of a harvest source, importing its module if needed.
+
+    :param harvest_source_name: harvest source name
+    :return: refiner function of (context, package_dict) or None if no refiner is registered for the source
+    """
+    registration = _get_registry().get(harvest_source_name)
+    if registration is None:
+        return None
+    # Looked up on every call, so that replacing the module attribute (eg. in tests) takes effect
+    module = importlib.import_module(registration.module_name)
+    refiner = module
+    for name in registration.function_name.split('.'):
+        refiner = getattr(refiner, name)
+    return refiner
+
+
+def get_data_catalog_filename(harvest_source_name):
+    """
+    Get the name of the data catalog json file of a harvest source.
+
+    :param harvest_source_name: harvest source name
+    :return: file name or None if no refiner is registered for the source
+    """
+    registration = _get_registry().get(harvest_source_name)
+    if registration is None:
+        return None
+    if registration.data_catalog_filename is not None:
+        return registration.data_catalog_filename
+    data_catalog_filename = getattr(get_refiner(harvest_source_name), 'data_catalog_filename', None)
+    return data_catalog_filename or DEFAULT_DATA_CATALOG_FILENAME.format(harvest_source_name)
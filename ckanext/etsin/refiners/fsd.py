@@ -10,10 +10,10 @@
 """
 Refine FSD data_dict
 """
-from functionally import first
 import os
 import re
 
+from ..ddi_index import build_ddi_index
 from ..utils import (convert_language,
                      get_language_identifier,
                      get_tag_lang,
@@ -27,11 +27,9 @@ log = logging.getLogger(__name__)
 def fsd_refiner(context, data_dict):
     """ Refines the given MetaX data dict in a FSD-specific way
 
-    :param context: Dictionary with an lxml-field
+    :param context: Dictionary with an lxml-field, and optionally the DDIIndex of it in ddi_index
     :param data_dict: Dataset dictionary in MetaX format
     """
-    namespaces = {'oai': "http://www.openarchives.org/OAI/2.0/",
-                  'ddi': "ddi:codebook:2_5"}
     ACCESS_RIGHTS = [{
         'match': r"The dataset is \(A\)",
         'license': 'other-open',
@@ -49,13 +47,10 @@ def fsd_refiner(context, data_dict):
         'access_type': 'restricted'}]
 
     package_dict = data_dict
-    xml = context.get('source_data')
-    cb = first(xml.xpath('//oai:record/oai:metadata/ddi:codeBook',
-                         namespaces=namespaces))
+    index = context.get('ddi_index') or build_ddi_index(context.get('source_data'))
 
     # Language
-    languages = [get_tag_lang(fn) for fn in cb.findall(
-        'ddi:fileDscr/ddi:fileTxt/ddi:fileName', namespaces)]
+    languages = [get_tag_lang(fn) for fn in index.findall('fileDscr/fileTxt/fileName')]
 
     language_list = [{'identifier': get_language_identifier(
         convert_language(lang))} for lang in languages]
@@ -66,8 +61,7 @@ def fsd_refiner(context, data_dict):
     if 'access_rights' not in package_dict:
         package_dict['access_rights'] = {}
     restriction = {}
-    for res in cb.findall('ddi:stdyDscr/ddi:dataAccs/ddi:useStmt/ddi:restrctn',
-                          namespaces):
+    for res in index.findall('stdyDscr/dataAccs/useStmt/restrctn'):
         restriction[get_tag_lang(res)] = res.text.strip()
     if len(restriction.get('en', '')):
         for ar in ACCESS_RIGHTS:
@@ -89,8 +83,7 @@ def fsd_refiner(context, data_dict):
             log.error('Unknown licence in dataset')
 
     conditions = {}
-    for cond in cb.findall('ddi:stdyDscr/ddi:dataAccs/ddi:useStmt/ddi:conditions',
-                           namespaces):
+    for cond in index.findall('stdyDscr/dataAccs/useStmt/conditions'):
         conditions[get_tag_lang(cond)] = cond.text.strip()
     if len(conditions):
         package_dict['access_rights']['description'] = conditions
@@ -5,7 +5,12 @@
 # :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
 # :license: GNU Affero General Public License version 3
 
+import os
+import shutil
+import tempfile
+
 import ckanext.etsin.actions as actions
+import ckanext.etsin.journal as journal
 from ckanext.etsin.mappers.cmdi import cmdi_mapper
 from ckan import model
 
@@ -48,5 +53,107 @@ class TestActions(TestCase):
 #            ok_(mock_create.called)
 #
 
+
+class TestResumeJournaledActions(TestCase):
+    """ Tests for resume_journaled_actions """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.journal = journal.HarvestJournal(os.path.join(self.tmp_dir, 'journal.sqlite'))
+        # Metax has the catalog records cr1, of urn:1, and cr3, but not cr2 or cr4
+        existing = {'cr1': 'urn:1', 'cr3': 'urn:3'}
+        patches = [
+            patch.object(journal, 'get_journal', return_value=self.journal),
+            patch.object(actions.metax_api, 'check_catalog_record_exists', side_effect=lambda cr_id: cr_id in existing),
+            patch.object(actions.metax_api, 'get_catalog_record_identifier_using_preferred_identifier',
+                         side_effect=lambda pref_id: dict((v, k) for k, v in existing.items()).get(pref_id)),
+            patch('ckan.logic.action.create.package_create'),
+            patch('ckan.logic.action.update.package_update'),
+            patch('ckan.logic.action.delete.package_delete'),
+            patch.object(actions, '_link_harvest_object'),
+        ]
+        self.mocks = [p.start() for p in patches]
+        for p in patches:
+            self.addCleanup(p.stop)
+        self.create, self.update, self.delete, self.link_harvest_object = self.mocks[3:]
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _resume(self):
+        return actions.resume_journaled_actions(self.journal, lambda: {'user': 'harvest'})
+
+    def _steps(self):
+        return dict((package_id, self.journal.history(package_id)[-1].step)
+                    for package_id in ['pkg1', 'pkg2', 'pkg3', 'pkg4', 'pkg5', 'pkg6'])
+
+    def testCreates(self):
+        # The catalog record of pkg1 was created before the harvester stopped, that of pkg2 was not
+        self.journal.record('pkg1', journal.ACTION_CREATE, journal.STEP_BEGIN, 'fsd', 'urn:1', guid='oai:1')
+        self.journal.record('pkg2', journal.ACTION_CREATE, journal.STEP_BEGIN, 'fsd', 'urn:2', guid='oai:2')
+
+        eq_(self._resume(), {'finished': 1, 'rolled_back': 1, 'failed': 0})
+        eq_(self.create.call_args[0][1], {'id': 'pkg1', 'name': 'cr1'})
+        self.link_harvest_object.assert_called_once_with('fsd', 'oai:1', 'pkg1')
+        eq_(self.journal.pending(), [])
+        eq_(self.journal.history('pkg1')[-1].step, journal.STEP_DONE)
+        eq_(self.journal.history('pkg2')[-1].step, journal.STEP_ABORTED)
+
+    def testUpdatesAndDeletes(self):
+        # Updates of an existing and of a recreated catalog record, and one that changed nothing
+        self.journal.record('pkg1', journal.ACTION_UPDATE, journal.STEP_BEGIN, 'fsd', 'urn:1', 'cr1')
+        self.journal.record('pkg2', journal.ACTION_UPDATE, journal.STEP_BEGIN, 'fsd', 'urn:3')
+        self.journal.record('pkg3', journal.ACTION_UPDATE, journal.STEP_BEGIN, 'fsd', 'urn:4', 'cr4')
+        # Deletes that landed in Metax and that did not
+        self.journal.record('pkg4', journal.ACTION_DELETE, journal.STEP_BEGIN, 'fsd', metax_cr_id='cr2')
+        self.journal.record('pkg5', journal.ACTION_DELETE, journal.STEP_BEGIN, 'fsd', metax_cr_id='cr3')
+        # A delete whose Metax side was journaled as done
+        self.journal.record('pkg6', journal.ACTION_DELETE, journal.STEP_METAX_DONE, 'fsd', metax_cr_id='cr5')
+
+        eq_(self._resume(), {'finished': 4, 'rolled_back': 2, 'failed': 0})
+        eq_([c[0][1] for c in self.update.call_args_list],
+            [{'id': 'pkg1', 'name': 'cr1'}, {'id': 'pkg2', 'name': 'cr3'}])
+        eq_([c[0][1] for c in self.delete.call_args_list],
+            [{'id': 'pkg4', 'name': 'cr2'}, {'id': 'pkg6', 'name': 'cr5'}])
+        ok_(not self.link_harvest_object.called)
+        eq_(self._steps(), {'pkg1': journal.STEP_DONE, 'pkg2': journal.STEP_DONE, 'pkg3': journal.STEP_ABORTED,
+                            'pkg4': journal.STEP_DONE, 'pkg5': journal.STEP_ABORTED, 'pkg6': journal.STEP_DONE})
+
+    def testFailedActionIsLeftPending(self):
+        self.journal.record('pkg1', journal.ACTION_CREATE, journal.STEP_METAX_DONE, 'fsd', metax_cr_id='cr1')
+        self.create.side_effect = Exception('create failed')
+        self.update.side_effect = Exception('update failed')
+
+        eq_(self._resume(), {'finished': 0, 'rolled_back': 0, 'failed': 1})
+        eq_([entry.package_id for entry in self.journal.pending()], ['pkg1'])
+
+
+class TestLinkHarvestObject(TestCase):
+    """ Tests for _link_harvest_object """
+
+    def testLatestHarvestObjectIsMadeCurrent(self):
+        latest, older = Mock(current=False, package_id=None), Mock(current=True, package_id='pkg0')
+        with patch.object(actions, 'model') as mock_model, patch.object(actions, 'HarvestObject') as mock_ho:
+            mock_model.Package.get.return_value = Mock(id='source1')
+            mock_model.Session.query.return_value.filter.return_value.filter.return_value.order_by.return_value \
+                .all.return_value = [latest, older]
+            actions._link_harvest_object('fsd', 'oai:1', 'pkg1')
+            ok_(not mock_ho.called)
+            ok_(mock_model.Session.commit.called)
+        eq_((latest.current, latest.package_id), (True, 'pkg1'))
+        eq_(older.current, False)
+
+    def testMissingHarvestObjectIsAdded(self):
+        with patch.object(actions, 'model') as mock_model, patch.object(actions, 'HarvestObject') as mock_ho:
+            mock_model.Package.get.return_value = Mock(id='source1')
+            mock_model.Session.query.return_value.filter.return_value.filter.return_value.order_by.return_value \
+                .all.return_value = []
+            actions._link_harvest_object('fsd', 'oai:1', 'pkg1')
+            eq_(mock_ho.call_args[1]['guid'], 'oai:1')
+            eq_(mock_ho.call_args[1]['harvest_source_id'], 'source1')
+            mock_model.Session.add.assert_called_once_with(mock_ho.return_value)
+        eq_((mock_ho.return_value.current, mock_ho.return_value.package_id), (True, 'pkg1'))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,45 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for the agent model of the mappers"""
+from unittest import TestCase
+
+from nose.tools import assert_raises, eq_, ok_
+
+from ckanext.etsin.agents import Organization, Person, intern_text
+
+
+class TestAgents(TestCase):
+
+    def testOrganizationToMetax(self):
+        eq_(Organization((('fi', u'Yliopisto'), ('en', u'University')), email='info@example.com',
+                         telephone='+358 1', homepage='http://example.com').to_metax(),
+            {'@type': 'Organization', 'name': {'fi': u'Yliopisto', 'en': u'University'},
+             'email': 'info@example.com', 'telephone': ['+358 1'], 'homepage': {'identifier': 'http://example.com'}})
+        eq_(Organization(u'University').to_metax(), {'@type': 'Organization', 'name': u'University'})
+
+    def testPersonToMetax(self):
+        eq_(Person(u'Maija', email='', member_of=Organization((('und', u'University'),))).to_metax(),
+            {'@type': 'Person', 'name': u'Maija', 'email': '',
+             'member_of': {'@type': 'Organization', 'name': {'und': u'University'}}})
+        eq_(Person(u'Matti', identifier='http://orcid.org/1').to_metax(),
+            {'@type': 'Person', 'name': u'Matti', 'identifier': 'http://orcid.org/1'})
+
+    def testRepeatedStringsAreShared(self):
+        strings = {}
+        first = Organization((('fi', ''.join(['Yli', 'opisto'])),), strings=strings)
+        second = Organization((('fi', ''.join(['Yliopi', 'sto'])),), strings=strings)
+        ok_(first.names[0][1] is second.names[0][1])
+        # Strings are shared only within the dict given, eg. of one record
+        other = Organization((('fi', ''.join(['Yliop', 'isto'])),), strings={})
+        ok_(other.names[0][1] is not first.names[0][1])
+        eq_(intern_text(strings, None), None)
+        eq_(intern_text(None, 'a'), 'a')
+
+    def testAgentsHaveNoDict(self):
+        with assert_raises(AttributeError):
+            Person(u'Maija').role = 'author'
@@ -0,0 +1,101 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for mapping dumps of records to Metax catalog records"""
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from StringIO import StringIO
+from unittest import TestCase
+
+from mock import patch
+from nose.tools import eq_
+
+import ckanext.etsin.metax_api as api
+from ckanext.etsin import batch, dumps
+from ckanext.etsin.benchmarks.corpus import DEFAULT_SETTINGS, GENERATORS
+from ckanext.etsin.benchmarks.metax_server import MetaxStore, start_in_thread
+
+LIST_RECORDS = '''<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><ListRecords>
+<record><header><identifier>oai:1</identifier></header><metadata/></record>
+<record><header status="deleted"><identifier>oai:2</identifier></header></record>
+</ListRecords></OAI-PMH>'''
+
+
+class TestBatch(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dump = os.path.join(self.directory, 'dump')
+        os.mkdir(self.dump)
+        self.records = list(GENERATORS['ddi25'](DEFAULT_SETTINGS._replace(records=10, description_size=(10, 100))))
+        for i, record in enumerate(self.records):
+            with open(os.path.join(self.dump, '{0:02d}.xml'.format(i)), 'w') as f:
+                f.write(record.xml)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _identifiers(self, paths):
+        return [dumps.oaipmh_header(dumps.etree.fromstring(xml))[0] for xml in dumps.iter_records(paths)]
+
+    def testRecordsAreReadFromArchives(self):
+        tar_path = os.path.join(self.directory, 'dump.tar.gz')
+        with tarfile.open(tar_path, 'w:gz') as archive:
+            archive.add(self.dump, 'dump')
+        zip_path = os.path.join(self.directory, 'dump.zip')
+        with zipfile.ZipFile(zip_path, 'w') as archive:
+            for name in sorted(os.listdir(self.dump)):
+                archive.write(os.path.join(self.dump, name), name)
+        guids = [record.guid for record in self.records]
+        eq_(self._identifiers([self.dump]), guids)
+        eq_(sorted(self._identifiers([tar_path])), sorted(guids))
+        eq_(self._identifiers([zip_path]), guids)
+
+    def testListRecordsResponseIsSplit(self):
+        path = os.path.join(self.directory, 'page.xml')
+        with open(path, 'w') as f:
+            f.write(LIST_RECORDS)
+        eq_(self._identifiers([path]), ['oai:1', 'oai:2'])
+
+    def testCatalogRecordsAreWrittenInOrder(self):
+        server = start_in_thread(MetaxStore())
+        try:
+            with patch('ckanext.etsin.metax_api.config', {'metax.host': server.host, 'metax.protocol': 'http',
+                                                          'metax.verify_ssl': 'false'}):
+                api.reset_settings()
+                outputs = []
+                for processes in (1, 3):
+                    output = StringIO()
+                    outcomes = batch.run('oai_ddi25', 'fsd', dumps.iter_records([self.dump]), output,
+                                         processes=processes, chunksize=2)
+                    eq_(outcomes, {batch.MAPPED: len(self.records)})
+                    outputs.append(output.getvalue())
+        finally:
+            api.reset_settings()
+            server.shutdown()
+            server.server_close()
+
+        # The pool writes the same catalog records in the same order as mapping in one process
+        eq_(outputs[0], outputs[1])
+        catalog_records = [json.loads(line) for line in outputs[1].splitlines()]
+        eq_(len(catalog_records), len(self.records))
+        eq_(catalog_records[0]['data_catalog'], 'urn:nbn:fi:att:data-catalog-harvest-fsd')
+        eq_(len(set(cr['research_dataset']['preferred_identifier'] for cr in catalog_records)), len(self.records))
+
+    def testBrokenRecordIsNotWritten(self):
+        output = StringIO()
+        path = os.path.join(self.directory, 'page.xml')
+        with open(path, 'w') as f:
+            f.write(LIST_RECORDS)
+        outcomes = batch.run('oai_ddi25', 'fsd', dumps.iter_records([path]), output, processes=1)
+        # The first record has no metadata, the second is deleted
+        eq_(outcomes, {batch.FAILED: 1, batch.DELETED: 1})
+        eq_(output.getvalue(), '')
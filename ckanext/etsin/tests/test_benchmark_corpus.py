@@ -0,0 +1,44 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for the synthetic benchmark corpora and the mapper benchmark."""
+from unittest import TestCase
+
+from nose.tools import eq_, ok_
+
+from ckanext.etsin.benchmarks.corpus import DEFAULT_SETTINGS, GENERATORS
+from ckanext.etsin.benchmarks.mappers import FORMATS, regressions, run_format
+
+SETTINGS = DEFAULT_SETTINGS._replace(records=5, agents=(1, 5), description_size=(10, 200))
+
+
+class TestCorpus(TestCase):
+
+    def testSameSeedGivesSameCorpus(self):
+        for format_name in FORMATS:
+            eq_(list(GENERATORS[format_name](SETTINGS)), list(GENERATORS[format_name](SETTINGS)))
+
+    def testRecordsDiffer(self):
+        for format_name in FORMATS:
+            records = list(GENERATORS[format_name](SETTINGS))
+            eq_(len(records), 5)
+            eq_(len(set(repr(record[1]) for record in records)), 5)
+
+    def testAllRecordsMap(self):
+        for format_name in FORMATS:
+            result = run_format(format_name, SETTINGS)
+            eq_(result['records'], 5)
+            eq_(result['failed'], 0, format_name)
+            ok_(result['p50_ms'] <= result['p99_ms'])
+
+    def testRegressions(self):
+        baseline = [{'format': 'cmdi', 'records_per_second': 100.0},
+                    {'format': 'ddi25', 'records_per_second': 100.0}]
+        results = [{'format': 'cmdi', 'records_per_second': 95.0},
+                   {'format': 'ddi25', 'records_per_second': 80.0},
+                   {'format': 'datacite', 'records_per_second': 1.0}]
+        eq_(regressions(results, baseline, 10), [('ddi25', 100.0, 80.0)])
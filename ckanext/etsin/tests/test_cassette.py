@@ -0,0 +1,113 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for recording Metax requests to a cassette and replaying them"""
+import json
+import os
+import shutil
+import tempfile
+import timeit
+from unittest import TestCase
+
+from mock import patch
+from nose.tools import assert_raises, eq_, ok_
+from requests import HTTPError
+
+import ckanext.etsin.cassette as cassette
+import ckanext.etsin.metax_api as api
+from ckanext.etsin.benchmarks.metax_server import Faults, MetaxStore, start_in_thread
+
+
+def _record(preferred_identifier):
+    return {'data_catalog': 'urn:nbn:fi:att:data-catalog-test',
+            'research_dataset': {'preferred_identifier': preferred_identifier, 'modified': '2018-01-01T00:00:00Z'}}
+
+
+class TestCassette(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'metax.jsonl')
+        self.server = start_in_thread(MetaxStore(), Faults(latency=0.05))
+        self.metax_config = patch('ckanext.etsin.metax_api.config', {'metax.host': self.server.host,
+                                                                     'metax.protocol': 'http',
+                                                                     'metax.verify_ssl': 'false'})
+        self.metax_config.start()
+        api.reset_settings()
+
+    def tearDown(self):
+        self.metax_config.stop()
+        api.reset_settings()
+        cassette.reset()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def _cassette(self, mode, time_scale='1.0'):
+        cassette.reset()
+        return patch('ckanext.etsin.cassette.config', {'etsin.cassette.mode': mode,
+                                                       'etsin.cassette.path': self.path,
+                                                       'etsin.cassette.time_scale': time_scale})
+
+    def _harvest(self):
+        """ Requests of a small harvest, returning what Metax answered """
+        cr_id = api.create_catalog_record(_record('urn:1'))
+        try:
+            api.create_catalog_record(_record('urn:1'))
+            duplicate = None
+        except HTTPError as e:
+            duplicate = e.response.status_code
+        exists = api.check_catalog_record_exists(cr_id)
+        api.delete_catalog_record(cr_id)
+        return cr_id, duplicate, exists, api.check_catalog_record_exists(cr_id), \
+            api.get_ref_data_batch([('location', 'label.fi', 'Suomi', 'code'), ('license', 'uri', 'x', 'id')])
+
+    def testReplayAnswersAsRecorded(self):
+        with self._cassette('record'):
+            recorded = self._harvest()
+        eq_(len(open(self.path).readlines()), 6)
+
+        # Metax is gone, the cassette answers
+        self.server.shutdown()
+        self.server.server_close()
+        with self._cassette('replay', time_scale='0'):
+            eq_(self._harvest(), recorded)
+        eq_(recorded[1:4], (400, True, False))
+
+    def testReplayKeepsScaledLatency(self):
+        with self._cassette('record'):
+            api.get_ref_data('location', 'label.fi', 'Suomi', 'code')
+        with self._cassette('replay', time_scale='2'):
+            start = timeit.default_timer()
+            eq_(api.get_ref_data('location', 'label.fi', 'Suomi', 'code'), 'http://www.yso.fi/onto/yso/p94426')
+            ok_(timeit.default_timer() - start >= 0.1)
+
+    def testJsonBodiesMatchAsData(self):
+        with self._cassette('record'):
+            cr_id = api.create_catalog_record({'research_dataset': {'preferred_identifier': 'urn:1', 'a': 1, 'b': 2},
+                                               'data_catalog': 'c'})
+        with open(self.path) as f:
+            entry = json.loads(f.readline())
+        # The same body, serialized with keys in another order
+        entry['body'] = json.dumps(json.loads(entry['body']), sort_keys=True, indent=1)
+        with open(self.path, 'w') as f:
+            f.write(json.dumps(entry) + '\n')
+        with self._cassette('replay', time_scale='0'):
+            eq_(api.create_catalog_record({'data_catalog': 'c',
+                                           'research_dataset': {'b': 2, 'a': 1, 'preferred_identifier': 'urn:1'}}),
+                cr_id)
+
+    def testUnrecordedRequestFails(self):
+        open(self.path, 'w').close()
+        with self._cassette('replay', time_scale='0'):
+            with assert_raises(cassette.CassetteMissError):
+                api.create_catalog_record(_record('urn:1'))
+
+    def testOffWithoutPath(self):
+        cassette.reset()
+        with patch('ckanext.etsin.cassette.config', {'etsin.cassette.mode': 'replay'}):
+            eq_(cassette.get_cassette(), None)
@@ -7,6 +7,7 @@
 
 """Tests for mappers/datacite.py."""
 
+from lxml import etree
 from nose.tools import eq_
 from unittest import TestCase
 
@@ -103,3 +104,45 @@ class TestMappersDataCite(TestCase):
     # TODO: current test file doesn't have location
     def testLocation(self):
         pass
+
+    def testInputTreeIsNotModified(self):
+        xml = _get_file_as_lxml('datacite/datacite1.xml')
+        before = etree.tostring(xml)
+        datacite_mapper(xml)
+        eq_(etree.tostring(xml), before)
+
+
+class TestMappersDataCiteNamespaced(TestCase):
+
+    XML = '''<resource xmlns="http://datacite.org/schema/kernel-4">
+      <identifier identifierType="DOI">10.1234/abc</identifier>
+      <creators><creator><creatorName>Doe, Jane</creatorName>
+        <affiliation>University</affiliation></creator></creators>
+      <titles><title titleType="Subtitle">Sub</title><title>Main</title></titles>
+      <publisher>Publisher</publisher>
+      <publicationYear>2018</publicationYear>
+      <language>en-GB</language>
+      <contributors><contributor contributorType="ContactPerson">
+        <contributorName>Curator, Carl</contributorName></contributor></contributors>
+      <version>2.0</version>
+      <descriptions><description descriptionType="Abstract">Text</description></descriptions>
+    </resource>'''
+
+    @classmethod
+    def setup_class(cls):
+        cls.research_dataset = datacite_mapper(etree.fromstring(cls.XML))['research_dataset']
+
+    def testIdentifier(self):
+        eq_(self.research_dataset['preferred_identifier'], 'https://dx.doi.org/10.1234/abc')
+
+    def testTitleAndLanguage(self):
+        eq_(self.research_dataset['title'], {'en': 'Main'})
+        eq_(self.research_dataset['description'], [{'en': 'Abstract: Text '}])
+
+    def testAgents(self):
+        eq_(self.research_dataset['creator'], [{'@type': 'Person', 'name': 'Doe, Jane', 'member_of': {
+            '@type': 'Organization', 'name': {'und': 'University'}}}])
+        eq_(self.research_dataset['curator'], [{'@type': 'Person', 'name': 'Curator, Carl'}])
+
+    def testVersion(self):
+        eq_(self.research_dataset['version_info'], '2.0')
@@ -0,0 +1,74 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for ddi_index.py."""
+import unittest
+from unittest import TestCase
+
+from lxml import etree
+from mock import patch
+from nose.tools import eq_, ok_
+
+from ckanext.etsin.ddi_index import NAMESPACES, build_ddi_index
+from ckanext.etsin.mappers import ddi25
+from ckanext.etsin.refiners import fsd
+
+from .helpers import _get_file_as_lxml
+
+
+class TestDDIIndex(TestCase):
+
+    def setUp(self):
+        self.xml = _get_file_as_lxml('ddi25/ddi25_1.xml')
+        self.index = build_ddi_index(self.xml)
+        self.stdy = self.xml.find('.//ddi:codeBook/ddi:stdyDscr', NAMESPACES)
+
+    def testFindallMatchesLxml(self):
+        for path in ['stdyDscr/citation/titlStmt/titl', 'stdyDscr/stdyInfo/subject/keyword',
+                     'stdyDscr/citation', 'fileDscr/fileTxt/fileName']:
+            ddi_path = '/'.join('ddi:' + name for name in path.split('/'))
+            eq_(self.index.findall(path), self.xml.find('.//ddi:codeBook', NAMESPACES).findall(ddi_path, NAMESPACES))
+        eq_(self.index.findall('no/such/path'), [])
+        eq_(self.index.find('no/such/path'), None)
+
+    def testAttributeSubIndexes(self):
+        lang = '{http://www.w3.org/XML/1998/namespace}lang'
+        eq_(self.index.find_by('stdyDscr/stdyInfo/sumDscr/nation', 'lang', 'fi'),
+            self.stdy.find("ddi:stdyInfo/ddi:sumDscr/ddi:nation[@{0}='fi']".format(lang), NAMESPACES))
+        eq_(self.index.findall_by('stdyDscr/stdyInfo/subject/topcClas', 'vocab', 'OKM'),
+            self.stdy.findall("ddi:stdyInfo/ddi:subject/ddi:topcClas[@vocab='OKM']", NAMESPACES))
+        eq_(self.index.find_by('stdyDscr/stdyInfo/sumDscr/collDate', 'event', 'start'),
+            self.stdy.find("ddi:stdyInfo/ddi:sumDscr/ddi:collDate[@event='start']", NAMESPACES))
+
+    def testFindallWithin(self):
+        for citation in self.index.findall('stdyDscr/citation'):
+            eq_(self.index.findall_within(citation, 'stdyDscr/citation/rspStmt/AuthEnty',
+                                          'stdyDscr/citation/rspStmt/othId'),
+                citation.xpath('ddi:rspStmt/ddi:AuthEnty|ddi:rspStmt/ddi:othId', namespaces=NAMESPACES))
+
+    def testOnlyFirstStudyIsIndexed(self):
+        codebook = self.xml.find('.//ddi:codeBook', NAMESPACES)
+        codebook.append(etree.fromstring(etree.tostring(self.stdy)))
+        index = build_ddi_index(etree.fromstring(etree.tostring(self.xml)))
+        eq_(len(index.findall('stdyDscr')), 1)
+        eq_(len(index.findall('stdyDscr/citation')), len(self.index.findall('stdyDscr/citation')))
+
+
+    def testMapperSharesIndexWithRefiner(self):
+        context = {'source_data': self.xml}
+        with patch.object(ddi25, 'get_ref_data_batch', side_effect=lambda queries: [None] * len(queries)):
+            package_dict = ddi25.ddi25_mapper(self.xml, context)
+        ok_(context['ddi_index'].codebook is self.xml.find('.//ddi:codeBook', NAMESPACES))
+
+        package_dict['preferred_identifier'] = 'urn:nbn:fi:fsd:T-FSD3092'
+        with patch.object(fsd, 'build_ddi_index') as mock_build_ddi_index:
+            fsd.fsd_refiner(context, package_dict)
+        ok_(not mock_build_ddi_index.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for dry runs of harvests"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from mock import Mock, patch
+from nose.tools import eq_, ok_
+
+from ckanext.etsin import dry_run, dumps
+import helpers
+
+DDI_GUID = 'oai:fsd.uta.fi:FSD3092'
+
+LIST_RECORDS = '''<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><ListRecords>
+<record><header><identifier>oai:1</identifier></header><metadata/></record>
+<record><header status="deleted"><identifier>oai:2</identifier></header></record>
+</ListRecords></OAI-PMH>'''
+
+
+def _no_ref_data(queries):
+    return [None] * len(queries)
+
+
+class TestDryRun(TestCase):
+
+    def setUp(self):
+        harvest_user = Mock()
+        harvest_user.name = 'harvest'
+        self.metax_create = Mock()
+        self.metax_update = Mock()
+        self.ckan_create = Mock()
+        self.ckan_update = Mock()
+        self.patches = [
+            patch('ckanext.etsin.actions.model'),
+            patch('ckanext.etsin.actions._get_metax_id_from_ckan_db', return_value='cr-1'),
+            patch('ckanext.etsin.mappers.ddi25.get_ref_data_batch', side_effect=_no_ref_data),
+            patch('ckanext.etsin.metax_api.get_ref_data', return_value=None),
+            patch('ckanext.etsin.metax_api.create_catalog_record', self.metax_create),
+            patch('ckanext.etsin.metax_api.update_catalog_record', self.metax_update),
+            patch('ckanext.etsin.metax_api.check_catalog_record_exists', return_value=True),
+            patch('ckan.logic.action.create.package_create', self.ckan_create),
+            patch('ckan.logic.action.update.package_update', self.ckan_update),
+        ]
+        for p in self.patches:
+            p.start().User.get.return_value = harvest_user
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def _valid(self):
+        return patch('ckanext.etsin.actions.validate_research_dataset')
+
+    def _dry_run(self, existing):
+        records = dry_run.iter_records([helpers._get_fixture('ddi25/ddi25_1.xml')])
+        with patch('ckanext.etsin.dry_run._get_existing_package_ids', return_value=existing):
+            return dry_run.dry_run('fsd', 'oai_ddi25', records, lambda: {'user': 'harvest'})
+
+    def testNewRecordWouldBeCreated(self):
+        with self._valid():
+            summary = self._dry_run({})
+        eq_(summary.outcomes, {'would_create': 1}, summary.format())
+        eq_(self.metax_create.call_count + self.ckan_create.call_count, 0)
+
+    def testChangedRecordWouldBeUpdated(self):
+        with patch('ckanext.etsin.metax_api.get_catalog_record_research_dataset_modified_using_preferred_identifier',
+                   return_value='2000-01-01T00:00:00Z'), self._valid():
+            summary = self._dry_run({DDI_GUID: 'package-1'})
+        eq_(summary.outcomes, {'would_update': 1}, summary.format())
+        eq_(self.metax_update.call_count + self.ckan_update.call_count, 0)
+
+    def testUnmodifiedRecordIsUnchanged(self):
+        with patch('ckanext.etsin.metax_api.get_catalog_record_research_dataset_modified_using_preferred_identifier',
+                   return_value='2018-01-01T00:00:00Z'), self._valid(), \
+                patch('ckanext.etsin.actions.refine',
+                      side_effect=lambda context, package_dict: dict(package_dict, modified='2018-01-01T00:00:00Z')):
+            summary = self._dry_run({DDI_GUID: 'package-1'})
+        eq_(summary.outcomes, {'unchanged': 1})
+
+    def testInvalidRecordIsReported(self):
+        # The URN of the fixture is not marked with agency URN, so the record has no preferred identifier
+        summary = self._dry_run({})
+        eq_(summary.outcomes, {'invalid': 1})
+        eq_(summary.problems[0][0], DDI_GUID)
+        ok_('preferred_identifier' in summary.problems[0][1])
+        eq_(self.metax_create.call_count + self.ckan_create.call_count, 0)
+
+
+class TestIterRecords(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testListRecordsAreSplitToRecords(self):
+        with open(os.path.join(self.directory, 'page1.xml'), 'w') as f:
+            f.write(LIST_RECORDS)
+        records = list(dry_run.iter_records([self.directory, helpers._get_fixture('ddi25/ddi25_1.xml')]))
+        eq_([dumps.oaipmh_header(record) for record in records],
+            [('oai:1', False), ('oai:2', True), (DDI_GUID, False)])
+        for record in records:
+            # Each record is the root of its own tree, so the mappers find only its header
+            eq_(record.getroottree().getroot(), record)
+
+    def testSummary(self):
+        summary = dry_run.DryRunSummary()
+        summary.add('would_create')
+        summary.add('invalid', 'oai:1', ValueError('No title'))
+        summary.seconds = 2.0
+        eq_(summary.records, 2)
+        ok_('1.0 records/s' in summary.format())
+        ok_('oai:1: No title' in summary.format())
@@ -0,0 +1,26 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests that heavy dependencies are imported on first use, not at startup."""
+from unittest import TestCase
+
+from nose.tools import eq_
+
+from ckanext.etsin.benchmarks.imports import import_in_child
+
+
+class TestImports(TestCase):
+
+    def testUtilsImportsNoHeavyModules(self):
+        eq_(import_in_child('ckanext.etsin.utils')[1], [])
+
+    def testMetaxApiImportsNoHeavyModules(self):
+        eq_(import_in_child('ckanext.etsin.metax_api')[1], [])
+
+    def testValidationImportsNoHeavyModules(self):
+        eq_(import_in_child('ckanext.etsin.validation')[1], [])
+
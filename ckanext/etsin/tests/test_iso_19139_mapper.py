@@ -7,7 +7,7 @@
 
 """Tests for mappers/iso_19139.py."""
 
-from ckanext.etsin.mappers.iso_19139 import iso_19139_mapper
+from ckanext.etsin.mappers.iso_19139 import iso_19139_mapper, _group_agents_by_role
 from nose.tools import eq_
 from nose.tools import assert_not_equal as neq_
 from unittest import TestCase
@@ -45,3 +45,14 @@ class TestMappersISO19139(TestCase):
         eq_('2001-01-01T23:59:59-00:00', dict['temporal'][0]['end_date'])
         eq_('2017-06-06T00:00:00-00:00', dict['modified'])
         self.assertDictEqual(dict['provenance'][0], {'description': {'fi': 'provenance'}})
+
+    def testGroupAgentsByRole(self):
+        author = {'role': ['author', 'owner']}
+        processor_user = {'role': ['processor', 'user']}
+        poc = {'role': 'pointOfContact'}
+        agents_by_role = _group_agents_by_role([author, processor_user, poc, {}, {'role': ['author']}])
+        eq_(agents_by_role['author'], [author])
+        eq_(agents_by_role['owner'], [author])
+        eq_(agents_by_role['pointOfContact'], [poc])
+        eq_(agents_by_role['contributor'], [processor_user])
+        eq_(agents_by_role['publisher'], [])
@@ -0,0 +1,87 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for journal.py."""
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import TestCase
+
+from nose.tools import eq_, ok_
+
+from ckanext.etsin import journal
+
+
+class TestHarvestJournal(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.journal = journal.HarvestJournal(os.path.join(self.tmp_dir, 'journal.sqlite'))
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def testPendingReturnsLatestUnfinishedStep(self):
+        self.journal.record('pkg1', journal.ACTION_CREATE, journal.STEP_BEGIN, 'fsd', 'urn:1')
+        self.journal.record('pkg1', journal.ACTION_CREATE, journal.STEP_METAX_DONE, 'fsd', metax_cr_id='cr1')
+        self.journal.record('pkg2', journal.ACTION_UPDATE, journal.STEP_BEGIN, 'syke')
+        self.journal.record('pkg3', journal.ACTION_DELETE, journal.STEP_BEGIN, 'fsd')
+        self.journal.record('pkg3', journal.ACTION_DELETE, journal.STEP_METAX_DONE, 'fsd')
+        self.journal.record('pkg3', journal.ACTION_DELETE, journal.STEP_DONE, 'fsd')
+
+        pending = self.journal.pending()
+        eq_([(e.package_id, e.step) for e in pending],
+            [('pkg1', journal.STEP_METAX_DONE), ('pkg2', journal.STEP_BEGIN)])
+        eq_(pending[0].metax_cr_id, 'cr1')
+
+    def testCompactKeepsOnlyUnfinishedPackages(self):
+        self.journal.record('pkg1', journal.ACTION_CREATE, journal.STEP_BEGIN)
+        self.journal.record('pkg1', journal.ACTION_CREATE, journal.STEP_ABORTED)
+        self.journal.record('pkg2', journal.ACTION_CREATE, journal.STEP_BEGIN)
+
+        eq_(self.journal.compact(), 2)
+        eq_(self.journal.history('pkg1'), [])
+        eq_(len(self.journal.history('pkg2')), 1)
+
+    def testJournalIsCompactedOverActions(self):
+        self.journal.compact_interval = 10
+        for i in range(100):
+            package_id = 'pkg{0}'.format(i)
+            self.journal.record(package_id, journal.ACTION_CREATE, journal.STEP_BEGIN)
+            self.journal.record(package_id, journal.ACTION_CREATE, journal.STEP_METAX_DONE)
+            self.journal.record(package_id, journal.ACTION_CREATE, journal.STEP_DONE)
+            rows = self.journal._conn.execute('SELECT COUNT(*) FROM journal').fetchone()[0]
+            ok_(rows <= 3 * 10, rows)
+        # Unfinished actions are kept
+        self.journal.record('pkg', journal.ACTION_CREATE, journal.STEP_BEGIN)
+        self.journal.compact()
+        eq_([entry.package_id for entry in self.journal.pending()], ['pkg'])
+
+    def testJournalSurvivesReopen(self):
+        self.journal.record('pkg1', journal.ACTION_UPDATE, journal.STEP_BEGIN, preferred_identifier='urn:1')
+        self.journal.close()
+        self.journal = journal.HarvestJournal(os.path.join(self.tmp_dir, 'journal.sqlite'))
+
+        eq_(self.journal.pending()[0].preferred_identifier, 'urn:1')
+
+    def testGuidColumnIsAddedToOldJournal(self):
+        path = os.path.join(self.tmp_dir, 'old.sqlite')
+        conn = sqlite3.connect(path)
+        conn.executescript(journal._SCHEMA.replace(',\n    guid TEXT', ''))
+        conn.close()
+
+        old_journal = journal.HarvestJournal(path)
+        old_journal.record('pkg1', journal.ACTION_CREATE, journal.STEP_BEGIN, guid='oai:1')
+        eq_(old_journal.pending()[0].guid, 'oai:1')
+        old_journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for the mapping cache"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from lxml import etree
+from mock import Mock, patch
+from nose.tools import eq_, ok_
+
+from ckanext.etsin import metax_api
+from ckanext.etsin.mapping_cache import MappingCache, get_mapper_version, record_digest
+
+RECORD = '<record xmlns="urn:test"><title lang="fi" type="main">Otsikko</title></record>'
+# The same record, serialized differently
+RECORD_REORDERED = '<record  xmlns="urn:test"><title type="main" lang="fi">Otsikko</title></record>'
+
+
+class TestMappingCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'mapping.sqlite')
+        self.cache = MappingCache(self.path)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def testUnchangedRecordIsNotMappedAgain(self):
+        mapper = Mock(return_value={'title': {'fi': u'Otsikko'}})
+        eq_(self.cache.get_or_map('oai_ddi25', etree.fromstring(RECORD), mapper), {'title': {'fi': u'Otsikko'}})
+        eq_(self.cache.get_or_map('oai_ddi25', etree.fromstring(RECORD_REORDERED), mapper),
+            {'title': {'fi': u'Otsikko'}})
+        eq_(mapper.call_count, 1)
+
+    def testMappingWithFailedRefDataIsNotCached(self):
+        def mapper(xml):
+            metax_api._ref_data_failed()
+            return {'title': {'fi': u'Otsikko'}}
+
+        mapper = Mock(side_effect=mapper)
+        eq_(self.cache.get_or_map('oai_ddi25', etree.fromstring(RECORD), mapper), {'title': {'fi': u'Otsikko'}})
+        eq_(self.cache.get_or_map('oai_ddi25', etree.fromstring(RECORD), mapper), {'title': {'fi': u'Otsikko'}})
+        eq_(mapper.call_count, 2)
+        eq_(self.cache.size, 0)
+
+    def testChangedRecordOrFormatIsMapped(self):
+        mapper = Mock(return_value={'title': {'fi': u'Otsikko'}})
+        self.cache.get_or_map('oai_ddi25', etree.fromstring(RECORD), mapper)
+        self.cache.get_or_map('oai_ddi25', etree.fromstring(RECORD.replace('Otsikko', 'Toinen')), mapper)
+        self.cache.get_or_map('cmdi0571', etree.fromstring(RECORD), mapper)
+        eq_(mapper.call_count, 3)
+
+    def testCachedDictIsACopy(self):
+        xml = etree.fromstring(RECORD)
+        self.cache.put('oai_ddi25', xml, {'keyword': ['a']})
+        self.cache.get('oai_ddi25', xml)['keyword'].append('b')
+        eq_(self.cache.get('oai_ddi25', xml), {'keyword': ['a']})
+
+    def testOtherMapperVersionIsRemoved(self):
+        xml = etree.fromstring(RECORD)
+        self.cache.put('oai_ddi25', xml, {'title': 'x'})
+        self.cache.close()
+        self.cache = MappingCache(self.path, version='other')
+        eq_(self.cache.get('oai_ddi25', xml), None)
+        eq_(self.cache.size, 0)
+
+    def testExpiredEntryIsMappedAgain(self):
+        self.cache.max_age = 60
+        xml = etree.fromstring(RECORD)
+        with patch('ckanext.etsin.mapping_cache.time.time', return_value=1000.0):
+            self.cache.put('oai_ddi25', xml, {'title': 'x'})
+        with patch('ckanext.etsin.mapping_cache.time.time', return_value=1030.0):
+            eq_(self.cache.get('oai_ddi25', xml), {'title': 'x'})
+        with patch('ckanext.etsin.mapping_cache.time.time', return_value=1061.0):
+            eq_(self.cache.get('oai_ddi25', xml), None)
+
+    def testLeastRecentlyUsedAreEvicted(self):
+        self.cache.max_bytes = 1000
+        self.cache.max_age = 0
+        records = [etree.fromstring(RECORD.replace('Otsikko', str(i))) for i in range(10)]
+        value = {'description': 'x' * 180}
+        for i, xml in enumerate(records[:5]):
+            with patch('ckanext.etsin.mapping_cache.time.time', return_value=float(i)):
+                self.cache.put('oai_ddi25', xml, value)
+        # The first record is used, so the second is the least recently used
+        with patch('ckanext.etsin.mapping_cache.time.time', return_value=10.0):
+            ok_(self.cache.get('oai_ddi25', records[0]))
+        with patch('ckanext.etsin.mapping_cache.time.time', return_value=11.0):
+            self.cache.put('oai_ddi25', records[5], value)
+
+        ok_(self.cache.size <= 1000)
+        eq_(self.cache.get('oai_ddi25', records[1]), None)
+        ok_(self.cache.get('oai_ddi25', records[0]))
+        ok_(self.cache.get('oai_ddi25', records[5]))
+
+    def testDigestIgnoresSerialization(self):
+        eq_(record_digest(etree.fromstring(RECORD)), record_digest(etree.fromstring(RECORD_REORDERED)))
+        eq_(len(get_mapper_version()), 64)
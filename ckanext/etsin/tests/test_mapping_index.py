@@ -0,0 +1,64 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for the binary indexes of the mapping files"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from mock import patch
+from nose.tools import eq_, ok_
+
+from ckanext.etsin import mapping_index
+
+ROWS = 'urn:c,kata-c\nurn:a,kata-a\nurn:b,kata-b1\nurn:b,kata-b2\n\nurn:d\n'
+
+
+class TestMappingIndex(TestCase):
+
+    def setUp(self):
+        mapping_index.reset()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'pid_to_kata_urn.csv')
+        with open(self.path, 'w') as f:
+            f.write(ROWS)
+
+    def tearDown(self):
+        mapping_index.reset()
+        shutil.rmtree(self.directory)
+
+    def testFindsRowsAsTheCsv(self):
+        eq_(mapping_index.find_row(self.path, 'urn:a'), ['urn:a', 'kata-a'])
+        eq_(mapping_index.find_row(self.path, u'urn:c'), ['urn:c', 'kata-c'])
+        # The first of rows with the same key
+        eq_(mapping_index.find_row(self.path, 'urn:b'), ['urn:b', 'kata-b1'])
+        eq_(mapping_index.find_row(self.path, 'urn:d'), ['urn:d'])
+        for key in ('urn:', 'urn:aa', 'urn:e', ''):
+            eq_(mapping_index.find_row(self.path, key), None)
+        ok_(os.path.exists(self.path + mapping_index.INDEX_SUFFIX))
+
+    def testChangedCsvIsCompiledAgain(self):
+        eq_(mapping_index.find_row(self.path, 'urn:e'), None)
+        with open(self.path, 'a') as f:
+            f.write('urn:e,kata-e\n')
+        eq_(mapping_index.find_row(self.path, 'urn:e'), ['urn:e', 'kata-e'])
+        # Another process finds the index up to date
+        mapping_index.reset()
+        with patch('ckanext.etsin.mapping_index.compile_index') as compile_index:
+            eq_(mapping_index.find_row(self.path, 'urn:e'), ['urn:e', 'kata-e'])
+        eq_(compile_index.call_count, 0)
+
+    def testCsvIsSearchedIfIndexCannotBeWritten(self):
+        with patch('ckanext.etsin.mapping_index.compile_index', side_effect=OSError(13, 'Permission denied')):
+            eq_(mapping_index.find_row(self.path, 'urn:b'), ['urn:b', 'kata-b1'])
+            eq_(mapping_index.find_row(self.path, 'urn:e'), None)
+        ok_(not os.path.exists(self.path + mapping_index.INDEX_SUFFIX))
+
+    def testEmptyCsv(self):
+        open(self.path, 'w').close()
+        eq_(mapping_index.find_row(self.path, 'urn:a'), None)
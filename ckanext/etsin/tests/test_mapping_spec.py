@@ -0,0 +1,70 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for mappers/spec.py."""
+import unittest
+from unittest import TestCase
+
+from nose.tools import eq_, ok_
+
+from ckanext.etsin.mappers.spec import Field, OMIT, compile_spec, first_item
+
+
+def _fail(value, env):
+    raise ValueError('bad value')
+
+
+class TestMappingSpec(TestCase):
+
+    def setUp(self):
+        self.spec = compile_spec([
+            Field('title', 'title', transform=lambda v, env: {env['lang']: v}, default={'und': ''}),
+            Field('field', 'categories', select=first_item, lookup={'a': 'A'}, lookup_default='?'),
+            Field('modified', ('updated', 'created'), transform=lambda v, env: env['source_key'] + ':' + v),
+            Field('keyword', 'tags', default=[]),
+            Field('issued', 'released', omit_empty=True),
+            Field('broken', 'title', transform=_fail, default='fallback'),
+            Field('omitted', 'title', transform=lambda v, env: OMIT),
+        ])
+
+    def testApply(self):
+        package_dict = {}
+        errors = self.spec.apply({'title': 'T', 'categories': ['a', 'b'], 'updated': '', 'created': '2017',
+                                  'released': ''}, package_dict, {'lang': 'fi'})
+        eq_(package_dict, {'title': {'fi': 'T'}, 'field': 'A', 'modified': 'created:2017', 'keyword': [],
+                           'broken': 'fallback'})
+        eq_([target for target, e in errors], ['broken'])
+        ok_(isinstance(errors[0][1], ValueError))
+
+    def testKeyErrorsOfTransformsAreErrors(self):
+        spec = compile_spec([Field('title', 'title', transform=lambda v, env: v['missing'], default='fallback')])
+        package_dict = {}
+        errors = spec.apply({'title': {}}, package_dict, {})
+        eq_(package_dict, {'title': 'fallback'})
+        eq_([target for target, e in errors], ['title'])
+        ok_(isinstance(errors[0][1], KeyError))
+
+    def testMissingSourcesUseDefaults(self):
+        package_dict = {}
+        self.spec.apply({'categories': []}, package_dict, {'lang': 'fi'})
+        eq_(package_dict, {'title': {'und': ''}, 'keyword': [], 'broken': 'fallback'})
+
+    def testDefaultsAreNotShared(self):
+        first, second = {}, {}
+        self.spec.apply({}, first, {})
+        self.spec.apply({}, second, {})
+        first['keyword'].append('x')
+        eq_(second['keyword'], [])
+
+    def testTimings(self):
+        timings = {}
+        self.spec.apply({'title': 'T'}, {}, {'lang': 'fi'}, timings)
+        eq_(sorted(timings), ['broken', 'field', 'issued', 'keyword', 'modified', 'omitted', 'title'])
+
+
+if __name__ == '__main__':
+    unittest.main()
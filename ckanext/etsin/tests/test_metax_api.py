@@ -7,6 +7,8 @@
 
 """Basic tests for checking that metax_api.py works"""
 import ckanext.etsin.metax_api as api
+import json
+import requests
 import unittest
 from unittest import TestCase
 
@@ -43,6 +45,71 @@ class TestMetaxAPI(TestCase):
             ok_(mock_delete.called)
             ok_(mock_delete.return_value.raise_for_status.called)
 
+    def testGetRefDataConcurrently(self):
+        ''' Test that get_ref_data_concurrently queries each distinct term once and keeps the order '''
+        queries = [('location', 'label.fi', 'Suomi', 'code'),
+                   ('field_of_science', 'label.fi', 'Kemia', 'code'),
+                   ('location', 'label.fi', 'Suomi', 'code')]
+        with patch('ckanext.etsin.metax_api.get_ref_data') as mock_get_ref_data:
+            mock_get_ref_data.side_effect = lambda topic, field, term, result_field: topic + ':' + term
+            eq_(api.get_ref_data_concurrently(queries), ['location:Suomi', 'field_of_science:Kemia', 'location:Suomi'])
+            eq_(mock_get_ref_data.call_count, 2)
+        eq_(api.get_ref_data_concurrently([]), [])
+
+    def testGetRefDataBatch(self):
+        ''' Test that get_ref_data_batch sends one multi search request and maps the responses back in order '''
+        queries = [('location', 'label.fi', 'Suomi', 'code'),
+                   ('field_of_science', 'label.fi', 'Kemia', 'code'),
+                   ('location', 'label.fi', 'Suomi', 'code')]
+
+        def msearch(url, data=None, **kwargs):
+            lines = data.strip().split('\n')
+            responses = []
+            for line in lines[1::2]:
+                term = json.loads(line)['query']['bool']['must'][0]['match']['label.fi']
+                responses.append({'hits': {'hits': [{'_source': {'code': 'code:' + term}}]}}
+                                 if term == 'Suomi' else {'hits': {'hits': []}})
+            response = Mock()
+            response.text = json.dumps({'responses': responses})
+            return response
+
+        with patch('requests.post') as mock_post:
+            mock_post.side_effect = msearch
+            eq_(api.get_ref_data_batch(queries), ['code:Suomi', None, 'code:Suomi'])
+            eq_(mock_post.call_count, 1)
+            ok_(mock_post.call_args[0][0].endswith('/es/reference_data/_msearch'))
+
+    def testGetRefDataBatchFallback(self):
+        ''' Test that get_ref_data_batch queries terms one by one if multi search fails '''
+        queries = [('location', 'label.fi', 'Suomi', 'code')]
+        with patch('requests.post') as mock_post, patch('ckanext.etsin.metax_api.get_ref_data') as mock_get_ref_data:
+            mock_post.side_effect = requests.exceptions.ConnectionError()
+            mock_get_ref_data.return_value = 'code'
+            eq_(api.get_ref_data_batch(queries), ['code'])
+
+    def testRefDataFailuresAreTracked(self):
+        ''' Test that failed reference data lookups are counted for the thread, also those of the pool threads '''
+        queries = [('location', 'label.fi', 'Suomi', 'code'),
+                   ('field_of_science', 'label.fi', 'Kemia', 'code')]
+        response = Mock(status_code=503, text='{}')
+        with patch('requests.post') as mock_post, patch('requests.get', return_value=response):
+            mock_post.side_effect = requests.exceptions.ConnectionError()
+            with api.track_ref_data_failures() as failures:
+                eq_(api.get_ref_data_batch(queries), [None, None])
+        eq_(failures.count, 2)
+
+        response = Mock(text=json.dumps({'responses': [{'error': 'timeout'}]}))
+        with patch('requests.post', return_value=response):
+            with api.track_ref_data_failures() as failures:
+                eq_(api.get_ref_data_batch(queries[:1]), [None])
+        eq_(failures.count, 1)
+
+        response = Mock(status_code=200, text=json.dumps({'hits': {'hits': []}}))
+        with patch('requests.get', return_value=response):
+            with api.track_ref_data_failures() as failures:
+                eq_(api.get_ref_data(*queries[0]), None)
+        eq_(failures.count, 0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,94 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for metax_api against the local Metax stand-in server"""
+from unittest import TestCase
+
+from mock import patch
+from nose.tools import assert_raises, eq_, ok_
+from requests import HTTPError
+
+import ckanext.etsin.metax_api as api
+from ckanext.etsin.benchmarks.metax_server import Faults, MetaxStore, start_in_thread
+
+
+def _record(preferred_identifier, modified='2018-01-01T00:00:00', data_catalog='urn:nbn:fi:att:data-catalog-test'):
+    return {'data_catalog': data_catalog,
+            'research_dataset': {'preferred_identifier': preferred_identifier, 'modified': modified}}
+
+
+class TestMetaxServer(TestCase):
+
+    def setUp(self):
+        self.server = start_in_thread(MetaxStore(), Faults())
+        self.config = patch('ckanext.etsin.metax_api.config', {'metax.host': self.server.host,
+                                                               'metax.protocol': 'http',
+                                                               'metax.verify_ssl': 'false'})
+        self.config.start()
+        api.reset_settings()
+
+    def tearDown(self):
+        self.config.stop()
+        api.reset_settings()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testCreateReadUpdateDelete(self):
+        cr_id = api.create_catalog_record(_record('urn:1'))
+        eq_(api.get_catalog_record_identifier_using_preferred_identifier('urn:1'), cr_id)
+        ok_(api.check_catalog_record_exists(cr_id))
+
+        api.update_catalog_record(cr_id, _record('urn:1', modified='2018-02-02T00:00:00'))
+        eq_(api.get_catalog_record_research_dataset_modified_using_preferred_identifier('urn:1'),
+            '2018-02-02T00:00:00')
+
+        api.delete_catalog_record(cr_id)
+        ok_(not api.check_catalog_record_exists(cr_id))
+        eq_(api.get_catalog_record_identifier_using_preferred_identifier('urn:1'), None)
+
+    def testDuplicatePreferredIdentifierIsRejected(self):
+        api.create_catalog_record(_record('urn:1'))
+        with assert_raises(HTTPError) as cm:
+            api.create_catalog_record(_record('urn:1'))
+        eq_(cm.exception.response.status_code, 400)
+        # Other data catalogs may have the same preferred identifier
+        api.create_catalog_record(_record('urn:1', data_catalog='urn:nbn:fi:att:data-catalog-other'))
+
+    def testListAndDeleteMany(self):
+        cr_ids = [api.create_catalog_record(_record('urn:{0}'.format(i))) for i in range(5)]
+        records = api.get_catalog_records_for_data_catalog('urn:nbn:fi:att:data-catalog-test', page_size=2)
+        eq_(sorted(records), sorted(cr_ids))
+        eq_(records[cr_ids[0]]['preferred_identifier'], 'urn:0')
+
+        api.delete_catalog_records(cr_ids[:3])
+        eq_(sorted(api.get_catalog_records_for_data_catalog('urn:nbn:fi:att:data-catalog-test')), sorted(cr_ids[3:]))
+
+    def testDeleteManyOneByOneWithoutBulkDelete(self):
+        self.server.bulk_delete = False
+        cr_ids = [api.create_catalog_record(_record('urn:{0}'.format(i))) for i in range(3)]
+        api.delete_catalog_record(cr_ids[0])
+
+        # The bulk delete is refused, so the catalog records are deleted one by one, skipping the deleted one
+        api.delete_catalog_records(cr_ids)
+        eq_(api.get_catalog_records_for_data_catalog('urn:nbn:fi:att:data-catalog-test'), {})
+        requests = self.server.stats.as_dict()['requests']
+        eq_(requests['DELETE datasets 405'], 1)
+        eq_(requests['DELETE datasets 404'], 1)
+        eq_(requests['DELETE datasets 204'], 3)
+
+    def testReferenceData(self):
+        eq_(api.get_ref_data('license', 'uri', 'info:eu-repo/semantics/openAccess', 'id'), 'CC-BY-4.0')
+        eq_(api.get_ref_data_batch([('field_of_science', 'label.fi', 'yhteiskuntatieteet', 'code'),
+                                    ('location', 'label.fi', 'Suomi', 'code'),
+                                    ('license', 'uri', 'unknown', 'id')]),
+            ['ta5', 'http://www.yso.fi/onto/yso/p94426', None])
+
+    def testInjectedErrors(self):
+        self.server.faults.error_rate = 1.0
+        with assert_raises(HTTPError):
+            api.create_catalog_record(_record('urn:1'))
+        eq_(self.server.stats.as_dict()['requests'], {'POST datasets 503': 1})
@@ -0,0 +1,89 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for metrics.py and transport.py."""
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import requests
+from mock import Mock, patch
+from nose.tools import eq_, ok_, assert_raises
+
+from ckanext.etsin import metrics, transport
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.reset()
+
+    def testRender(self):
+        metrics.record_harvest_outcome('fsd', 'create', 'created')
+        metrics.record_harvest_outcome('fsd', 'create', 'created')
+        metrics.observe('etsin_metax_request_seconds', {'verb': 'GET'}, 0.25)
+        lines = metrics.render().splitlines()
+
+        ok_('# TYPE etsin_harvest_records_total counter' in lines)
+        ok_('etsin_harvest_records_total{action="create",outcome="created",source="fsd"} 2' in lines)
+        ok_('# TYPE etsin_metax_request_seconds summary' in lines)
+        ok_('etsin_metax_request_seconds{verb="GET",quantile="0.5"} 0.25' in lines)
+        ok_('etsin_metax_request_seconds_count{verb="GET"} 1' in lines)
+
+    def testLabelValuesAreEscaped(self):
+        metrics.inc('etsin_test_total', {'source': 'a"b\\c'})
+        ok_('etsin_test_total{source="a\\"b\\\\c"} 1' in metrics.render().splitlines())
+
+    def testWriteTextfile(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'etsin.prom')
+            # Files of a process no longer running and of another running process
+            stale_path = metrics.get_process_textfile_path(path, 999999999)
+            other_path = metrics.get_process_textfile_path(path, os.getppid())
+            for other in (stale_path, other_path):
+                with open(other, 'w') as f:
+                    f.write('etsin_test_total 5\n')
+
+            with patch('ckanext.etsin.metrics.config', {'etsin.metrics.textfile_path': path}):
+                metrics.inc('etsin_test_total')
+            process_path = os.path.join(directory, 'etsin.{0}.prom'.format(os.getpid()))
+            with open(process_path) as f:
+                ok_('etsin_test_total{{pid="{0}"}} 1'.format(os.getpid()) in f.read().splitlines())
+            eq_(sorted(os.listdir(directory)), sorted([os.path.basename(process_path), os.path.basename(other_path)]))
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestTransport(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.reset()
+
+    def testSendCountsRequest(self):
+        with patch('requests.put') as mock_put:
+            mock_put.return_value = Mock(status_code=200, content='{"a": 1}')
+            mock_put.return_value.request.body = '{}'
+            eq_(transport.send('put', 'https://metax/rest/datasets/1', json={}), mock_put.return_value)
+        eq_(metrics.get_counter('etsin_metax_requests_total', {'verb': 'PUT', 'status': '200'}), 1)
+        eq_(metrics.get_counter('etsin_metax_request_bytes_total', {'verb': 'PUT'}), 2)
+        eq_(metrics.get_counter('etsin_metax_response_bytes_total', {'verb': 'PUT'}), 8)
+
+    def testSendCountsTimeout(self):
+        with patch('requests.get') as mock_get:
+            mock_get.side_effect = requests.exceptions.ReadTimeout()
+            with assert_raises(requests.exceptions.ReadTimeout):
+                transport.send('get', 'https://metax/rest/datasets')
+        eq_(metrics.get_counter('etsin_metax_timeouts_total', {'verb': 'GET'}), 1)
+        eq_(metrics.get_counter('etsin_metax_requests_total', {'verb': 'GET', 'status': 'timeout'}), 1)
@@ -6,7 +6,55 @@
 # :license: GNU Affero General Public License version 3
 
 """Tests for plugin.py."""
+import unittest
+from unittest import TestCase
+
+from mock import Mock, patch
+from nose.tools import eq_, ok_
+
 import ckanext.etsin.plugin as plugin
+from ckanext.etsin.ddi_index import build_ddi_index
+from ckanext.etsin.mappers import ddi25
+from ckanext.etsin.refine import RECORD_CONTEXT_KEY, refine
+from ckanext.etsin.refiners import fsd
+
+from .helpers import _get_file_as_lxml
+
 
 def test_plugin():
-    pass
\ No newline at end of file
+    pass
+
+
+class TestGetOaipmhPackageDict(TestCase):
+
+    def setUp(self):
+        self.build_ddi_index = Mock(wraps=build_ddi_index)
+        patches = [
+            patch.object(ddi25, 'build_ddi_index', self.build_ddi_index),
+            patch.object(fsd, 'build_ddi_index', self.build_ddi_index),
+            patch.object(ddi25, 'get_ref_data_batch', side_effect=lambda queries: [None] * len(queries)),
+            patch.object(plugin.mapping_cache, 'get_mapping_cache', return_value=None),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _harvest(self, xml):
+        """ Map the record like the OAI-PMH harvester and refine it like the harvest actions """
+        package_dict = plugin.EtsinPlugin().get_oaipmh_package_dict('oai_ddi25', xml)
+        package_dict['preferred_identifier'] = 'urn:nbn:fi:fsd:T-FSD3092'
+        # The harvester builds the context of the actions after mapping
+        return refine({'harvest_source_name': 'fsd', 'source_data': xml}, package_dict)
+
+    def testRecordIsIndexedOnce(self):
+        for i in range(2):
+            self._harvest(_get_file_as_lxml('ddi25/ddi25_1.xml'))
+            eq_(self.build_ddi_index.call_count, i + 1)
+
+    def testRecordContextIsNotSentToMetax(self):
+        package_dict = self._harvest(_get_file_as_lxml('ddi25/ddi25_1.xml'))
+        ok_(RECORD_CONTEXT_KEY not in package_dict)
+
+
+if __name__ == '__main__':
+    unittest.main()
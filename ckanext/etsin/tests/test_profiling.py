@@ -0,0 +1,76 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for profiling.py."""
+import os
+import pstats
+import shutil
+import tempfile
+from unittest import TestCase
+
+from mock import Mock, patch
+from nose.tools import eq_, ok_
+
+from ckanext.etsin import profiling
+
+
+class TestProfiling(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        profiling.reset_settings()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        profiling.reset_settings()
+
+    def _config(self, **settings):
+        values = {'etsin.profile.dir': self.directory}
+        values.update(('etsin.profile.' + key, value) for key, value in settings.items())
+        return patch('ckanext.etsin.profiling.config', values)
+
+    def testSampledRecordIsProfiledPerSourceAndGuid(self):
+        with self._config(sample_rate='1.0'):
+            with profiling.profile('map', 'fsd', lambda: 'oai:fsd.uta.fi:FSD0115'):
+                sorted(range(1000))
+
+        eq_(os.listdir(self.directory), ['fsd'])
+        files = os.listdir(os.path.join(self.directory, 'fsd'))
+        eq_(len(files), 1)
+        ok_(files[0].startswith('map-oai_fsd.uta.fi_FSD0115-') and files[0].endswith('.prof'))
+        ok_(pstats.Stats(os.path.join(self.directory, 'fsd', files[0])).total_calls > 0)
+
+    def testProfilingIsOffByDefault(self):
+        guid = []
+        with self._config():
+            with profiling.profile('map', 'fsd', lambda: guid.append(1)):
+                pass
+        eq_(os.listdir(self.directory), [])
+        eq_(guid, [])
+
+    def testMemoryModeNeedsTracemalloc(self):
+        with self._config(sample_rate='1', mode='both'), \
+                patch('ckanext.etsin.profiling._get_tracemalloc', return_value=None):
+            settings = profiling.get_settings()
+        ok_(settings.cpu)
+        ok_(not settings.memory)
+
+    def testMemoryProfile(self):
+        tracemalloc = Mock()
+        tracemalloc.is_tracing.return_value = False
+        tracemalloc.take_snapshot.return_value.compare_to.return_value = ['a.py:1: size=1 KiB (+1 KiB)']
+        with self._config(sample_rate='1', mode='memory'), \
+                patch('ckanext.etsin.profiling._get_tracemalloc', return_value=tracemalloc):
+            with profiling.profile('action.package_create', None, 'urn:nbn:fi:1'):
+                pass
+
+        ok_(tracemalloc.start.called and tracemalloc.stop.called)
+        files = os.listdir(os.path.join(self.directory, 'unknown'))
+        eq_(len(files), 1)
+        ok_(files[0].endswith('.txt'))
+        with open(os.path.join(self.directory, 'unknown', files[0])) as f:
+            eq_(f.read(), 'a.py:1: size=1 KiB (+1 KiB)\n')
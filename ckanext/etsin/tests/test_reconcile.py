@@ -0,0 +1,137 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for reconcile.py."""
+import datetime
+import unittest
+from unittest import TestCase
+
+from mock import Mock, call, patch
+from nose.tools import eq_, ok_
+
+from ckanext.etsin import reconcile
+from ckanext.etsin.journal import ACTION_CREATE, ACTION_UPDATE, JournalEntry, STEP_BEGIN, STEP_METAX_DONE
+from ckanext.etsin.reconcile import CkanPackage, diff_catalog_records
+
+
+class TestDiffCatalogRecords(TestCase):
+
+    def setUp(self):
+        self.metax_records = {
+            'cr1': {'preferred_identifier': 'urn:1', 'modified': '2018-01-01T00:00:00-00:00'},
+            'cr2': {'preferred_identifier': 'urn:2', 'modified': '2018-01-01T12:00:00+02:00'},
+            'cr3': {'preferred_identifier': 'urn:3', 'modified': None},
+            'cr4': {'preferred_identifier': 'urn:4', 'modified': None},
+        }
+        self.ckan_packages = [
+            CkanPackage('pkg1', 'cr1', datetime.datetime(2018, 2, 1)),
+            CkanPackage('pkg2', 'cr2', datetime.datetime(2018, 1, 1, 10, 0, 0)),
+            CkanPackage('pkg5', 'cr5', None),
+        ]
+
+    def testOrphans(self):
+        result = diff_catalog_records(self.metax_records, self.ckan_packages)
+        eq_(result.metax_orphans, ['cr3', 'cr4'])
+        eq_([pkg.id for pkg in result.ckan_orphans], ['pkg5'])
+
+    def testInProgressRecordsAreNotOrphans(self):
+        result = diff_catalog_records(self.metax_records, self.ckan_packages, in_progress_cr_ids=['cr4'])
+        eq_(result.metax_orphans, ['cr3'])
+
+    def testInProgressPreferredIdentifiersAreNotOrphans(self):
+        result = diff_catalog_records(self.metax_records, self.ckan_packages,
+                                      in_progress_preferred_identifiers=['urn:3'])
+        eq_(result.metax_orphans, ['cr4'])
+
+    def testStale(self):
+        result = diff_catalog_records(self.metax_records, self.ckan_packages)
+        # cr2 was modified at 10:00 UTC, same as its source
+        eq_([pkg.id for pkg in result.stale], ['pkg1'])
+
+
+class TestReconcileHarvestSource(TestCase):
+
+    def setUp(self):
+        metax_records = {
+            'cr1': {'preferred_identifier': 'urn:1', 'modified': None},
+            'cr2': {'preferred_identifier': 'urn:2', 'modified': None},
+            'cr3': {'preferred_identifier': 'urn:3', 'modified': None},
+        }
+        # A create that has created its catalog record but not yet recorded its identifier, and an update
+        pending = [
+            JournalEntry(1, None, ACTION_CREATE, STEP_BEGIN, 'src', 'urn:2', None, 0.0, 'oai:2'),
+            JournalEntry(2, 'pkg4', ACTION_UPDATE, STEP_METAX_DONE, 'src', 'urn:4', 'cr4', 0.0, 'oai:4'),
+        ]
+        self.journal = Mock()
+        self.journal.pending.return_value = pending
+        self.ckan_packages = [CkanPackage('pkg1', 'cr1', None), CkanPackage('pkg5', 'cr5', None)]
+
+        patches = [
+            patch.object(reconcile.DataCatalogMetaxAPIService, 'get_data_catalog_id_from_file',
+                         return_value='urn:catalog'),
+            patch.object(reconcile.metax_api, 'get_catalog_records_for_data_catalog', return_value=metax_records),
+            patch.object(reconcile, 'get_ckan_packages_for_harvest_source', return_value=self.ckan_packages),
+            patch.object(reconcile, 'get_journal', return_value=self.journal),
+        ]
+        self.get_active_package_names = patch.object(reconcile, 'get_active_package_names', return_value=set())
+        patches.append(self.get_active_package_names)
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.get_active_package_names = reconcile.get_active_package_names
+
+    def testPendingCreateIsNotOrphan(self):
+        result = reconcile.reconcile_harvest_source('src')
+        eq_(result.metax_orphans, ['cr3'])
+        eq_(result.ckan_orphans, [self.ckan_packages[1]])
+
+    def testRepair(self):
+        context = {'user': 'harvest'}
+        with patch.object(reconcile.metax_api, 'delete_catalog_records') as delete_catalog_records, \
+                patch.object(reconcile, '_delete_ckan_orphans') as delete_ckan_orphans:
+            reconcile.reconcile_harvest_source('src', context, repair=True)
+        # The catalog record of the pending create is not deleted
+        eq_(delete_catalog_records.call_args_list, [call(['cr3'])])
+        delete_ckan_orphans.assert_called_once_with(context, [self.ckan_packages[1]])
+
+    def testPackageWithoutCurrentHarvestObjectIsNotOrphan(self):
+        # An active package named after the catalog record, eg. one whose harvest objects are no longer current
+        self.get_active_package_names.return_value = {'cr3'}
+        with patch.object(reconcile.metax_api, 'delete_catalog_records') as delete_catalog_records, \
+                patch.object(reconcile, '_delete_ckan_orphans'):
+            result = reconcile.reconcile_harvest_source('src', {'user': 'harvest'}, repair=True)
+        eq_(result.metax_orphans, [])
+        ok_(not delete_catalog_records.called)
+
+    def testOrphanIsCheckedAgainBeforeDeleting(self):
+        # The package of the catalog record is created between the comparison and the deletion
+        self.get_active_package_names.side_effect = [set(), {'cr3'}]
+        with patch.object(reconcile.metax_api, 'delete_catalog_records') as delete_catalog_records, \
+                patch.object(reconcile, '_delete_ckan_orphans'):
+            result = reconcile.reconcile_harvest_source('src', {'user': 'harvest'}, repair=True)
+        eq_(result.metax_orphans, ['cr3'])
+        ok_(not delete_catalog_records.called)
+
+    def testOrphanStartedByHarvestBeforeDeletingIsNotDeleted(self):
+        pending = self.journal.pending.return_value
+        self.journal.pending.side_effect = [
+            pending, pending + [JournalEntry(3, None, ACTION_CREATE, STEP_BEGIN, 'src', 'urn:3', None, 0.0, 'oai:3')]]
+        with patch.object(reconcile.metax_api, 'delete_catalog_records') as delete_catalog_records, \
+                patch.object(reconcile, '_delete_ckan_orphans'):
+            reconcile.reconcile_harvest_source('src', {'user': 'harvest'}, repair=True)
+        ok_(not delete_catalog_records.called)
+
+    def testNoRepair(self):
+        with patch.object(reconcile.metax_api, 'delete_catalog_records') as delete_catalog_records, \
+                patch.object(reconcile, '_delete_ckan_orphans') as delete_ckan_orphans:
+            reconcile.reconcile_harvest_source('src')
+        ok_(not delete_catalog_records.called)
+        ok_(not delete_ckan_orphans.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for refiner_registry.py."""
+import unittest
+from unittest import TestCase
+
+from mock import Mock, patch
+from nose.tools import eq_, ok_
+
+from ckanext.etsin import refiner_registry
+from ckanext.etsin.data_catalog_service import get_data_catalog_filename_for_harvest_source
+
+
+class TestRefinerRegistry(TestCase):
+
+    def tearDown(self):
+        refiner_registry._registry = None
+
+    def testBuiltinRefiners(self):
+        from ckanext.etsin.refiners.fsd import fsd_refiner
+        eq_(refiner_registry.get_refiner('fsd'), fsd_refiner)
+        eq_(refiner_registry.get_refiner('unknown'), None)
+
+    def testRefinerIsLookedUpOnEachCall(self):
+        with patch('ckanext.etsin.refiners.syke.syke_refiner') as mock_refiner:
+            ok_(refiner_registry.get_refiner('syke') is mock_refiner)
+
+    def testEntryPointsReplaceBuiltinRefiners(self):
+        entry_point = Mock(module_name='ckanext.etsin.refiners.fsd', attrs=('fsd_refiner',))
+        entry_point.name = 'other'
+        with patch.object(refiner_registry, '_iter_entry_points', return_value=[entry_point]):
+            from ckanext.etsin.refiners.fsd import fsd_refiner
+            eq_(refiner_registry.get_refiner('other'), fsd_refiner)
+            # The built-in table is only a fallback when no entry points are installed
+            eq_(refiner_registry.get_refiner('fsd'), None)
+
+    def testBuiltinRefinersWithoutEntryPoints(self):
+        with patch.object(refiner_registry, '_iter_entry_points', return_value=[]):
+            eq_(sorted(refiner_registry._get_registry()), sorted(refiner_registry.BUILTIN_REFINERS))
+
+    def testRegisterRefiner(self):
+        refiner_registry.register_refiner('other', 'ckanext.etsin.utils', 'str_to_bool')
+        eq_(refiner_registry.get_refiner('other')('true'), True)
+        eq_(refiner_registry.get_data_catalog_filename('other'), 'other_data_catalog.json')
+
+        refiner_registry.register_refiner('other', 'ckanext.etsin.utils', 'str_to_bool',
+                                          data_catalog_filename='kielipankki_data_catalog.json')
+        eq_(refiner_registry.get_data_catalog_filename('other'), 'kielipankki_data_catalog.json')
+
+    def testDataCatalogFilenameOfRefinerFunction(self):
+        with patch('ckanext.etsin.refiners.syke.syke_refiner') as mock_refiner:
+            mock_refiner.data_catalog_filename = 'syke_2_data_catalog.json'
+            eq_(refiner_registry.get_data_catalog_filename('syke'), 'syke_2_data_catalog.json')
+
+    def testDataCatalogFilename(self):
+        eq_(get_data_catalog_filename_for_harvest_source('kielipankki'), 'kielipankki_data_catalog.json')
+        eq_(get_data_catalog_filename_for_harvest_source('unknown'), False)
+
+
+if __name__ == '__main__':
+    unittest.main()
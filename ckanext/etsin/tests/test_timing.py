@@ -0,0 +1,96 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for timing.py."""
+import random
+from unittest import TestCase
+
+from mock import patch
+from nose.tools import eq_, ok_, assert_raises
+
+from ckanext.etsin import timing
+
+
+class TestHistogram(TestCase):
+
+    def testPercentiles(self):
+        rnd = random.Random(1)
+        values = sorted(rnd.uniform(0.001, 2.0) for _ in range(10000))
+        histogram = timing.Histogram()
+        for value in values:
+            histogram.add(value)
+
+        eq_(histogram.count, 10000)
+        for percent in timing.PERCENTILES:
+            exact = values[int(percent / 100.0 * len(values)) - 1]
+            ok_(abs(histogram.percentile(percent) - exact) / exact < 0.06,
+                'p{0}: {1} vs {2}'.format(percent, histogram.percentile(percent), exact))
+        eq_(histogram.percentile(100), values[-1])
+        eq_(timing.Histogram().percentile(50), None)
+
+    def testMerge(self):
+        first, second = timing.Histogram(), timing.Histogram()
+        first.add(0.1)
+        second.add(0.2)
+        second.add(0.3)
+        first.merge(second)
+        eq_(first.count, 3)
+        eq_((first.min, first.max), (0.1, 0.3))
+        ok_(abs(first.total - 0.6) < 1e-9)
+
+
+class TestTiming(TestCase):
+
+    def setUp(self):
+        timing.reset()
+
+    def tearDown(self):
+        timing.reset()
+
+    def testTimerPerSource(self):
+        with timing.timer('map', source='oai_ddi25'):
+            pass
+        with timing.source('fsd'):
+            with timing.timer('refine'):
+                pass
+            with assert_raises(ValueError):
+                with timing.timer('refine'):
+                    raise ValueError()
+        eq_(timing.current_source(), None)
+        with timing.timer('refine'):
+            pass
+
+        histograms = timing.get_histograms()
+        eq_(sorted(histograms), [('fsd', 'refine'), ('oai_ddi25', 'map'), (timing.UNKNOWN_SOURCE, 'refine')])
+        eq_(histograms[('fsd', 'refine')].count, 2)
+
+    def testTimed(self):
+        @timing.timed('double')
+        def double(value):
+            return value * 2
+
+        with timing.source('syke'):
+            eq_(double(2), 4)
+        eq_(timing.get_histograms()[('syke', 'double')].count, 1)
+
+    def testSummary(self):
+        timing.record('map', 0.5, source='fsd')
+        timing.record('map', 1.5, source='fsd')
+        rows = timing.summary()
+        eq_(len(rows), 1)
+        eq_(rows[0][:3], ('fsd', 'map', 2))
+        eq_(rows[0][-1], 1.5)
+        ok_('fsd' in timing.format_summary(rows).splitlines()[1])
+
+    def testSummaryLoggedEveryInterval(self):
+        timing.record('map', 0.5, source='fsd')
+        with patch('ckanext.etsin.timing.config', {'etsin.timing.summary_interval': '2'}), \
+                patch('ckanext.etsin.timing.log_summary') as mock_log_summary:
+            timing.record_finished()
+            eq_(mock_log_summary.call_count, 0)
+            timing.record_finished()
+            eq_(mock_log_summary.call_count, 1)
@@ -0,0 +1,117 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for utils.py."""
+import random
+import unittest
+from unittest import TestCase
+
+from iso639 import languages
+from nose.tools import eq_
+
+from ckanext.etsin import utils
+
+
+class TestLanguageConversions(TestCase):
+    """ The conversion tables must give the same answers as iso639 for every code it knows """
+
+    MISSES = ['', 'x', 'xx', 'XX', 'zzz', 'FIN', 'fi-FI', None, 1]
+
+    def testConvertLanguage(self):
+        eq_(utils.convert_language('fi'), 'fin')
+        eq_(utils.convert_language(''), 'und')
+        eq_(utils.convert_language('xx'), '')
+        for code, lang in languages.part1.items():
+            eq_(utils.convert_language(code), lang.part2t)
+
+    def testConvertLanguageTo6391(self):
+        for code, lang in languages.part3.items():
+            eq_(utils.convert_language_to_6391(code), lang.part1)
+        for code in self.MISSES + [['fin']]:
+            eq_(utils.convert_language_to_6391(code), False)
+
+    def testValidate6391(self):
+        for code in languages.part1:
+            eq_(utils.validate_6391(code), True)
+        for code in self.MISSES + ['fin']:
+            eq_(utils.validate_6391(code), False)
+
+    def testGetLanguageIdentifier(self):
+        eq_(utils.get_language_identifier('fin'), 'http://lexvo.org/id/iso639-3/fin')
+        eq_(utils.get_language_identifier('smi'), 'http://lexvo.org/id/iso639-5/smi')
+        eq_(utils.get_language_identifier(None), 'http://lexvo.org/id/iso639-3/und')
+        for code in languages.part5:
+            eq_(utils.get_language_identifier(code), 'http://lexvo.org/id/iso639-5/' + code)
+
+
+class TestDateConversions(TestCase):
+    """ The regular expression fast paths must give the same answers as the dateutil implementations """
+
+    FIXED = ['2010', '2010-01-01', '2010-1-1', '2010-01-1', '2010-1', '20100101', '2010-02-30', '2012-02-29',
+             '0999-12-31', '0000-01-01', '2010-01-01T10:20:30', '2010-01-01T10:20:30Z', '2010-01-01T10:20:30+00:00',
+             '2010-01-01T10:20:30-00:00', '2010-01-01T10:20:30+03:00', '2010-01-01T10:20:30-0300',
+             '2010-01-01T10:20:30.5', '2010-01-01T10:20:30.000000', '2010-01-01T10:20:30.1234567',
+             '2010-01-01T24:00:00', '2010-01-01T23:59:60', '2010-01-01T10:20:30+24:00', '2010-01-01 10:20:30',
+             '2010-13-01', 'abcd', '201', 'not a date', u'2010-01-01', '2010\n', '2010-01-01\n',
+             '2010-01-01T10:20:30Z\n', '2010-01-01T10:20:30\n', '2010 ', '2010-01-01 ', ' 2010-01-01',
+             '2010-01-01T10:20:30Z ', '2010-01-01\n\n']
+    MONTH_DAYS = [None, '01-01', '12-31', '02-30', '1-011', '13-01']
+    TIMES = [None, '00:00:00', '23:59:59']
+
+    def _random_values(self):
+        rnd = random.Random(20181019)
+        for _ in range(2000):
+            year = '{0:04d}'.format(rnd.choice([rnd.randint(0, 2100), 2000, 2016]))
+            month = str(rnd.randint(0, 13)).zfill(rnd.choice([1, 2]))
+            day = str(rnd.randint(0, 32)).zfill(rnd.choice([1, 2]))
+            value = rnd.choice([year, year + '-' + month, year + '-' + month + '-' + day])
+            if rnd.random() < 0.5:
+                value += 'T{0:02d}:{1:02d}:{2:02d}'.format(rnd.randint(0, 24), rnd.randint(0, 60), rnd.randint(0, 60))
+                value += rnd.choice(['', '.' + str(rnd.randint(0, 999999)).zfill(rnd.randint(1, 7))])
+                value += rnd.choice(['', 'Z', '+00:00', '-00:00', '+02:00', '-11:30', '+25:00', '+0200'])
+            yield value
+
+    def _assert_same(self, fast, reference, *args):
+        try:
+            expected = reference(*args)
+        except (Exception, SystemExit) as e:
+            with self.assertRaises(type(e)):
+                fast(*args)
+        else:
+            eq_(fast(*args), expected, args)
+
+    def testDatetimeFastPathMatchesDateutil(self):
+        for value in self.FIXED + list(self._random_values()):
+            for month_day in self.MONTH_DAYS:
+                for time in self.TIMES:
+                    self._assert_same(utils.get_string_as_valid_datetime_string,
+                                      utils._get_string_as_valid_datetime_string_with_dateutil,
+                                      value, month_day, time)
+
+    def testDateFastPathMatchesDateutil(self):
+        for value in self.FIXED + list(self._random_values()):
+            self._assert_same(utils.get_string_as_valid_date_string,
+                              utils._get_string_as_valid_date_string_with_dateutil, value)
+
+    def testDatetimeExamples(self):
+        eq_(utils.get_string_as_valid_datetime_string('2010', '01-01', '12:00:00'), '2010-01-01T12:00:00-00:00')
+        eq_(utils.get_string_as_valid_datetime_string('2010-1-1'), '2010-01-01T00:00:00-00:00')
+        eq_(utils.get_string_as_valid_datetime_string('2010-01-01T10:20:30Z'), '2010-01-01T10:20:30+00:00')
+        eq_(utils.get_string_as_valid_datetime_string('2010-01-01T10:20:30+03:00'), '2010-01-01T10:20:30+03:00')
+        eq_(utils.get_string_as_valid_datetime_string('2010'), None)
+
+    def testNormalizeDates(self):
+        values = ['2010', '', None, '2010-01-01T10:20:30Z', 'abc', '2010']
+        eq_(utils.normalize_dates(values, '12-31', '23:59:59'),
+            [utils.get_string_as_valid_datetime_string(v, '12-31', '23:59:59') for v in values])
+
+        with self.assertRaises(Exception):
+            utils.normalize_dates(values, '01-01', '00:00:00Z')
+
+
+if __name__ == '__main__':
+    unittest.main()
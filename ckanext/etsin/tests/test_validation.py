@@ -0,0 +1,50 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for validation.py."""
+import unittest
+from unittest import TestCase
+
+from nose.tools import eq_, ok_
+
+from ckanext.etsin.exceptions import ResearchDatasetInvalidError
+from ckanext.etsin.mappers.cmdi import cmdi_mapper
+from ckanext.etsin.refiners.kielipankki import kielipankki_refiner
+from ckanext.etsin.validation import get_research_dataset_errors, validate_research_dataset
+
+from .helpers import _get_file_as_lxml
+
+
+class TestValidation(TestCase):
+
+    def setUp(self):
+        xml = _get_file_as_lxml('kielipankki_cmdi/cmdi_record_example.xml')
+        self.research_dataset = kielipankki_refiner({'source_data': xml}, cmdi_mapper(xml))
+
+    def testRefinedDatasetIsValid(self):
+        eq_(get_research_dataset_errors(self.research_dataset), [])
+        validate_research_dataset(self.research_dataset)
+
+    def testMissingPreferredIdentifier(self):
+        del self.research_dataset['preferred_identifier']
+        with self.assertRaises(ResearchDatasetInvalidError) as cm:
+            validate_research_dataset(self.research_dataset)
+        eq_(cm.exception.errors[0]['path'], '')
+        ok_('preferred_identifier' in cm.exception.errors[0]['message'])
+
+    def testBadModifiedFormat(self):
+        self.research_dataset['modified'] = '2017-01-01'
+        eq_([e['path'] for e in get_research_dataset_errors(self.research_dataset)], ['modified'])
+
+    def testBadAgentShapeIsReportedInsideMatchingType(self):
+        self.research_dataset['creator'][0]['name'] = {'fi': 'Teija'}
+        self.research_dataset['creator'][0]['@type'] = 'Person'
+        eq_([e['path'] for e in get_research_dataset_errors(self.research_dataset)], ['creator/0/name'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Per stage timing of the harvest pipeline.
+
+Stages are timed with the timer context manager or the timed decorator, eg.
+
+    with timing.timer('map', source='oai_ddi25'):
+        ...
+
+The time of each stage is added to a histogram per (harvest source, stage). The source is given explicitly or
+taken from the source set for the current thread with the source context manager; the actions set it for the
+record they handle. A summary with percentiles of every stage is logged every etsin.timing.summary_interval
+records (default 1000) and when the process exits. Timing is disabled with etsin.timing.enabled = false.
+"""
+
+import atexit
+import functools
+import math
+import threading
+import timeit
+from contextlib import contextmanager
+
+from pylons import config
+
+import logging
+log = logging.getLogger(__name__)
+
+UNKNOWN_SOURCE = 'unknown'
+DEFAULT_SUMMARY_INTERVAL = 1000
+PERCENTILES = (50, 95, 99)
+
+
+class Histogram(object):
+    """
+    Histogram of durations in logarithmic buckets, each GROWTH times as wide as the previous one. Percentiles are
+    accurate to about 5 % over any range of durations and memory does not grow with the number of values.
+    """
+
+    MIN_VALUE = 1e-6
+    GROWTH = 1.1
+    _LOG_GROWTH = math.log(GROWTH)
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """
+        :param value: duration in seconds
+        """
+        index = int(math.log(max(value, self.MIN_VALUE) / self.MIN_VALUE) / self._LOG_GROWTH)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+        Add the values of another histogram to this one.
+        """
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent):
+        """
+        :param percent: 0-100
+        :return: duration in seconds below which percent of the values are, or None if there are no values
+        """
+        if not self.count:
+            return None
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # Middle of the bucket, within the range of the values seen
+                value = self.MIN_VALUE * self.GROWTH ** (index + 0.5)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+_histograms = {}
+_lock = threading.Lock()
+_local = threading.local()
+_records_since_summary = 0
+_enabled = None
+
+
+def is_enabled():
+    global _enabled
+    if _enabled is None:
+        from ckanext.etsin.utils import str_to_bool
+        _enabled = str_to_bool(config.get('etsin.timing.enabled', 'true'))
+    return _enabled
+
+
+def current_source():
+    """
+    :return: harvest source set for the current thread or None
+    """
+    return getattr(_local, 'source', None)
+
+
+@contextmanager
+def source(harvest_source_name):
+    """
+    Attribute the stages timed inside the block, in this thread, to a harvest source.
+    """
+    previous = current_source()
+    _local.source = harvest_source_name
+    try:
+        yield
+    finally:
+        _local.source = previous
+
+
+def record(stage, seconds, source=None):
+    """
+    Add a duration to the histogram of a stage.
+
+    :param stage: name of the stage, eg. 'refine'
+    :param seconds: duration
+    :param source: harvest source, by default the source of the current thread
+    """
+    key = (source or current_source() or UNKNOWN_SOURCE, stage)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.add(seconds)
+
+
+@contextmanager
+def timer(stage, source=None):
+    """
+    Time the block as a stage. The time is recorded also if the block raises.
+    """
+    if not is_enabled():
+        yield
+        return
+    start = timeit.default_timer()
+    try:
+        yield
+    finally:
+        record(stage, timeit.default_timer() - start, source)
+
+
+def timed(stage):
+    """
+    Decorator timing every call of the function as a stage.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def get_histograms():
+    """
+    :return: dict of (source, stage) -> copy of the Histogram
+    """
+    with _lock:
+        copies = {}
+        for key, histogram in _histograms.items():
+            copies[key] = Histogram()
+            copies[key].merge(histogram)
+        return copies
+
+
+def reset():
+    global _records_since_summary
+    with _lock:
+        _histograms.clear()
+        _records_since_summary = 0
+
+
+def summary():
+    """
+    :return: list of (source, stage, count, total seconds, p50, p95, p99, max) sorted by source and stage
+    """
+    rows = []
+    for (source_name, stage), histogram in sorted(get_histograms().items()):
+        rows.append((source_name, stage, histogram.count, histogram.total) +
+                    tuple(histogram.percentile(p) for p in PERCENTILES) + (histogram.max,))
+    return rows
+
+
+def format_summary(rows):
+    """
+    :param rows: rows of summary()
+    :return: the rows as a text table, durations in milliseconds
+    """
+    stage_width = max([len('stage')] + [len(row[1]) for row in rows])
+    header = '{0:<20} {1:<{width}} {2:>8} {3:>10} {4:>10} {5:>10} {6:>10} {7:>10}'
+    line = '{0:<20} {1:<{width}} {2:>8} {3:>10.2f} {4:>10.2f} {5:>10.2f} {6:>10.2f} {7:>10.2f}'
+    lines = [header.format('source', 'stage', 'count', 'total s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms',
+                           width=stage_width)]
+    for source_name, stage, count, total, p50, p95, p99, max_value in rows:
+        lines.append(line.format(source_name, stage, count, total, p50 * 1e3, p95 * 1e3, p99 * 1e3,
+                                 max_value * 1e3, width=stage_width))
+    return '\n'.join(lines)
+
+
+def log_summary():
+    """
+    Log the timing summary of every stage, if anything has been timed.
+    """
+    rows = summary()
+    if rows:
+        log.info("Harvest stage timings:\n{0}".format(format_summary(rows)))
+
+
+def record_finished():
+    """
+    Count a handled record, logging the summary every etsin.timing.summary_interval records.
+    """
+    global _records_since_summary
+    if not is_enabled():
+        return
+    interval = int(config.get('etsin.timing.summary_interval', DEFAULT_SUMMARY_INTERVAL))
+    with _lock:
+        _records_since_summary += 1
+        due = interval > 0 and _records_since_summary >= interval
+        if due:
+            _records_since_summary = 0
+    if due:
+        log_summary()
+
+
+atexit.register(log_summary)
@@ -0,0 +1,70 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+HTTP requests to Metax. Every request goes through send, which counts it in metrics and records or replays it
+if a cassette is set up (see cassette).
+"""
+
+import functools
+import timeit
+
+import requests
+
+from ckanext.etsin import cassette as cassettes
+from ckanext.etsin import metrics
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def send(verb, url, **kwargs):
+    """
+    Send a request with requests and count it by verb and status, with its latency and size.
+
+    :param verb: 'get', 'post', 'put', 'delete' or 'head'
+    :param url: request url
+    :param kwargs: keyword arguments of the requests function
+    :return: requests Response
+    """
+    labels = {'verb': verb.upper()}
+    cassette = cassettes.get_cassette()
+    if cassette is not None and cassette.replaying:
+        request = functools.partial(cassette.play, verb)
+    else:
+        # Looked up on every call, so that patching requests.<verb> (eg. in tests) takes effect
+        request = getattr(requests, verb)
+    recording = cassette is not None and cassette.recording
+    start = timeit.default_timer()
+    try:
+        response = request(url, **kwargs)
+    except requests.exceptions.Timeout:
+        metrics.inc('etsin_metax_timeouts_total', labels)
+        metrics.inc('etsin_metax_requests_total', dict(labels, status='timeout'))
+        if recording:
+            cassette.record(verb, url, kwargs, seconds=timeit.default_timer() - start, error='timeout')
+        raise
+    except requests.exceptions.RequestException:
+        metrics.inc('etsin_metax_requests_total', dict(labels, status='error'))
+        if recording:
+            cassette.record(verb, url, kwargs, seconds=timeit.default_timer() - start, error='error')
+        raise
+    finally:
+        seconds = timeit.default_timer() - start
+        metrics.observe('etsin_metax_request_seconds', labels, seconds)
+
+    if recording:
+        cassette.record(verb, url, kwargs, response, seconds)
+
+    metrics.inc('etsin_metax_requests_total', dict(labels, status=str(response.status_code)))
+    metrics.inc('etsin_metax_request_bytes_total', labels, _length(getattr(response.request, 'body', None)))
+    metrics.inc('etsin_metax_response_bytes_total', labels, _length(getattr(response, 'content', None)))
+    return response
+
+
+def _length(body):
+    return len(body) if isinstance(body, basestring) else 0
@@ -6,17 +6,40 @@
 # :license: GNU Affero General Public License version 3
 
 import logging
-import csv
-from iso639 import languages
-from dateutil import parser
+import re
+from collections import namedtuple
+from datetime import date, datetime
 from json import dumps, loads
 from urlparse import urlparse
 
 log = logging.getLogger(__name__)
 
+from . import mapping_index
 from .data_catalog_service import DataCatalogMetaxAPIService, get_data_catalog_filename_for_harvest_source
 
 
+LanguageTables = namedtuple('LanguageTables', ['part1_to_terminology', 'part2b_to_terminology', 'part3_to_part1',
+                                               'part5'])
+
+_language_tables = None
+
+
+def _get_language_tables():
+    """
+    Build the ISO 639 code conversion tables on first use. Every language code conversion is then
+    a single dictionary or set lookup. iso639 loads its full tables when imported, so it is imported only here.
+    """
+    global _language_tables
+    if _language_tables is None:
+        from iso639 import languages
+        _language_tables = LanguageTables(
+            part1_to_terminology=dict((code, lang.part2t) for code, lang in languages.part1.items()),
+            part2b_to_terminology=dict((code, lang.part2t) for code, lang in languages.part2b.items()),
+            part3_to_part1=dict((code, lang.part1) for code, lang in languages.part3.items()),
+            part5=frozenset(languages.part5))
+    return _language_tables
+
+
 def convert_language(language):
     """
     Convert alpha2 language (eg. 'en') to terminology language (eg. 'eng')
@@ -29,16 +52,14 @@ def convert_language(language):
     if len(language) == 3 and language[0].islower():
         return language
 
-    try:
-        lang_object = languages.get(part1=language)
-        return lang_object.terminology
-    except KeyError as ke:
-        try:
-            lang_object = languages.get(part2b=language)
-            return lang_object.terminology
-        except KeyError as ke:
-            log.error('KeyError: key not found: {0}'.format(ke.args))
-            return ''
+    tables = _get_language_tables()
+    terminology = tables.part1_to_terminology.get(language)
+    if terminology is None:
+        terminology = tables.part2b_to_terminology.get(language)
+    if terminology is None:
+        log.error('Language code not found: {0}'.format(language))
+        return ''
+    return terminology
 
 
 def convert_language_to_6391(language):
@@ -46,12 +67,10 @@ def convert_language_to_6391(language):
     Convert ISO 639-2 and 639-3 language code ('fin') to ISO 639-1 ('fi'), if possible.
     Note that not all languages are included in ISO 639-1.
     """
-    try:
-        part1 = languages.get(part3=language).part1
-    except:
+    if not isinstance(language, basestring):
         return False
 
-    return part1
+    return _get_language_tables().part3_to_part1.get(language, False)
 
 
 def validate_6391(language):
@@ -61,12 +80,7 @@ def validate_6391(language):
     if not isinstance(language, basestring):
         return False
 
-    try:
-        part1 = languages.get(part1=language).part1
-    except:
-        return False
-
-    return language == part1
+    return language in _get_language_tables().part1_to_terminology
 
 
 def get_language_identifier(language):
@@ -77,13 +91,11 @@ def get_language_identifier(language):
     if not isinstance(language, basestring):
         language = 'und'
 
-    try:
-        languages.get(part5=language)
+    if language in _get_language_tables().part5:
         # TODO: In metax language reference data iso639-5 URIs do not get validated,
         # TODO: so if the below is returned, it won't get stored to metax
         return 'http://lexvo.org/id/iso639-5/' + language
-    except KeyError:
-        return 'http://lexvo.org/id/iso639-3/' + language
+    return 'http://lexvo.org/id/iso639-3/' + language
 
 
 def get_tag_lang(tag):
@@ -205,12 +217,8 @@ def search_pid_exists_in_mapping_file(file_path, search_pid):
 
 
 def _find_row_from_mapping_file(file_path, search_pid):
-    with open(file_path, 'rb') as f:
-        reader = csv.reader(f, delimiter=',')
-        for row in reader:
-            if row[0] == search_pid:
-                return row
-    return None
+    # Binary search in the memory-mapped index of the file, see mapping_index
+    return mapping_index.find_row(file_path, search_pid)
 
 
 def str_to_bool(s):
@@ -223,6 +231,30 @@ def str_to_bool(s):
         return False
 
 
+OAI_IDENTIFIER_TAG = '{http://www.openarchives.org/OAI/2.0/}identifier'
+
+
+def get_oaipmh_identifier(xml):
+    """
+    :param xml: lxml element of an OAI-PMH record, or of any part of its document
+    :return: OAI-PMH identifier of the record, from its header, or None
+    """
+    for identifier in xml.getroottree().iter(OAI_IDENTIFIER_TAG):
+        return identifier.text
+    return None
+
+
+# Shapes of date strings that are handled without dateutil
+_YEAR_RE = re.compile(r'^[0-9]{4}\Z')
+_DATE_RE = re.compile(r'^([0-9]{4})-([0-9]{1,2})-([0-9]{1,2})\Z')
+_DATETIME_RE = re.compile(r'^([0-9]{4})-([0-9]{2})-([0-9]{2})T([0-9]{2}):([0-9]{2}):([0-9]{2})(?:\.([0-9]{1,6}))?'
+                          r'(Z|[+-][0-9]{2}:[0-9]{2})?\Z')
+_MONTH_DAY_RE = re.compile(r'^([0-9]{2})-([0-9]{2})\Z')
+
+# Returned by the fast paths for strings they cannot handle
+_NOT_HANDLED = object()
+
+
 def get_string_as_valid_date_string(str_val, month_day_to_add_if_not_present=None):
     if str_val is None or not str_val:
         return None
@@ -233,6 +265,35 @@ def get_string_as_valid_date_string(str_val, month_day_to_add_if_not_present=Non
                 "Unable to understand month_day_to_add_if_not_present: {0}".format(month_day_to_add_if_not_present))
         exit(1)
 
+    output = _get_string_as_valid_date_string_fast(str_val)
+    if output is not _NOT_HANDLED:
+        return output
+    return _get_string_as_valid_date_string_with_dateutil(str_val, month_day_to_add_if_not_present)
+
+
+def _get_string_as_valid_date_string_fast(str_val):
+    """
+    Handle the common date string shapes with regular expressions only.
+
+    :return: same value as _get_string_as_valid_date_string_with_dateutil or _NOT_HANDLED
+    """
+    match = _DATE_RE.match(str_val)
+    if match:
+        try:
+            return date(int(match.group(1)), int(match.group(2)), int(match.group(3))).isoformat()
+        except ValueError:
+            return _NOT_HANDLED
+
+    # Only year, or contains time: neither can be converted to date without month and day
+    if _YEAR_RE.match(str_val) or _DATETIME_RE.match(str_val):
+        return None
+
+    return _NOT_HANDLED
+
+
+def _get_string_as_valid_date_string_with_dateutil(str_val, month_day_to_add_if_not_present=None):
+    from dateutil import parser
+
     # For cases e.g. 2010-01-1, 2010-1-01, 2010-1, 2010-1-1
     # Above example would be transformed into 2010-01-01
     if 4 < len(str_val) < 10:
@@ -290,6 +351,36 @@ def get_string_as_valid_datetime_string(str_val, month_day_to_add_if_not_present
     if str_val is None or not str_val:
         return None
 
+    _check_datetime_defaults(month_day_to_add_if_not_present, time_to_add_if_not_present)
+    return _normalize_datetime_string(str_val, month_day_to_add_if_not_present, time_to_add_if_not_present)
+
+
+def normalize_dates(values, month_day_default=None, time_default=None):
+    """
+    Convert a list of date strings to datetime strings accepted by Metax in one call. Works like calling
+    get_string_as_valid_datetime_string for each value, but the defaults are checked only once and each
+    distinct value is converted only once.
+
+    :param values: list of date strings, empty values and None are allowed
+    :param month_day_default: MM-DD to use for values having only the year
+    :param time_default: hh:mm:ss to use for values having no time
+    :return: list of datetime strings or None for values that could not be converted, in the order of values
+    """
+    _check_datetime_defaults(month_day_default, time_default)
+
+    converted = {}
+    output = []
+    for value in values:
+        if value is None or not value:
+            output.append(None)
+            continue
+        if value not in converted:
+            converted[value] = _normalize_datetime_string(value, month_day_default, time_default)
+        output.append(converted[value])
+    return output
+
+
+def _check_datetime_defaults(month_day_to_add_if_not_present, time_to_add_if_not_present):
     if time_to_add_if_not_present is not None:
         if '+' in time_to_add_if_not_present or '-' in time_to_add_if_not_present or 'Z' in time_to_add_if_not_present:
             log.debug("No timezone info allowed in time_to_add_if_not_present parameter: {0}".format(
@@ -305,6 +396,75 @@ def get_string_as_valid_datetime_string(str_val, month_day_to_add_if_not_present
                 "Unable to understand month_day_to_add_if_not_present: {0}".format(month_day_to_add_if_not_present))
             raise Exception
 
+
+def _normalize_datetime_string(str_val, month_day_to_add_if_not_present, time_to_add_if_not_present):
+    output = _get_string_as_valid_datetime_string_fast(str_val, month_day_to_add_if_not_present,
+                                                       time_to_add_if_not_present)
+    if output is not _NOT_HANDLED:
+        return output
+    return _get_string_as_valid_datetime_string_with_dateutil(str_val, month_day_to_add_if_not_present,
+                                                              time_to_add_if_not_present)
+
+
+def _get_string_as_valid_datetime_string_fast(str_val, month_day_to_add_if_not_present=None,
+                                              time_to_add_if_not_present=None):
+    """
+    Handle the common date and datetime string shapes with regular expressions only. Anything out of the
+    ordinary, eg. invalid dates or times, is left to dateutil.
+
+    :return: same value as _get_string_as_valid_datetime_string_with_dateutil or _NOT_HANDLED
+    """
+    match = _DATE_RE.match(str_val)
+    if match:
+        return _date_with_time(int(match.group(1)), int(match.group(2)), int(match.group(3)),
+                               time_to_add_if_not_present)
+
+    if _YEAR_RE.match(str_val):
+        if month_day_to_add_if_not_present is None:
+            return None
+        month_day = _MONTH_DAY_RE.match(month_day_to_add_if_not_present)
+        if not month_day:
+            return _NOT_HANDLED
+        return _date_with_time(int(str_val), int(month_day.group(1)), int(month_day.group(2)),
+                               time_to_add_if_not_present)
+
+    match = _DATETIME_RE.match(str_val)
+    if match:
+        year, month, day, hour, minute, second, fraction, tz = match.groups()
+        microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+        try:
+            datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), microsecond)
+        except ValueError:
+            return _NOT_HANDLED
+
+        output = year + '-' + month + '-' + day + 'T' + hour + ':' + minute + ':' + second
+        if microsecond:
+            output += '.%06d' % microsecond
+        if tz is None:
+            return output + '-00:00'
+        if tz == 'Z' or tz[1:] == '00:00':
+            return output + '+00:00'
+        if int(tz[1:3]) > 23 or int(tz[4:6]) > 59:
+            return _NOT_HANDLED
+        return output + tz
+
+    return _NOT_HANDLED
+
+
+def _date_with_time(year, month, day, time_to_add_if_not_present):
+    try:
+        date_as_valid_str = date(year, month, day).isoformat()
+    except ValueError:
+        return _NOT_HANDLED
+    if time_to_add_if_not_present is None:
+        return date_as_valid_str + 'T00:00:00-00:00'
+    return date_as_valid_str + 'T' + time_to_add_if_not_present + '-00:00'
+
+
+def _get_string_as_valid_datetime_string_with_dateutil(str_val, month_day_to_add_if_not_present=None,
+                                                       time_to_add_if_not_present=None):
+    from dateutil import parser
+
     # For cases e.g. 2010-01-1, 2010-1-01, 2010-1, 2010-1-1
     # Above example would be transformed into 2010-01-01
     if 4 < len(str_val) < 10:
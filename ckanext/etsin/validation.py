@@ -0,0 +1,87 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Validate refined research datasets locally before sending them to Metax
+"""
+
+import json
+import logging
+import os
+
+from ckanext.etsin.exceptions import ResearchDatasetInvalidError
+
+log = logging.getLogger(__name__)
+
+SCHEMA_FILE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'resources',
+                                'research_dataset_schema.json')
+
+_validator = None
+
+
+def _get_validator():
+    """
+    Load the research dataset schema and build its validator once per process. jsonschema is imported here,
+    so that importing the actions does not import it.
+    """
+    global _validator
+    if _validator is None:
+        from jsonschema import Draft4Validator
+        with open(SCHEMA_FILE_PATH, 'r') as f:
+            schema = json.load(f)
+        Draft4Validator.check_schema(schema)
+        _validator = Draft4Validator(schema)
+    return _validator
+
+
+def get_research_dataset_errors(research_dataset):
+    """
+    Validate a research dataset against the bundled Metax research dataset schema.
+
+    :param research_dataset: research dataset dictionary, as returned by refine
+    :return: list of error dictionaries with keys path and message, empty if the research dataset is valid
+    """
+    errors = []
+    for error in _get_validator().iter_errors(research_dataset):
+        for flat_error in _flatten_error(error):
+            errors.append({
+                'path': '/'.join(unicode(p) for p in flat_error.absolute_path),
+                'message': flat_error.message,
+            })
+    errors.sort(key=lambda e: e['path'])
+    return errors
+
+
+def validate_research_dataset(research_dataset):
+    """
+    Validate a research dataset against the bundled Metax research dataset schema.
+
+    :param research_dataset: research dataset dictionary, as returned by refine
+    :raises ResearchDatasetInvalidError: if the research dataset is not valid
+    """
+    errors = get_research_dataset_errors(research_dataset)
+    if errors:
+        raise ResearchDatasetInvalidError(research_dataset, errors)
+
+
+def _flatten_error(error):
+    """
+    Replace an error of an agent that failed every oneOf branch with the errors of the branch
+    matching the agent @type, since those are what needs fixing.
+    """
+    if not error.context:
+        return [error]
+
+    branches = {}
+    for sub_error in error.context:
+        branches.setdefault(sub_error.schema_path[0], []).append(sub_error)
+    matching = [sub_errors for sub_errors in branches.values()
+                if not any(list(e.relative_path) == ['@type'] for e in sub_errors)]
+    if len(matching) != 1:
+        return [error]
+
+    return [flat_error for sub_error in matching[0] for flat_error in _flatten_error(sub_error)]
@@ -81,6 +81,14 @@ setup(
     entry_points='''
         [ckan.plugins]
         etsin=ckanext.etsin.plugin:EtsinPlugin
+        [paste.paster_command]
+        etsin=ckanext.etsin.commands:EtsinCommand
+        [console_scripts]
+        etsin-map=ckanext.etsin.batch:main
+        [ckanext.etsin.refiners]
+        kielipankki=ckanext.etsin.refiners.kielipankki:kielipankki_refiner
+        syke=ckanext.etsin.refiners.syke:syke_refiner
+        fsd=ckanext.etsin.refiners.fsd:fsd_refiner
 	[babel.extractors]
 	ckan = ckan.lib.extract:extract_ckan
     ''',